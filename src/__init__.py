@@ -7,6 +7,7 @@ from .config import config
 from .observability import ObservabilityManager, traced_agent_operation, log_conversation
 from .safety import SafetyManager, ValidationStatus
 from .agents import TrackedAssistantAgent, MarketAnalysisTeam
+from .batch import BatchRunner, ProcessBatchRunner
 
 __version__ = "1.0.0"
 __author__ = "Agent Workflow Team"
@@ -19,5 +20,7 @@ __all__ = [
     "SafetyManager",
     "ValidationStatus", 
     "TrackedAssistantAgent",
-    "MarketAnalysisTeam"
+    "MarketAnalysisTeam",
+    "BatchRunner",
+    "ProcessBatchRunner"
 ] 
\ No newline at end of file
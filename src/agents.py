@@ -4,30 +4,316 @@ AutoGen Agent 系统
 """
 
 import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
 import time
-from typing import Dict, List, Any, Optional, Callable
+from concurrent.futures import Executor
+from typing import AsyncIterator, Dict, List, Any, Optional, Callable
 import autogen
-from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
+import openai
+from autogen import Agent, AssistantAgent, ConversableAgent, UserProxyAgent, GroupChat, GroupChatManager
 import json
 import logging
+import re
 from .config import config
-from .observability import traced_agent_operation, log_conversation
+from .observability import traced_agent_operation, log_conversation, set_span_attributes, add_span_event
+from .cache import LRUCache, canonicalize_query, get_response_cache
+from .ratelimit import rate_limiters, estimate_tokens
+from .retry import ErrorClass, classify_error, backoff_delay
+from .routing import model_config_entry, route_config_entry, route_stats, supports_streaming
+from .hedging import current_cancel_token, hedging, make_abortable
+from .pipeline import AgentPipeline, PipelineStep, decompose_query, speculation_stats
+from .streaming import AnalysisEvent, AnalysisEventType, emit_event, finish_turn, start_turn, stream_events, token_stream
 from .safety import output_validator, AgentOutput
 
 logger = logging.getLogger(__name__)
 
+# 同步 LLM 调用使用的线程池，未设置时使用事件循环的默认线程池（BatchRunner 运行期间设置为自己的线程池）
+llm_executor: contextvars.ContextVar[Optional[Executor]] = contextvars.ContextVar("llm_executor", default=None)
+
+# 跨团队共享的分析结果缓存和进行中的分析，键为规范化后的查询
+analysis_result_cache = LRUCache(
+    max_entries=config.cache.result_cache_max_entries,
+    ttl_seconds=config.cache.result_cache_ttl_seconds,
+)
+_inflight_analyses: Dict[str, asyncio.Future] = {}
+
 class TrackedAssistantAgent(AssistantAgent):
     """带追踪功能的 AssistantAgent"""
     
-    def __init__(self, name: str, **kwargs):
+    def __init__(self, name: str, route: Optional[str] = None, **kwargs):
         super().__init__(name, **kwargs)
         self.conversation_history = []
+        self.route = route or name  # 模型路由名称，用于按路由统计延迟和成本
+        self._abortable_clients = threading.local()
+        
+        # 替换默认的异步 LLM 回复函数，使线程池中的调用继承当前上下文（追踪 span、IOStream）
+        self.replace_reply_func(ConversableAgent.a_generate_oai_reply, TrackedAssistantAgent.a_generate_oai_reply)
     
     @traced_agent_operation("agent_generate_reply")
     def generate_reply(self, *args, **kwargs):
         """重写生成回复方法，添加追踪和验证"""
         
-        # 处理参数 - 兼容不同的调用方式
+        messages, sender = self._parse_reply_args(args, kwargs)
+        self._log_incoming_message(messages)
+        turn = start_turn(self.name)
+        
+        # 调用父类方法生成回复，可恢复的 LLM 错误已在 _call_llm 中重试，这里的异常直接抛出
+        try:
+            reply = super().generate_reply(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"{self.name} 生成回复失败: {e}")
+            finish_turn(turn, self.name, error=e)
+            raise
+        
+        self._record_reply(reply, sender)
+        finish_turn(turn, self.name, reply)
+        return reply
+    
+    @traced_agent_operation("agent_generate_reply")
+    async def a_generate_reply(self, *args, **kwargs):
+        """异步生成回复 - LLM 调用在线程池中执行，不阻塞事件循环"""
+        
+        messages, sender = self._parse_reply_args(args, kwargs)
+        self._log_incoming_message(messages)
+        turn = start_turn(self.name)
+        
+        try:
+            reply = await super().a_generate_reply(*args, **kwargs)
+        except asyncio.CancelledError:
+            # 例如推测执行的结果作废
+            finish_turn(turn, self.name, cancelled=True)
+            raise
+        except Exception as e:
+            logger.error(f"{self.name} 生成回复失败: {e}")
+            finish_turn(turn, self.name, error=e)
+            raise
+        
+        self._record_reply(reply, sender)
+        finish_turn(turn, self.name, reply)
+        return reply
+    
+    async def a_generate_oai_reply(self, messages=None, sender=None, config=None):
+        """在线程池中调用 LLM，并复制当前上下文，使缓存等属性记录在调用方的 span 上"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            llm_executor.get(),
+            functools.partial(context.run, self.generate_oai_reply, messages, sender, config),
+        )
+    
+    def _generate_oai_reply_from_client(self, llm_client, messages, cache):
+        """在 LLM 调用外包裹持久化响应缓存"""
+        response_cache = get_response_cache()
+        if response_cache is None:
+            return self._call_llm(llm_client, messages, cache)[0]
+        
+        _, model, temperature = self._llm_call_params(llm_client)
+        system_message = None
+        conversation = messages
+        if messages and messages[0].get("role") == "system":
+            system_message = messages[0].get("content")
+            conversation = messages[1:]
+        key = response_cache.make_key(model, temperature, system_message, conversation)
+        
+        cached = response_cache.get(key)
+        if cached is not None:
+            set_span_attributes({
+                "llm.cache.hit": True,
+                "llm.cache.saved_seconds": cached["latency"],
+            })
+            return cached["response"]
+        
+        start_time = time.time()
+        reply, answered_model = self._call_llm(llm_client, messages, cache)
+        latency = time.time() - start_time
+        set_span_attributes({
+            "llm.cache.hit": False,
+            "llm.latency_seconds": latency,
+        })
+        if reply is not None:
+            # 故障切换或对冲到备用模型时按实际回答的模型存储，避免之后作为主模型的回复返回
+            if answered_model != model:
+                key = response_cache.make_key(answered_model, temperature, system_message, conversation)
+            response_cache.set(key, reply, latency)
+        return reply
+    
+    def _call_llm(self, llm_client, messages, cache):
+        """调用 LLM，按错误分类重试，返回 (回复, 实际回答的模型)
+        
+        - 限流和临时错误（5xx、超时、连接错误）按带抖动的指数退避重试
+        - 主模型连续失败 failover_after_attempts 次后立即切换到备用模型
+        - 其他错误和重试次数用尽后直接抛出
+        """
+        client = llm_client
+        attempt = 0
+        backoff_seconds = 0.0
+        failed_over = False
+        try:
+            while True:
+                attempt += 1
+                try:
+                    return self._call_llm_hedged(client, messages, cache)
+                except Exception as e:
+                    error_class = classify_error(e)
+                    if error_class == ErrorClass.FATAL or attempt > config.llm.max_retries:
+                        raise
+                    
+                    if (not failed_over
+                            and attempt >= config.llm.failover_after_attempts
+                            and self.backup_client is not None):
+                        failed_over = True
+                        client = self.backup_client
+                        logger.warning(f"{self.name} 主模型第 {attempt} 次调用失败（{error_class.value}），切换到备用模型: {e}")
+                        add_span_event("llm.failover", {"model": config.llm.backup_model, "error": str(e)})
+                        continue
+                    
+                    delay = backoff_delay(attempt, e)
+                    backoff_seconds += delay
+                    logger.warning(f"{self.name} LLM 调用失败（{error_class.value}），{delay:.2f} 秒后第 {attempt} 次重试: {e}")
+                    time.sleep(delay)
+        finally:
+            set_span_attributes({
+                "llm.retry.count": attempt - 1,
+                "llm.retry.backoff_seconds": backoff_seconds,
+                "llm.failover": failed_over,
+            })
+    
+    def _call_llm_hedged(self, llm_client, messages, cache):
+        """启用对冲时，调用超过该模型的延迟分位数仍未返回则发出重复请求，先成功者胜出，返回 (回复, 模型)"""
+        if not config.hedging.enable_hedging:
+            return self._call_llm_once(llm_client, messages, cache)
+        
+        hedge_client = llm_client
+        if config.hedging.hedge_target == "backup" and self.backup_client is not None:
+            hedge_client = self.backup_client
+        _, model, _ = self._llm_call_params(llm_client)
+        return hedging.call(
+            model,
+            functools.partial(self._call_llm_once, llm_client, messages, cache),
+            # 对冲请求的输出不转为 token 事件，避免同一段内容出现两次
+            functools.partial(self._call_llm_once, hedge_client, messages, cache, stream_tokens=False),
+        )
+    
+    def _call_llm_once(self, llm_client, messages, cache, stream_tokens: bool = True):
+        """经过进程级共享限流器调用一次 LLM，并按路由记录延迟和估算成本，返回 (回复, 模型)
+        
+        流式分析或推测执行监听输出期间以流式请求调用 LLM，输出的内容实时送出。
+        作为对冲请求执行时使用可中断的客户端，落败被中断的调用同样计入限流器用量和路由统计。
+        """
+        provider, model, _ = self._llm_call_params(llm_client)
+        prompt_tokens = estimate_tokens(messages)
+        limiter = rate_limiters.get(provider, model)
+        reserved = prompt_tokens + config.rate_limit.completion_token_estimate
+        cancel_token = current_cancel_token()
+        if cancel_token is not None:
+            llm_client = self._abortable_client(llm_client, cancel_token)
+        
+        start_time = time.time()
+        try:
+            with token_stream(self.name, llm_client) if stream_tokens else contextlib.nullcontext(llm_client) as client:
+                if limiter is None:
+                    reply = super()._generate_oai_reply_from_client(client, messages, cache)
+                else:
+                    with limiter.limit(reserved):
+                        reply = super()._generate_oai_reply_from_client(client, messages, cache)
+        except Exception:
+            if cancel_token is not None and cancel_token.cancelled:
+                # 落败的请求已发出，输入 token 照常计费；中断前生成的内容无法得知，不计输出 token
+                if limiter is not None:
+                    limiter.record_usage(prompt_tokens, reserved)
+                route_stats.record(self.route, model, time.time() - start_time, prompt_tokens, 0, cancelled=True)
+            raise
+        latency = time.time() - start_time
+        
+        completion_tokens = estimate_tokens([{"content": str(reply or "")}])
+        if limiter is not None:
+            limiter.record_usage(prompt_tokens + completion_tokens, reserved)
+        cost = route_stats.record(self.route, model, latency, prompt_tokens, completion_tokens)
+        set_span_attributes({
+            "llm.route": self.route,
+            "llm.model": model,
+            "llm.estimated_cost_usd": cost,
+        })
+        return reply, model
+    
+    def _abortable_client(self, llm_client, cancel_token):
+        """当前线程专用的客户端副本，对冲请求落败时断开其 HTTP 连接
+        
+        副本只在对冲线程池的线程中使用，同一时间只执行一个请求，断开连接不影响其他调用；
+        被中断后在下次使用时重新创建。非 OpenAIWrapper 的客户端（如测试替身）原样返回。
+        """
+        if not isinstance(llm_client, autogen.OpenAIWrapper):
+            return llm_client
+        
+        clients = self._abortable_clients.__dict__
+        entry = clients.get(id(llm_client))
+        if entry is None or entry["aborted"].is_set():
+            if entry is not None:
+                entry["http_client"].close()
+            http_client = openai.DefaultHttpxClient()
+            base_config = {k: v for k, v in (self.llm_config or {}).items() if k != "config_list"}
+            config_list = [{**e, "http_client": http_client} for e in self._client_config_list(llm_client)]
+            entry = clients[id(llm_client)] = {
+                "client": autogen.OpenAIWrapper(config_list=config_list, **base_config),
+                "http_client": http_client,
+                "abort": make_abortable(http_client),
+                "aborted": threading.Event(),
+            }
+        
+        def abort() -> None:
+            entry["aborted"].set()
+            entry["abort"]()
+        
+        cancel_token.on_cancel(abort)
+        return entry["client"]
+    
+    def _client_config_list(self, llm_client) -> List[Dict[str, Any]]:
+        """创建客户端时使用的 config_list（OpenAIWrapper 不保留 api_key 等连接参数）"""
+        if llm_client is self.__dict__.get("backup_client"):
+            return self._backup_config_list
+        return (self.llm_config or {}).get("config_list", [])
+    
+    @functools.cached_property
+    def backup_client(self) -> Optional[autogen.OpenAIWrapper]:
+        """故障切换客户端：路由到备用模型的 Agent 切换到默认模型，其余切换到备用模型
+        
+        未配置备用模型或缺少对应密钥时为 None。
+        """
+        primary = self._llm_call_params(self.client)[1]
+        model = config.llm.default_model if primary == config.llm.backup_model else config.llm.backup_model
+        if not model or model == primary:
+            return None
+        entry = model_config_entry(model)
+        if entry is None:
+            logger.warning(f"故障切换模型 {model} 缺少 API 密钥或依赖，不启用故障切换")
+            return None
+        
+        base_config = {k: v for k, v in (self.llm_config or {}).items() if k != "config_list"}
+        self._backup_config_list = [entry]
+        try:
+            return autogen.OpenAIWrapper(config_list=[entry], **base_config)
+        except Exception as e:
+            logger.warning(f"创建故障切换模型 {model} 客户端失败，不启用故障切换: {e}")
+            return None
+    
+    def _llm_call_params(self, llm_client):
+        """获取本次调用使用的 provider、模型和温度"""
+        llm_config = self.llm_config or {}
+        config_list = getattr(llm_client, "_config_list", None) or llm_config.get("config_list") or [{}]
+        provider = config_list[0].get("api_type", "openai")
+        model = config_list[0].get("model")
+        temperature = config_list[0].get("temperature", llm_config.get("temperature"))
+        return provider, model, temperature
+    
+    def supports_streaming(self) -> bool:
+        """当前路由的模型客户端能否流式输出（token 事件和推测执行都依赖流式输出）"""
+        return supports_streaming(self._llm_call_params(self.client)[0])
+    
+    @staticmethod
+    def _parse_reply_args(args: tuple, kwargs: dict):
+        """处理参数 - 兼容不同的调用方式"""
         messages = None
         sender = None
         
@@ -43,7 +329,10 @@ class TrackedAssistantAgent(AssistantAgent):
         if 'sender' in kwargs:
             sender = kwargs['sender']
         
-        # 记录输入
+        return messages, sender
+    
+    def _log_incoming_message(self, messages) -> None:
+        """记录输入"""
         try:
             if messages:
                 if isinstance(messages, list) and messages:
@@ -58,29 +347,19 @@ class TrackedAssistantAgent(AssistantAgent):
                 )
         except Exception as e:
             logger.warning(f"记录输入消息时出错: {e}")
-        
-        # 调用父类方法生成回复
-        try:
-            # 使用原始参数调用父类方法
-            reply = super().generate_reply(*args, **kwargs)
-        except Exception as e:
-            logger.error(f"调用父类generate_reply时出错: {e}")
-            logger.error(f"参数: args={args}, kwargs={kwargs}")
-            # 返回一个默认回复而不是抛出异常
-            return "抱歉，我在处理您的请求时遇到了技术问题。"
-        
-        # 记录输出
+    
+    def _record_reply(self, reply, sender) -> None:
+        """记录输出并存储对话历史"""
         try:
             log_conversation(
                 self.name,
                 str(reply),
                 "assistant",
-                {"sender": sender.name if sender and hasattr(sender, 'name') else "unknown"}
+                sender=sender.name if sender and hasattr(sender, 'name') else "unknown"
             )
         except Exception as e:
             logger.warning(f"记录输出消息时出错: {e}")
         
-        # 存储对话历史
         try:
             self.conversation_history.append({
                 "role": "assistant",
@@ -89,16 +368,93 @@ class TrackedAssistantAgent(AssistantAgent):
             })
         except Exception as e:
             logger.warning(f"无法记录对话历史: {e}")
-        
-        return reply
+    
+    def reset(self):
+        """重置 Agent 状态，同时清空追踪的对话历史"""
+        super().reset()
+        self.conversation_history.clear()
+
+# 最终报告必须包含的章节，BusinessWriter 给出包含全部章节的报告后群聊即可结束
+REPORT_SECTIONS = ["执行摘要", "市场环境分析", "战略建议", "风险评估", "下一步行动计划"]
+REPORT_WRITER_NAME = "BusinessWriter"
+
+# 章节名开头的行：前面只允许出现 Markdown 标题符号、列表符号和编号（用于去掉正文开头重复的章节标题）
+_SECTION_PATTERNS = [
+    re.compile(rf"^[\s#*>\-\d.、()（）一二三四五六七八九十]*{section}", re.MULTILINE)
+    for section in REPORT_SECTIONS
+]
+# 章节标题：Markdown 标题（## 执行摘要）或加粗（**1. 执行摘要**），不接受列表项形式的提纲
+_SECTION_HEADINGS = [
+    re.compile(rf"^[ \t]*(#{{1,6}}[ \t]*|\*\*)[ \t\d.、()（）一二三四五六七八九十]*{section}.*$", re.MULTILINE)
+    for section in REPORT_SECTIONS
+]
+# 每个章节标题下至少应有的正文字数（不含空白），只有章节标题的提纲不算完整报告
+MIN_SECTION_BODY_CHARS = 20
+
+def is_report_complete(message: Any) -> bool:
+    """判断消息是否为 BusinessWriter 给出的完整报告（不调用 LLM）
+    
+    报告必须以标题形式包含全部章节，且每个章节下都有正文。
+    """
+    if not isinstance(message, dict) or message.get("name") != REPORT_WRITER_NAME:
+        return False
+    content = message.get("content")
+    if not isinstance(content, str):
+        return False
+    
+    headings = [pattern.search(content) for pattern in _SECTION_HEADINGS]
+    if not all(headings):
+        return False
+    # 章节正文为标题行之后到下一个章节标题之前的内容，章节内部的小标题计入正文
+    for heading in headings:
+        following = [other.start() for other in headings if other.start() > heading.start()]
+        body = content[heading.end():min(following, default=len(content))]
+        if len("".join(body.split())) < MIN_SECTION_BODY_CHARS:
+            return False
+    return True
+
+def _strip_section_heading(content: str, pattern: re.Pattern) -> str:
+    """去掉模型在章节正文开头重复输出的章节标题"""
+    content = content.strip()
+    first_line, _, rest = content.partition("\n")
+    if pattern.match(first_line) and len(first_line) <= 40:
+        return rest.strip()
+    return content
+
+def _escape_template(text: str) -> str:
+    """转义花括号，使文本可以安全地放入 str.format 模板"""
+    return text.replace("{", "{{").replace("}", "}}")
 
 class EnhancedGroupChatManager(GroupChatManager):
     """增强的群聊管理器，集成安全验证"""
     
     def __init__(self, groupchat: GroupChat, **kwargs):
+        if config.agent.enable_early_termination:
+            # 报告完整后立即结束群聊，不再轮询其余 Agent
+            kwargs.setdefault("is_termination_msg", EnhancedGroupChatManager._is_report_complete)
         super().__init__(groupchat, **kwargs)
         self.round_count = 0
         self.validation_enabled = True
+        
+        # AutoGen 以类函数 GroupChatManager.run_chat 注册回复函数，
+        # 需要重新注册才能让下面的重写生效（后注册的优先匹配）
+        self.register_reply(Agent, EnhancedGroupChatManager.run_chat, config=groupchat, reset_config=GroupChat.reset)
+        self.register_reply(
+            Agent,
+            EnhancedGroupChatManager.a_run_chat,
+            config=groupchat,
+            reset_config=GroupChat.reset,
+            ignore_async_in_sync_chat=True,
+        )
+    
+    @staticmethod
+    def _is_report_complete(message: Dict) -> bool:
+        """群聊终止条件：检测到完整报告时记录提前结束"""
+        if not is_report_complete(message):
+            return False
+        log_conversation("GroupChatManager", "报告已包含全部章节，提前结束群聊", "system")
+        set_span_attributes({"group_chat.early_termination": True})
+        return True
     
     @traced_agent_operation("group_chat_coordination")
     def run_chat(self, *args, **kwargs):
@@ -120,6 +476,32 @@ class EnhancedGroupChatManager(GroupChatManager):
         )
         
         return result
+    
+    @traced_agent_operation("group_chat_coordination")
+    async def a_run_chat(self, *args, **kwargs):
+        """异步群聊执行，添加协调追踪"""
+        
+        self.round_count += 1
+        log_conversation(
+            "GroupChatManager",
+            f"开始第 {self.round_count} 轮群聊协调",
+            "system"
+        )
+        
+        result = await super().a_run_chat(*args, **kwargs)
+        
+        log_conversation(
+            "GroupChatManager",
+            f"第 {self.round_count} 轮群聊完成",
+            "system"
+        )
+        
+        return result
+    
+    def reset(self):
+        """重置管理器状态和轮次计数"""
+        super().reset()
+        self.round_count = 0
 
 class MarketAnalysisTeam:
     """市场分析团队 - 展示 AutoGen 对话驱动架构"""
@@ -129,21 +511,23 @@ class MarketAnalysisTeam:
         self.agents = {}
         self.group_chat = None
         self.manager = None
+        self._speculation_warned = False
         self._setup_agents()
         self._setup_group_chat()
     
-    def _build_llm_config(self) -> Dict[str, Any]:
-        """构建 LLM 配置"""
-        return {
-            "config_list": [
-                {
-                    "model": config.llm.default_model,
-                    "api_key": config.llm.openai_api_key,
-                }
-            ],
+    def _build_llm_config(self, route: Optional[str] = None) -> Dict[str, Any]:
+        """构建 LLM 配置，route 指定时按 config.routing 选择该角色的模型"""
+        llm_config = {
+            "config_list": [route_config_entry(route)],
             "timeout": config.llm.request_timeout,
             "temperature": 0.1,
+            # 重试由 TrackedAssistantAgent 按错误分类统一处理，关闭 SDK 内部重试以免叠加
+            "max_retries": 0,
         }
+        if config.cache.enable_llm_cache:
+            # 响应由 ResponseCache 缓存，关闭 AutoGen 内置的磁盘缓存以免重复存储
+            llm_config["cache_seed"] = None
+        return llm_config
     
     @traced_agent_operation("setup_agents")
     def _setup_agents(self):
@@ -170,7 +554,8 @@ class MarketAnalysisTeam:
 - 质疑不准确的市场假设
 
 请始终提供具体的数据和来源，避免泛泛而谈。""",
-            llm_config=self.llm_config,
+            llm_config=self._build_llm_config("researcher"),
+            route="researcher",
         )
         
         # 2. 战略分析师 - 负责战略规划和风险评估
@@ -194,7 +579,8 @@ class MarketAnalysisTeam:
 - 关注实施可行性
 
 请使用结构化的分析框架，提供可执行的战略建议。""",
-            llm_config=self.llm_config,
+            llm_config=self._build_llm_config("analyst"),
+            route="analyst",
         )
         
         # 3. 商业写作专家 - 负责整合信息并撰写报告
@@ -218,7 +604,8 @@ class MarketAnalysisTeam:
 - 根据反馈迭代改进
 
 请确保最终输出为结构化的、可操作的商业文档。""",
-            llm_config=self.llm_config,
+            llm_config=self._build_llm_config("writer"),
+            route="writer",
         )
         
         # 4. 用户代理 - 代表用户参与对话
@@ -234,6 +621,14 @@ class MarketAnalysisTeam:
             max_consecutive_auto_reply=1,
             code_execution_config=False,
         )
+        
+        # 报告修正使用与写作专家相同的角色设定，但走独立路由（默认为低成本模型），不参与群聊
+        self.corrector = TrackedAssistantAgent(
+            name="ReportCorrector",
+            system_message=self.agents["writer"].system_message,
+            llm_config=self._build_llm_config("correction"),
+            route="correction",
+        )
     
     @traced_agent_operation("setup_group_chat")
     def _setup_group_chat(self):
@@ -252,9 +647,229 @@ class MarketAnalysisTeam:
             llm_config=self.llm_config,
         )
     
+    def build_pipeline(self, query: str) -> AgentPipeline:
+        """流水线模式的工作流：研究 -> 分析 -> 写作
+        
+        research_fanout_width 大于 1 时将查询拆分为多个子问题，由研究员并发研究，
+        各分支的结果合并后交给战略分析师。parallel_report_sections 开启时，报告正文各章节并发撰写，
+        执行摘要最后根据正文撰写。enable_speculative_analysis 开启时，研究员按固定结构输出，
+        数据部分完成后即推测启动战略分析师。
+        """
+        speculative = config.agent.enable_speculative_analysis
+        if speculative and not self.agents["researcher"].supports_streaming():
+            # 非流式客户端只在调用结束时返回完整结果，就绪点永远不会提前出现
+            if not self._speculation_warned:
+                logger.warning("研究员路由的模型不支持流式输出，跳过推测执行")
+                self._speculation_warned = True
+            speculative = False
+        # 推测执行依赖研究输出的结构：数据部分在前，之后的章节标题即为就绪点
+        structure = """
+
+请按以下结构输出：先在「## 市场数据」部分给出关键数据和来源，再依次给出「## 趋势分析」和「## 竞争环境」。""" if speculative else ""
+        partial_ready = config.agent.speculation_trigger if speculative else None
+        sub_questions = decompose_query(query, config.agent.research_fanout_width)
+        if len(sub_questions) > 1:
+            research_steps = [
+                PipelineStep(
+                    name=f"research_{i}",
+                    agent="researcher",
+                    prompt=f"""🎯 **市场研究子任务**
+
+**总体问题:** {{query}}
+
+**子问题:** {_escape_template(question)}
+
+请聚焦该子问题，提供相关的市场数据、趋势和竞争环境分析。{structure}""",
+                    partial_ready=partial_ready,
+                )
+                for i, question in enumerate(sub_questions, 1)
+            ]
+            research = "\n\n".join(
+                f"#### {_escape_template(question)}\n{{research_{i}}}"
+                for i, question in enumerate(sub_questions, 1)
+            )
+        else:
+            research_steps = [
+                PipelineStep(
+                    name="research",
+                    agent="researcher",
+                    prompt="""🎯 **市场分析任务**
+
+**问题:** {query}
+
+请提供相关的市场数据、趋势和竞争环境分析。""" + structure,
+                    partial_ready=partial_ready,
+                )
+            ]
+            research = "{research}"
+        research_names = [step.name for step in research_steps]
+        context = f"""🎯 **市场分析任务**
+
+**问题:** {{query}}
+
+**MarketResearcher 的研究结果:**
+{research}
+
+**StrategyAnalyst 的战略分析:**
+{{analysis}}"""
+        
+        analysis_step = PipelineStep(
+            name="analysis",
+            agent="analyst",
+            depends_on=research_names,
+            speculative=speculative,
+            prompt=f"""🎯 **市场分析任务**
+
+**问题:** {{query}}
+
+**MarketResearcher 的研究结果:**
+{research}
+
+请基于研究结果进行战略分析，识别机会和风险。""",
+        )
+        
+        if not config.agent.parallel_report_sections:
+            sections = "\n".join(f"- {section}" for section in REPORT_SECTIONS)
+            return AgentPipeline(research_steps + [
+                analysis_step,
+                PipelineStep(
+                    name="report",
+                    agent="writer",
+                    depends_on=research_names + ["analysis"],
+                    prompt=f"""{context}
+
+请综合以上观点撰写结构化的分析报告，报告必须包含以下章节：
+{sections}""",
+                ),
+            ])
+        
+        # 正文各章节基于相同的研究和分析结果并发撰写，执行摘要在各章节完成后根据正文撰写
+        section_steps = [
+            PipelineStep(
+                name=f"section_{i}",
+                agent="writer",
+                depends_on=research_names + ["analysis"],
+                prompt=f"""{context}
+
+**撰写章节:** {section}
+
+请综合以上观点撰写分析报告中的「{section}」章节，只输出该章节的正文，不要包含章节标题和其他章节的内容。""",
+            )
+            for i, section in enumerate(REPORT_SECTIONS[1:], 1)
+        ]
+        body = "\n\n".join(
+            f"## {section}\n{{section_{i}}}" for i, section in enumerate(REPORT_SECTIONS[1:], 1)
+        )
+        summary_step = PipelineStep(
+            name="summary",
+            agent="writer",
+            depends_on=[step.name for step in section_steps],
+            prompt=f"""🎯 **市场分析任务**
+
+**问题:** {{query}}
+
+**报告正文:**
+{body}
+
+**撰写章节:** {REPORT_SECTIONS[0]}
+
+请根据以上报告正文撰写「{REPORT_SECTIONS[0]}」章节，概括关键发现和核心建议，只输出该章节的正文，不要包含章节标题。""",
+        )
+        return AgentPipeline(research_steps + [analysis_step] + section_steps + [summary_step])
+    
+    @staticmethod
+    def _assemble_report(outputs: Dict[str, str]) -> str:
+        """流水线输出转换为最终报告，分章节生成时按固定顺序拼接各章节"""
+        if "report" in outputs:
+            return outputs["report"]
+        contents = [outputs["summary"]] + [outputs[f"section_{i}"] for i in range(1, len(REPORT_SECTIONS))]
+        return "\n\n".join(
+            f"## {section}\n\n{_strip_section_heading(content, pattern)}"
+            for section, pattern, content in zip(REPORT_SECTIONS, _SECTION_PATTERNS, contents)
+        )
+    
+    def reset(self):
+        """重置对话状态，保留已创建的 Agent 对象以便复用
+        
+        清空群聊消息、各 Agent 的内部聊天记录、自动回复计数和追踪的对话历史，
+        使下一次分析从干净的上下文开始，提示词长度不随查询次数增长。
+        """
+        self.group_chat.reset()
+        self.manager.reset()
+        for agent in self.agents.values():
+            agent.reset()
+        self.corrector.reset()
+    
     @traced_agent_operation("market_analysis_workflow")
-    async def analyze_market(self, query: str) -> Optional[AgentOutput]:
-        """执行市场分析工作流"""
+    async def analyze_market(self, query: str, reset_state: bool = True) -> Optional[AgentOutput]:
+        """执行市场分析工作流
+        
+        查询规范化后先查找结果缓存；相同查询正在其他团队中分析时等待其结果，
+        而不是再启动一次群聊。
+        
+        Args:
+            query: 市场分析查询
+            reset_state: 是否在新的对话作用域中执行（默认开启）。
+                关闭时保留上一次分析的对话上下文，此时不使用结果缓存。
+        """
+        
+        if not reset_state or not config.cache.enable_result_cache:
+            return await self._run_analysis(query, reset_state)
+        
+        key = canonicalize_query(query)
+        cached = analysis_result_cache.get(key)
+        if cached is not None:
+            set_span_attributes({"analysis.cache.hit": True})
+            log_conversation("MarketAnalysisTeam", f"命中分析结果缓存: {query}", "system")
+            return cached.model_copy(deep=True)
+        
+        loop = asyncio.get_running_loop()
+        inflight = _inflight_analyses.get(key)
+        if inflight is not None and inflight.get_loop() is loop:
+            set_span_attributes({"analysis.cache.hit": False, "analysis.coalesced": True})
+            log_conversation("MarketAnalysisTeam", f"等待进行中的相同分析: {query}", "system")
+            await asyncio.wait([inflight])
+            # 进行中的分析被取消时自行执行
+            if not inflight.cancelled():
+                result = inflight.result()
+                return result.model_copy(deep=True) if result is not None else None
+        
+        set_span_attributes({"analysis.cache.hit": False, "analysis.coalesced": False})
+        future = loop.create_future()
+        _inflight_analyses[key] = future
+        try:
+            result = await self._run_analysis(query, reset_state)
+            if result is not None:
+                analysis_result_cache.set(key, result.model_copy(deep=True))
+            future.set_result(result)
+            return result
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            if _inflight_analyses.get(key) is future:
+                del _inflight_analyses[key]
+    
+    async def analyze_market_stream(self, query: str, reset_state: bool = True) -> AsyncIterator[AnalysisEvent]:
+        """流式执行市场分析，按发生顺序产出事件
+        
+        依次产出各 Agent 的 turn_started、token（LLM 流式输出的增量）和 turn_finished 事件，
+        验证完成后产出 validation 事件，最后产出携带结果的 final 事件。命中结果缓存或合并到
+        进行中的相同分析时只产出 final 事件。token 事件仅用于实时展示：LLM 调用重试时已送出的
+        token 不会撤回，发言内容以 turn_finished 事件为准。
+        
+        Args:
+            query: 市场分析查询
+            reset_state: 同 analyze_market
+        """
+        async for event in stream_events(self.analyze_market(query, reset_state)):
+            yield event
+    
+    async def _run_analysis(self, query: str, reset_state: bool) -> Optional[AgentOutput]:
+        """运行一次完整的分析（群聊或流水线）并验证输出"""
+        
+        if reset_state:
+            self.reset()
         
         log_conversation(
             "MarketAnalysisTeam",
@@ -263,8 +878,42 @@ class MarketAnalysisTeam:
         )
         
         try:
-            # 构建初始提示，明确任务和协作期望
-            initial_prompt = f"""
+            # 按 execution_mode 选择执行引擎
+            if config.agent.execution_mode == "pipeline":
+                run = self._run_pipeline(query)
+            else:
+                run = self._run_group_chat(query)
+            final_message = await asyncio.wait_for(run, timeout=config.agent.analysis_timeout)
+            
+            # 验证和后处理输出
+            if final_message:
+                validated_output = await output_validator.validate_with_correction(
+                    final_message,
+                    "MarketAnalysisTeam",
+                    correction_callback=self._correction_callback
+                )
+                emit_event(
+                    AnalysisEventType.VALIDATION,
+                    agent="Validator",
+                    content="验证通过" if validated_output is not None else "验证失败",
+                    metadata={"passed": validated_output is not None},
+                )
+                return validated_output
+            else:
+                logger.error("分析没有产生有效的最终结果")
+                return None
+        
+        except asyncio.TimeoutError:
+            logger.error(f"市场分析超时 ({config.agent.analysis_timeout} 秒)")
+            return None
+        except Exception as e:
+            logger.error(f"市场分析执行失败: {e}")
+            return None
+    
+    async def _run_group_chat(self, query: str) -> str:
+        """通过群聊管理器协调各 Agent，返回最终消息"""
+        # 构建初始提示，明确任务和协作期望
+        initial_prompt = f"""
 🎯 **市场分析任务**
 
 **问题:** {query}
@@ -283,51 +932,46 @@ class MarketAnalysisTeam:
 
 请开始协作！
 """
+        
+        # 启动群聊 - 使用异步入口，LLM 调用在线程池中执行，事件循环可继续调度其他协程
+        # 一次群聊即完成全部协作（轮数由 GroupChat.max_round 控制），不再由用户代理发起新一轮
+        result = await self.agents["user_proxy"].a_initiate_chat(
+            self.manager,
+            message=initial_prompt,
+            max_turns=1
+        )
+        
+        # 提取最后一个助手的回复作为最终结果
+        final_message = ""
+        try:
+            # 群聊因完整报告提前结束时，报告不会再广播给用户代理，直接从群聊消息中取
+            last_group_msg = self.group_chat.messages[-1] if self.group_chat.messages else None
+            if config.agent.enable_early_termination and is_report_complete(last_group_msg):
+                final_message = last_group_msg["content"]
+            elif hasattr(result, 'chat_history') and result.chat_history:
+                final_message = result.chat_history[-1].get("content", "")
+            elif isinstance(result, str):
+                final_message = result
+            elif isinstance(result, dict) and "content" in result:
+                final_message = result["content"]
             
-            # 启动群聊
-            result = self.agents["user_proxy"].initiate_chat(
-                self.manager,
-                message=initial_prompt,
-                max_turns=config.agent.max_round
-            )
-            
-            # 提取最后一个助手的回复作为最终结果
-            final_message = ""
-            try:
-                if hasattr(result, 'chat_history') and result.chat_history:
-                    final_message = result.chat_history[-1].get("content", "")
-                elif isinstance(result, str):
-                    final_message = result
-                elif isinstance(result, dict) and "content" in result:
-                    final_message = result["content"]
-                
-                if not final_message:
-                    # 从群聊消息中获取最后的回复
-                    if self.group_chat.messages:
-                        last_msg = self.group_chat.messages[-1]
-                        if isinstance(last_msg, dict):
-                            final_message = last_msg.get("content", "")
-                        else:
-                            final_message = str(last_msg)
-            except Exception as e:
-                logger.error(f"提取最终消息时出错: {e}")
-                final_message = "系统生成了回复，但提取时出现问题"
-            
-            # 验证和后处理输出
-            if final_message:
-                validated_output = await output_validator.validate_with_correction(
-                    final_message,
-                    "MarketAnalysisTeam",
-                    correction_callback=self._correction_callback
-                )
-                return validated_output
-            else:
-                logger.error("群聊没有产生有效的最终结果")
-                return None
-                
+            if not final_message:
+                # 从群聊消息中获取最后的回复
+                if self.group_chat.messages:
+                    last_msg = self.group_chat.messages[-1]
+                    if isinstance(last_msg, dict):
+                        final_message = last_msg.get("content", "")
+                    else:
+                        final_message = str(last_msg)
         except Exception as e:
-            logger.error(f"市场分析执行失败: {e}")
-            return None
+            logger.error(f"提取最终消息时出错: {e}")
+            final_message = "系统生成了回复，但提取时出现问题"
+        return final_message
+    
+    async def _run_pipeline(self, query: str) -> str:
+        """按 研究 -> 分析 -> 写作 流水线执行，返回报告"""
+        outputs = await self.build_pipeline(query).run(self.agents, query)
+        return self._assemble_report(outputs)
     
     async def _correction_callback(self, invalid_output: str, error_reason: str) -> str:
         """自修复回调函数"""
@@ -348,10 +992,10 @@ class MarketAnalysisTeam:
 """
         
         try:
-            # 让写作专家进行修正
+            # 由修正 Agent 按写作专家的角色设定进行修正
             # 需要将prompt包装为消息格式
             messages = [{"role": "user", "content": correction_prompt}]
-            corrected = self.agents["writer"].generate_reply(
+            corrected = await self.corrector.a_generate_reply(
                 messages=messages,
                 sender=None
             )
@@ -366,7 +1010,10 @@ class MarketAnalysisTeam:
             "total_rounds": self.manager.round_count if self.manager else 0,
             "participants": list(self.agents.keys()),
             "message_count": len(self.group_chat.messages) if self.group_chat else 0,
-            "agent_contributions": {}
+            "agent_contributions": {},
+            "model_routes": route_stats.get_stats(),
+            "hedging": hedging.get_stats(),
+            "speculation": speculation_stats.get_stats(),
         }
         
         # 统计每个Agent的贡献
@@ -0,0 +1,641 @@
+"""
+批量执行模块
+在有界并发下批量运行市场分析任务
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, Tuple, Iterable, Iterator
+from .agents import MarketAnalysisTeam, create_market_analysis_team, llm_executor
+from .observability import observability, log_conversation
+from .safety import AgentOutput
+
+logger = logging.getLogger(__name__)
+
+def build_result_record(query: str, result: Optional[AgentOutput]) -> Dict[str, Any]:
+    """将单个查询的分析结果转换为可序列化的记录"""
+    if result:
+        return {
+            "query": query,
+            "result": {
+                "content": result.content,
+                "confidence": result.confidence,
+                "agent_name": result.agent_name,
+                "metadata": result.metadata,
+                "sources": result.sources
+            },
+            "status": "success"
+        }
+    return {
+        "query": query,
+        "result": None,
+        "status": "failed"
+    }
+
+def _coerce_query(item: Any) -> str:
+    """查询项可以是字符串，或包含 query 字段的对象"""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict) and isinstance(item.get("query"), str):
+        return item["query"]
+    raise ValueError(f"无法识别的查询项: {str(item)[:100]}")
+
+def _iter_json_array(f, chunk_size: int) -> Iterator[Any]:
+    """增量解析 JSON 数组，逐个产生元素，缓冲区只保存尚未解析完的部分"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+
+    while not eof:
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ',')):
+                pos += 1
+            if pos >= len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("查询文件必须是 JSON 数组")
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break  # 元素尚未读完整，继续读取
+
+            # 位于缓冲区末尾的数字等可能被截断，等待更多数据再确认
+            if end >= len(buffer) and not eof:
+                break
+
+            yield value
+            pos = end
+
+        buffer = buffer[pos:]
+
+    raise ValueError("查询文件中的 JSON 数组不完整")
+
+def iter_query_file(path: str, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """按需读取查询文件
+
+    支持两种格式：
+    - .jsonl: 每行一个 JSON 字符串或 {"query": ...} 对象
+    - .json: 查询数组，增量解析，不会一次性载入整个文件
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield _coerce_query(json.loads(line))
+                except (json.JSONDecodeError, ValueError) as e:
+                    raise ValueError(f"{path} 第 {line_no} 行无效: {e}") from e
+        else:
+            for item in _iter_json_array(f, chunk_size):
+                yield _coerce_query(item)
+
+def iter_pending(queries: Iterable[str],
+                 skip: Optional[Dict[int, str]] = None) -> Iterator[Tuple[int, str]]:
+    """按输入顺序产生 (序号, 查询)，跳过已在 skip 中完成的同序号同内容查询"""
+    for index, query in enumerate(queries):
+        if skip and skip.get(index) == query:
+            continue
+        yield index, query
+
+class JsonlResultWriter:
+    """JSONL 结果写入器 - 每完成一个查询立即追加一行并刷新到磁盘
+
+    记录按完成顺序写入，并带有 index 字段标识其在输入中的位置。
+    断点续跑时失败的查询会重新执行并追加新记录，因此同一 index 可能对应多行，
+    以文件中最后一行为准（读取时使用 load_latest_records）。
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self._file = None
+
+    def open(self) -> "JsonlResultWriter":
+        """以追加模式打开文件，修复上次中断时未写完的最后一行"""
+        needs_newline = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if needs_newline:
+            self._file.write("\n")
+        return self
+
+    def write(self, index: int, record: Dict[str, Any]) -> None:
+        """追加一条结果记录"""
+        self._file.write(json.dumps({"index": index, **record}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "JsonlResultWriter":
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+def load_latest_records(path: str) -> Dict[int, Dict[str, Any]]:
+    """读取 JSONL 输出，返回每个序号的最新记录 {序号: 记录}
+
+    同一序号出现多次时（续跑时重新执行了失败的查询）以最后一行为准。
+    损坏或不完整的行（例如进程崩溃时写了一半）会被跳过。
+    """
+    records: Dict[int, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return records
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"跳过 {path} 第 {line_no} 行的不完整记录")
+                continue
+
+            if "index" in record:
+                records[record["index"]] = record
+
+    return records
+
+def load_completed_results(path: str) -> Dict[int, str]:
+    """读取已有 JSONL 输出中成功完成的查询，返回 {序号: 查询}（用于断点续跑）
+
+    每个序号只看最后一行记录，最新记录为失败时该查询会被重新执行。
+    """
+    return {
+        index: record.get("query")
+        for index, record in load_latest_records(path).items()
+        if record.get("status") == "success"
+    }
+
+class BatchRunner:
+    """批量分析执行器 - 使用信号量限制同时进行的分析数量
+
+    每个进行中的查询独占一个 MarketAnalysisTeam，团队在查询结束后归还到空闲池，
+    因此同时存在的团队数量不会超过并发度。
+    """
+
+    def __init__(self,
+                 concurrency: int = 1,
+                 team_factory: Callable[[], MarketAnalysisTeam] = create_market_analysis_team,
+                 teams: Optional[List[MarketAnalysisTeam]] = None):
+        if concurrency < 1:
+            raise ValueError("concurrency 必须大于等于 1")
+
+        self.concurrency = concurrency
+        self.team_factory = team_factory
+        self._idle_teams: List[MarketAnalysisTeam] = list(teams or [])
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _acquire_team(self) -> MarketAnalysisTeam:
+        """取出一个空闲团队，没有时按需创建"""
+        if self._idle_teams:
+            return self._idle_teams.pop()
+        return self.team_factory()
+
+    def _release_team(self, team: MarketAnalysisTeam) -> None:
+        """归还团队到空闲池"""
+        self._idle_teams.append(team)
+
+    async def _run_one(self,
+                       index: int,
+                       query: str,
+                       on_start: Optional[Callable[[int, str], None]],
+                       on_complete: Optional[Callable[[int, Dict[str, Any]], None]]) -> Dict[str, Any]:
+        """在信号量保护下执行单个查询"""
+        async with self._semaphore:
+            if on_start:
+                on_start(index, query)
+
+            team = self._acquire_team()
+            try:
+                result = await team.analyze_market(query)
+            except Exception as e:
+                logger.error(f"查询 {index + 1} 执行异常: {e}")
+                result = None
+            finally:
+                self._release_team(team)
+
+        record = build_result_record(query, result)
+        if on_complete:
+            on_complete(index, record)
+        return record
+
+    def _prepare(self) -> ThreadPoolExecutor:
+        """在当前事件循环中准备信号量，并创建本次运行专用的线程池"""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        # AutoGen 的异步回复在线程池中执行同步 LLM 调用，线程数需覆盖并发度；
+        # 使用自有线程池而不是修改调用方事件循环的默认线程池
+        return ThreadPoolExecutor(max_workers=self.concurrency + 4, thread_name_prefix="llm")
+
+    async def run(self,
+                  queries: Iterable[str],
+                  on_start: Optional[Callable[[int, str], None]] = None,
+                  on_complete: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                  skip: Optional[Dict[int, str]] = None,
+                  collect: bool = True) -> List[Dict[str, Any]]:
+        """并发执行所有查询
+
+        生产者协程在线程池中按需迭代输入，放入容量为并发度两倍的队列，
+        队列满时暂停读取；固定数量的消费协程从队列取出查询执行。
+        内存占用只与并发度相关，与输入规模无关。
+
+        Args:
+            queries: 查询序列，按需迭代
+            on_start: 查询开始时的回调
+            on_complete: 查询完成时的回调（按完成顺序调用，可用于流式写出结果）
+            skip: 已完成的 {序号: 查询}，序号和内容都匹配时跳过
+            collect: 是否在内存中收集结果。流式写出时应关闭
+
+        Returns:
+            与输入顺序一致的结果列表（不含跳过的查询）；collect=False 时为空列表
+        """
+        executor = self._prepare()
+        token = llm_executor.set(executor)
+        try:
+            return await self._run(executor, iter_pending(queries, skip), on_start, on_complete, collect)
+        finally:
+            llm_executor.reset(token)
+            # 超时被放弃的 LLM 调用可能仍在线程中执行，不等待其结束
+            executor.shutdown(wait=False)
+
+    async def _run(self,
+                   executor: ThreadPoolExecutor,
+                   pending: Iterator[Tuple[int, str]],
+                   on_start: Optional[Callable[[int, str], None]],
+                   on_complete: Optional[Callable[[int, Dict[str, Any]], None]],
+                   collect: bool) -> List[Dict[str, Any]]:
+        """在 run 设置好线程池后执行生产者和消费协程"""
+        results: Dict[int, Dict[str, Any]] = {}
+
+        log_conversation(
+            "BatchRunner",
+            f"开始批量分析, 并发度 {self.concurrency}",
+            "system"
+        )
+
+        work_queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        loop = asyncio.get_running_loop()
+
+        async def produce():
+            try:
+                while True:
+                    # 读取和解析输入文件可能阻塞，放到线程池中执行
+                    task = await loop.run_in_executor(executor, next, pending, None)
+                    if task is None:
+                        break
+                    await work_queue.put(task)
+            finally:
+                for _ in range(self.concurrency):
+                    await work_queue.put(None)
+
+        async def consume():
+            while True:
+                task = await work_queue.get()
+                if task is None:
+                    return
+                index, query = task
+                record = await self._run_one(index, query, on_start, on_complete)
+                if collect:
+                    results[index] = record
+
+        await asyncio.gather(produce(), *[consume() for _ in range(self.concurrency)])
+        return [results[index] for index in sorted(results)]
+
+def _process_worker_main(worker_id: int,
+                         task_conn,
+                         result_conn,
+                         concurrency: int,
+                         team_factory: Callable[[], MarketAnalysisTeam],
+                         initialize_observability: bool) -> None:
+    """工作进程入口
+
+    每个进程拥有独立的 ObservabilityManager、SafetyManager 和 MarketAnalysisTeam
+    （均为进程内全局实例），追踪数据导出到主进程启动的 Phoenix。
+    """
+    if initialize_observability:
+        try:
+            observability.initialize(launch_phoenix=False)
+        except Exception as e:
+            logger.warning(f"工作进程 {worker_id} 可观测性初始化失败: {e}")
+
+    asyncio.run(_process_worker_loop(task_conn, result_conn, concurrency, team_factory))
+
+async def _process_worker_loop(task_conn,
+                               result_conn,
+                               concurrency: int,
+                               team_factory: Callable[[], MarketAnalysisTeam]) -> None:
+    """工作进程内的消费循环：以进程内并发度执行主进程派发的查询"""
+    runner = BatchRunner(concurrency=concurrency, team_factory=team_factory)
+    executor = runner._prepare()
+    llm_executor.set(executor)
+    loop = asyncio.get_running_loop()
+    tasks: asyncio.Queue = asyncio.Queue()
+
+    async def receive():
+        # 单个读取线程负责接收任务，避免多个线程同时读取同一管道
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-reader") as reader:
+            while True:
+                try:
+                    task = await loop.run_in_executor(reader, task_conn.recv)
+                except EOFError:
+                    task = None
+                if task is None:
+                    for _ in range(concurrency):
+                        tasks.put_nowait(None)
+                    return
+                tasks.put_nowait(task)
+
+    async def consume():
+        while True:
+            task = await tasks.get()
+            if task is None:
+                return
+
+            index, query = task
+            start_time = time.time()
+            record = await runner._run_one(index, query, None, None)
+            result_conn.send((index, record, time.time() - start_time))
+
+    try:
+        await asyncio.gather(receive(), *[consume() for _ in range(concurrency)])
+    finally:
+        executor.shutdown(wait=False)
+
+class _WorkerHandle:
+    """主进程中对单个工作进程的跟踪信息"""
+
+    def __init__(self, worker_id: int, process, task_conn, result_conn):
+        self.worker_id = worker_id
+        self.process = process
+        self.task_conn = task_conn
+        self.result_conn = result_conn
+        self.assigned: Dict[int, str] = {}
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.restarts = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def close(self) -> None:
+        """关闭主进程一侧的管道"""
+        for conn in (self.task_conn, self.result_conn):
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+class ProcessBatchRunner:
+    """多进程批量执行器 - 将查询分派到多个工作进程并合并结果
+
+    主进程通过独立管道向每个工作进程派发查询并记录已派发的查询，
+    工作进程崩溃时将其未完成的查询重新排队，并启动替代进程。
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 concurrency_per_worker: int = 1,
+                 team_factory: Callable[[], MarketAnalysisTeam] = create_market_analysis_team,
+                 max_attempts: int = 2,
+                 initialize_observability: bool = True):
+        """
+        Args:
+            workers: 工作进程数量
+            concurrency_per_worker: 每个进程内同时执行的查询数
+            team_factory: 在工作进程中创建分析团队的函数（需可被 pickle）
+            max_attempts: 单个查询单独执行时导致进程崩溃的最大次数，超过后记为失败
+            initialize_observability: 工作进程是否初始化追踪导出
+        """
+        if workers < 1:
+            raise ValueError("workers 必须大于等于 1")
+        if concurrency_per_worker < 1:
+            raise ValueError("concurrency_per_worker 必须大于等于 1")
+
+        self.workers = workers
+        self.concurrency_per_worker = concurrency_per_worker
+        self.team_factory = team_factory
+        self.max_attempts = max_attempts
+        self.initialize_observability = initialize_observability
+        # 每个进程预取的查询数，保证进程内并发槽位不空闲
+        self.prefetch = concurrency_per_worker * 2
+        self._ctx = multiprocessing.get_context("spawn")
+        self._handles: Dict[int, _WorkerHandle] = {}
+        self._source: Iterator[Tuple[int, str]] = iter(())
+        self._suspects: set = set()
+        self._crash_counts: Dict[int, int] = {}
+        self.worker_stats: List[Dict[str, Any]] = []
+
+    def _spawn_worker(self, worker_id: int) -> _WorkerHandle:
+        """启动一个工作进程"""
+        # 每个进程使用独立的单向管道，进程崩溃不会影响其他进程的通信
+        task_recv, task_send = self._ctx.Pipe(duplex=False)
+        result_recv, result_send = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=_process_worker_main,
+            args=(worker_id, task_recv, result_send, self.concurrency_per_worker,
+                  self.team_factory, self.initialize_observability),
+            daemon=True,
+        )
+        process.start()
+        # 子进程持有的管道端在主进程中关闭，子进程退出时主进程才能收到 EOF
+        task_recv.close()
+        result_send.close()
+        return _WorkerHandle(worker_id, process, task_send, result_recv)
+
+    def _dispatch(self, handle: _WorkerHandle, backlog: deque) -> None:
+        """向工作进程补充任务，直到达到预取上限
+
+        崩溃时与其他查询同进程执行的查询被标记为可疑，需要在空闲进程中单独重试，
+        这样再次崩溃时可以确定是哪个查询导致的。
+        """
+        while len(handle.assigned) < self.prefetch:
+            if any(index in self._suspects for index in handle.assigned):
+                return
+
+            # 重新排队的查询优先，其次按需从输入中读取
+            if not backlog:
+                task = next(self._source, None)
+                if task is None:
+                    return
+                backlog.append(task)
+
+            index, query = backlog[0]
+            if index in self._suspects and handle.assigned:
+                return
+
+            backlog.popleft()
+            handle.assigned[index] = query
+            try:
+                handle.task_conn.send((index, query))
+            except (BrokenPipeError, OSError):
+                # 进程已退出，任务保留在 assigned 中，由崩溃处理重新排队
+                return
+
+    def _handle_crash(self,
+                      handle: _WorkerHandle,
+                      backlog: deque,
+                      results: Dict[int, Dict[str, Any]],
+                      collect: bool,
+                      on_complete: Optional[Callable[[int, Dict[str, Any]], None]]) -> _WorkerHandle:
+        """处理崩溃的工作进程：重新排队未完成的查询并启动替代进程"""
+        handle.process.join()
+        logger.error(
+            f"工作进程 {handle.worker_id} 异常退出 (exitcode={handle.process.exitcode})，"
+            f"重新排队 {len(handle.assigned)} 个查询"
+        )
+        handle.close()
+
+        # 只有单独执行时的崩溃才计入该查询的崩溃次数
+        isolated = len(handle.assigned) == 1
+        # 按原顺序放回队首，优先重试
+        for index, query in sorted(handle.assigned.items(), reverse=True):
+            self._suspects.add(index)
+            if isolated:
+                self._crash_counts[index] = self._crash_counts.get(index, 0) + 1
+            if self._crash_counts.get(index, 0) >= self.max_attempts:
+                logger.error(f"查询 {index + 1} 单独执行 {self.max_attempts} 次仍导致进程崩溃，放弃")
+                record = build_result_record(query, None)
+                record["error"] = "worker_crashed"
+                if collect:
+                    results[index] = record
+                if on_complete:
+                    on_complete(index, record)
+            else:
+                backlog.appendleft((index, query))
+
+        replacement = self._spawn_worker(handle.worker_id)
+        replacement.completed = handle.completed
+        replacement.busy_seconds = handle.busy_seconds
+        replacement.restarts = handle.restarts + 1
+        replacement.started_at = handle.started_at
+        return replacement
+
+    def run(self,
+            queries: Iterable[str],
+            on_complete: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+            skip: Optional[Dict[int, str]] = None,
+            collect: bool = True) -> List[Dict[str, Any]]:
+        """在多个进程中执行所有查询
+
+        查询按需从输入中读取并派发，参数含义与 BatchRunner.run 相同。
+
+        Returns:
+            与输入顺序一致的结果列表（不含跳过的查询）；collect=False 时为空列表
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        backlog: deque = deque()
+        self._source = iter_pending(queries, skip)
+        self._suspects = set()
+        self._crash_counts = {}
+
+        log_conversation(
+            "ProcessBatchRunner",
+            f"开始多进程批量分析: {self.workers} 个进程 × 并发度 {self.concurrency_per_worker}",
+            "system"
+        )
+
+        self._handles = {worker_id: self._spawn_worker(worker_id) for worker_id in range(self.workers)}
+        for handle in self._handles.values():
+            self._dispatch(handle, backlog)
+
+        try:
+            while backlog or any(handle.assigned for handle in self._handles.values()):
+                by_conn = {handle.result_conn: handle for handle in self._handles.values()}
+                ready = multiprocessing.connection.wait(list(by_conn), timeout=1.0)
+
+                crashed = []
+                for conn in ready:
+                    handle = by_conn[conn]
+                    try:
+                        index, record, elapsed = conn.recv()
+                    except (EOFError, OSError):
+                        # 管道关闭意味着进程已退出，而主进程尚未发出结束信号
+                        crashed.append(handle)
+                        continue
+
+                    self._suspects.discard(index)
+                    # 每个进程的结果按发送顺序到达，已完成的查询不会重复出现
+                    if handle.assigned.pop(index, None) is not None:
+                        handle.completed += 1
+                        handle.busy_seconds += elapsed
+                        if collect:
+                            results[index] = record
+                        if on_complete:
+                            on_complete(index, record)
+                    self._dispatch(handle, backlog)
+
+                for handle in crashed:
+                    replacement = self._handle_crash(handle, backlog, results, collect, on_complete)
+                    self._handles[handle.worker_id] = replacement
+                    self._dispatch(replacement, backlog)
+        finally:
+            self._shutdown()
+
+        self.worker_stats = self._collect_worker_stats()
+        return [results[index] for index in sorted(results)]
+
+    def _shutdown(self) -> None:
+        """通知所有工作进程退出并等待结束"""
+        for handle in self._handles.values():
+            try:
+                handle.task_conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for handle in self._handles.values():
+            handle.process.join(timeout=30)
+            if handle.process.is_alive():
+                handle.process.terminate()
+            handle.finished_at = time.time()
+            handle.close()
+
+    def _collect_worker_stats(self) -> List[Dict[str, Any]]:
+        """汇总每个工作进程的吞吐量"""
+        stats = []
+        for worker_id, handle in sorted(self._handles.items()):
+            wall_seconds = (handle.finished_at or time.time()) - handle.started_at
+            stats.append({
+                "worker_id": worker_id,
+                "completed": handle.completed,
+                "restarts": handle.restarts,
+                "wall_seconds": round(wall_seconds, 2),
+                "busy_seconds": round(handle.busy_seconds, 2),
+                "queries_per_minute": round(handle.completed / wall_seconds * 60, 2) if wall_seconds > 0 else 0.0,
+            })
+        return stats
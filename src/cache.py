@@ -0,0 +1,281 @@
+"""
+缓存模块
+为 LLM 调用提供内容寻址的持久化响应缓存，并提供进程内的 LRU 缓存
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple, Union
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+def _normalize_content(content: Any) -> Any:
+    """规范化消息内容：统一换行符并去除首尾空白"""
+    if isinstance(content, str):
+        return content.replace("\r\n", "\n").strip()
+    return content
+
+def normalize_messages(messages: List[Dict]) -> List[Dict]:
+    """规范化消息列表，只保留影响模型输出的字段"""
+    normalized = []
+    for message in messages:
+        item = {
+            "role": message.get("role"),
+            "content": _normalize_content(message.get("content")),
+        }
+        for key in ("name", "function_call", "tool_calls", "tool_call_id"):
+            if message.get(key) is not None:
+                item[key] = message[key]
+        normalized.append(item)
+    return normalized
+
+# 不改变查询含义的停顿和句末标点（NFKC 归一化后全角形式已转为半角）；
+# 数字之间的小数点、正负号、百分号和 / - 等分隔符会改变含义，予以保留
+_NEUTRAL_PUNCTUATION = re.compile(r"[,;:!?。、]|(?<![0-9])\.|\.(?![0-9])")
+
+def canonicalize_query(query: str) -> str:
+    """规范化查询文本，使仅在格式上不同的查询得到相同的结果
+
+    - NFKC 归一化（全角字母、数字和标点转为半角）
+    - 忽略大小写
+    - 去除停顿和句末标点（，。、；：！？），保留符号和分隔符（如 "-5%"、"A/B"）
+    - 合并空白；中文字符之间的空白被去除，仅保留分隔英文单词和数字的空格
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = _NEUTRAL_PUNCTUATION.sub(" ", text)
+    text = " ".join(text.split())
+    return re.sub(r"(?<![0-9a-z]) | (?![0-9a-z])", "", text)
+
+class LRUCache:
+    """线程安全的内存 LRU 缓存，支持 TTL 过期"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """读取条目，命中时将其移动到最近使用的位置"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._data[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        """写入条目，超出上限时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存和统计"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class ResponseCache:
+    """基于 SQLite 的 LLM 响应缓存
+
+    - 键由模型、温度、系统消息和规范化后的消息列表计算得出
+    - WAL 模式，多个批量工作进程可以共享同一个缓存文件
+    - 支持 TTL 过期，超出条目数或总大小上限时按最近访问时间淘汰 (LRU)
+    """
+
+    def __init__(self,
+                 path: str,
+                 ttl_seconds: float = 7 * 24 * 3600,
+                 max_entries: int = 10000,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接（sqlite3 连接不能跨线程共享）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self) -> None:
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                latency REAL NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+
+    @staticmethod
+    def make_key(model: str,
+                 temperature: Optional[float],
+                 system_message: Optional[str],
+                 messages: List[Dict]) -> str:
+        """计算缓存键"""
+        payload = json.dumps(
+            {
+                "model": model,
+                "temperature": temperature,
+                "system_message": _normalize_content(system_message),
+                "messages": normalize_messages(messages),
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存条目，返回 {"response": ..., "latency": 原始调用耗时}，未命中返回 None"""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, latency, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is not None and self.ttl_seconds and now - row[2] > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                with self._stats_lock:
+                    self.misses += 1
+                return None
+
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            with self._stats_lock:
+                self.hits += 1
+                self.saved_seconds += row[1]
+            return {"response": json.loads(row[0]), "latency": row[1]}
+        except sqlite3.Error as e:
+            logger.warning(f"读取 LLM 缓存失败: {e}")
+            return None
+
+    def set(self, key: str, response: Union[str, Dict], latency: float) -> None:
+        """写入缓存条目，并在超出上限时淘汰最久未访问的条目"""
+        value = json.dumps(response, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, latency, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, size, latency, now, now),
+            )
+            self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"写入 LLM 缓存失败: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """清理过期条目，并按 LRU 顺序淘汰到条目数和大小上限以内"""
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logger.debug(f"LLM 缓存淘汰了 {len(evicted)} 个条目")
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._connect().execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取本进程的缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """获取全局 LLM 响应缓存，未启用时返回 None"""
+    global _response_cache
+    if not config.cache.enable_llm_cache:
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None or _response_cache.path != config.cache.llm_cache_path:
+            _response_cache = ResponseCache(
+                config.cache.llm_cache_path,
+                ttl_seconds=config.cache.llm_cache_ttl_seconds,
+                max_entries=config.cache.llm_cache_max_entries,
+                max_bytes=config.cache.llm_cache_max_bytes,
+            )
+        return _response_cache
@@ -4,7 +4,7 @@
 """
 
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
@@ -19,12 +19,45 @@ class LLMConfig(BaseModel):
     default_model: str = Field(default="gpt-4o")
     backup_model: str = Field(default="claude-3-haiku-20240307")
     request_timeout: int = Field(default=300)
+    max_retries: int = Field(default=3)  # 可重试错误的最大重试次数
+    retry_base_delay: float = Field(default=1.0)  # 指数退避的初始等待时间（秒）
+    retry_max_delay: float = Field(default=30.0)
+    failover_after_attempts: int = Field(default=2)  # 主模型连续失败多少次后切换到备用模型
 
 class SecurityConfig(BaseModel):
     """安全配置"""
     enable_content_moderation: bool = Field(default=True)
     moderation_threshold: float = Field(default=0.7)
     max_retry_attempts: int = Field(default=3)
+    moderation_cache_max_entries: int = Field(default=2048)
+    moderation_cache_ttl_seconds: float = Field(default=3600)
+    # 审核服务连接：为空时使用 OpenAI 官方地址，可指向兼容的代理或本地服务
+    moderation_base_url: Optional[str] = Field(default_factory=lambda: os.getenv("MODERATION_BASE_URL"))
+    moderation_timeout: float = Field(default=30)
+    moderation_max_connections: int = Field(default=50)
+    moderation_max_keepalive_connections: int = Field(default=20)
+    moderation_keepalive_expiry: float = Field(default=30)
+    # 审核微批处理：在时间窗口内合并并发请求，批量大小为 1 时相当于关闭
+    moderation_batch_window_ms: float = Field(default=10)
+    moderation_max_batch_size: int = Field(default=32)
+    # 超过该长度的内容按段落切分后并发审核，0 表示不切分
+    moderation_chunk_chars: int = Field(default=2000)
+    # 本地审核层：命中屏蔽词直接判定违规，命中复核词或无法确定时交给远程审核
+    local_block_terms: List[str] = Field(default_factory=list)
+    local_review_terms: List[str] = Field(default_factory=list)
+    local_scorer: Optional[str] = Field(default=None)  # "模块:函数"，返回 0~1 的违规概率
+    local_safe_below: float = Field(default=0.05)
+    local_flag_above: float = Field(default=0.95)
+    # 审核服务熔断器
+    moderation_max_retries: int = Field(default=2)  # OpenAI SDK 内部重试次数
+    moderation_breaker_failure_rate: float = Field(default=0.5)
+    moderation_breaker_slow_call_seconds: float = Field(default=5.0)
+    moderation_breaker_slow_call_rate: float = Field(default=0.5)
+    moderation_breaker_window: int = Field(default=20)
+    moderation_breaker_min_calls: int = Field(default=5)
+    moderation_breaker_open_seconds: float = Field(default=30)
+    moderation_breaker_half_open_calls: int = Field(default=1)
+    moderation_breaker_open_policy: str = Field(default="fail_open")  # fail_open | fail_closed | local_only
 
 class ObservabilityConfig(BaseModel):
     """可观测性配置"""
@@ -43,15 +76,87 @@ class ObservabilityConfig(BaseModel):
 class AgentConfig(BaseModel):
     """Agent 系统配置"""
     max_round: int = Field(default=10)
+    enable_early_termination: bool = Field(default=True)  # BusinessWriter 给出完整报告后结束群聊
+    execution_mode: str = Field(default="group_chat")  # group_chat: 群聊协作 | pipeline: 固定流水线
+    # 流水线模式下将查询拆分为多个子问题并发研究，默认 1 表示不拆分（研究、分析、写作各调用一次 LLM），
+    # 设为 N 时研究阶段调用 N 次 LLM
+    research_fanout_width: int = Field(default=1)
+    research_dimensions: List[str] = Field(default_factory=lambda: [
+        "市场规模与增长", "政策与监管环境", "竞争格局与主要参与者", "技术发展方向",
+    ])
+    parallel_report_sections: bool = Field(default=False)  # 流水线模式下并发撰写报告各章节
+    # 流水线模式下研究员的流式输出到达 speculation_trigger（正则，多行模式，默认为数据部分之后的章节标题）时
+    # 即以已完成的部分启动战略分析师；研究完成后，已读部分与最终结果的相似度低于 speculation_min_similarity 时重新分析
+    enable_speculative_analysis: bool = Field(default=False)
+    speculation_trigger: str = Field(default=r"^#+\s*趋势分析")
+    speculation_min_similarity: float = Field(default=0.9)
+    analysis_timeout: float = Field(default=1800)  # 单次分析的最长时间（秒），超时后取消群聊
     log_level: str = Field(default="INFO")
     log_format: str = Field(default="json")
 
+class CacheConfig(BaseModel):
+    """缓存配置"""
+    enable_llm_cache: bool = Field(default=True)
+    llm_cache_path: str = Field(default_factory=lambda: os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite"))
+    llm_cache_ttl_seconds: float = Field(default=7 * 24 * 3600)
+    llm_cache_max_entries: int = Field(default=10000)
+    llm_cache_max_bytes: int = Field(default=256 * 1024 * 1024)
+    enable_result_cache: bool = Field(default=True)
+    result_cache_max_entries: int = Field(default=256)
+    result_cache_ttl_seconds: float = Field(default=3600)
+
+class RateLimitConfig(BaseModel):
+    """限流配置（按 provider/model 共享）"""
+    enable_rate_limiting: bool = Field(default=True)
+    default_rpm: int = Field(default=500)
+    default_tpm: int = Field(default=200_000)  # 0 表示不限制
+    max_concurrency: int = Field(default=16)
+    min_concurrency: int = Field(default=1)
+    decrease_factor: float = Field(default=0.5)  # 遇到 429 时并发上限的缩减系数
+    default_retry_after: float = Field(default=1.0)  # 429 响应未携带 Retry-After 时的冷却时间（秒）
+    completion_token_estimate: int = Field(default=1000)  # 为补全内容预留的 token 数
+    # 按 "provider/model" 覆盖默认值，例如 {"openai/gpt-4o": {"rpm": 5000, "tpm": 800000}}
+    limits: Dict[str, Dict[str, int]] = Field(default_factory=lambda: {
+        "openai/moderation": {"rpm": 1000, "tpm": 0},
+    })
+
+class RoutingConfig(BaseModel):
+    """模型路由配置"""
+    enable_model_routing: bool = Field(default=True)
+    # 角色 -> 模型，"default"/"backup" 指向 LLMConfig 的 default_model/backup_model，也可直接填写模型名
+    routes: Dict[str, str] = Field(default_factory=lambda: {
+        "researcher": "backup",
+        "analyst": "default",
+        "writer": "default",
+        "correction": "backup",
+    })
+    # 模型价格（美元 / 百万 token），用于估算每条路由的成本
+    model_prices: Dict[str, Dict[str, float]] = Field(default_factory=lambda: {
+        "gpt-4o": {"input": 2.5, "output": 10.0},
+        "gpt-4o-mini": {"input": 0.15, "output": 0.6},
+        "claude-3-haiku-20240307": {"input": 0.25, "output": 1.25},
+    })
+
+class HedgingConfig(BaseModel):
+    """对冲请求配置"""
+    enable_hedging: bool = Field(default=False)
+    percentile: float = Field(default=0.95)  # 调用超过该模型历史延迟的此分位数时发出对冲请求
+    min_samples: int = Field(default=20)  # 样本不足时不对冲
+    window_size: int = Field(default=200)
+    hedge_target: str = Field(default="same")  # same: 同一模型 | backup: 故障切换模型
+    max_extra_request_rate: float = Field(default=0.1)  # 对冲请求占比上限
+    max_workers: int = Field(default=32)  # 对冲线程池大小，没有空闲线程时直接在调用方线程中执行且不对冲
+
 class AppConfig(BaseModel):
     """应用总配置"""
     llm: LLMConfig = Field(default_factory=LLMConfig)
     security: SecurityConfig = Field(default_factory=SecurityConfig)
     observability: ObservabilityConfig = Field(default_factory=ObservabilityConfig)
     agent: AgentConfig = Field(default_factory=AgentConfig)
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    rate_limit: RateLimitConfig = Field(default_factory=RateLimitConfig)
+    routing: RoutingConfig = Field(default_factory=RoutingConfig)
+    hedging: HedgingConfig = Field(default_factory=HedgingConfig)
 
 # 全局配置实例
 config = AppConfig()
@@ -19,6 +19,8 @@ from .config import config, validate_config
 from .observability import observability
 from .agents import create_market_analysis_team
 from .safety import AgentOutput
+from .streaming import AnalysisEventType
+from .batch import BatchRunner, ProcessBatchRunner, JsonlResultWriter, iter_query_file, load_completed_results
 
 # 初始化富文本控制台
 console = Console()
@@ -31,8 +33,12 @@ class DemoOrchestrator:
         self.team = None
         self.results = {}
     
-    async def initialize_system(self):
-        """初始化整个系统"""
+    async def initialize_system(self, create_team: bool = True):
+        """初始化整个系统
+        
+        Args:
+            create_team: 是否在当前进程创建Agent团队。多进程批量模式下由工作进程各自创建。
+        """
         with Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
@@ -57,6 +63,8 @@ class DemoOrchestrator:
                 console.print(f"⚠️ 可观测性系统启动失败: {e}", style="yellow")
             
             # 3. 创建Agent团队
+            if not create_team:
+                return
             task3 = progress.add_task("🤖 创建Agent团队...", total=None)
             try:
                 self.team = create_market_analysis_team()
@@ -79,28 +87,56 @@ class DemoOrchestrator:
             )
         )
         
-        # 执行分析
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            console=console,
-        ) as progress:
-            
-            task = progress.add_task("🤖 Agent团队协作中...", total=None)
-            
-            try:
-                result = await self.team.analyze_market(query)
-                progress.update(task, description="✅ 分析完成")
+        # 流式执行分析：Agent 发言实时输出，不必等待整个协作和验证流程结束
+        result = None
+        live_turn = None  # 正在逐 token 输出的发言，并发发言的内容在结束时整段输出
+        streamed_turns = set()
+        finished_turns = set()  # 被取消的发言在线程池中可能仍有 token 送达，不再输出
+        try:
+            async for event in self.team.analyze_market_stream(query):
+                if event.type == AnalysisEventType.TURN_STARTED:
+                    console.print(f"🤖 [bold cyan]{event.agent}[/bold cyan] 发言中...")
                 
-                if result:
-                    await self._display_results(result)
-                    await self._display_conversation_summary()
-                else:
-                    console.print("❌ 分析失败，未能生成有效结果", style="red")
-                    
-            except Exception as e:
-                progress.update(task, description="❌ 分析失败")
-                console.print(f"执行过程中出现错误: {e}", style="red")
+                elif event.type == AnalysisEventType.TOKEN:
+                    if event.turn in finished_turns:
+                        continue
+                    if live_turn is None:
+                        live_turn = event.turn
+                        console.rule(f"[cyan]{event.agent}[/cyan]", style="dim")
+                    if event.turn == live_turn:
+                        streamed_turns.add(event.turn)
+                        console.print(event.content, end="", markup=False, highlight=False)
+                
+                elif event.type == AnalysisEventType.TURN_FINISHED:
+                    finished_turns.add(event.turn)
+                    if event.turn == live_turn:
+                        live_turn = None
+                        console.print()
+                    elif event.turn not in streamed_turns and event.content:
+                        console.rule(f"[cyan]{event.agent}[/cyan]", style="dim")
+                        console.print(event.content, markup=False, highlight=False)
+                    if event.metadata.get("cancelled"):
+                        console.print(f"⏹️ {event.agent} 发言已取消", style="yellow")
+                    elif event.metadata.get("error"):
+                        console.print(f"⚠️ {event.agent} 发言失败: {event.metadata['error']}", style="yellow")
+                    else:
+                        console.print(f"✅ [bold cyan]{event.agent}[/bold cyan] 发言完成")
+                
+                elif event.type == AnalysisEventType.VALIDATION:
+                    style = "green" if event.metadata.get("passed") else "red"
+                    console.print(f"🛡️ 输出验证: {event.content}", style=style)
+                
+                elif event.type == AnalysisEventType.FINAL:
+                    result = event.output
+        except Exception as e:
+            console.print(f"执行过程中出现错误: {e}", style="red")
+            return
+        
+        if result:
+            await self._display_results(result)
+            await self._display_conversation_summary()
+        else:
+            console.print("❌ 分析失败，未能生成有效结果", style="red")
     
     async def _display_results(self, result: AgentOutput):
         """展示分析结果"""
@@ -161,6 +197,26 @@ class DemoOrchestrator:
                 contrib_table.add_row(agent_name, str(count))
             
             console.print(contrib_table)
+        
+        # 推测执行命中情况
+        if summary.get("speculation"):
+            speculation_table = Table(title="🔮 推测执行")
+            speculation_table.add_column("步骤", style="cyan")
+            speculation_table.add_column("命中/未命中/未触发", style="white")
+            speculation_table.add_column("命中率", style="white")
+            speculation_table.add_column("节省时间", style="white")
+            speculation_table.add_column("作废 token", style="white")
+            
+            for step, stats in summary["speculation"].items():
+                speculation_table.add_row(
+                    step,
+                    f"{stats['hits']}/{stats['misses']}/{stats['not_triggered']}",
+                    f"{stats['hit_rate']:.0%}",
+                    f"{stats['saved_seconds']:.1f}s",
+                    str(stats["wasted_tokens"]),
+                )
+            
+            console.print(speculation_table)
 
 @app.command()
 def run_demo(
@@ -252,70 +308,136 @@ def run_demo(
     # 运行异步主函数
     asyncio.run(main())
 
+def _display_worker_stats(worker_stats):
+    """显示多进程模式下每个工作进程的吞吐量"""
+    stats_table = Table(title="⚙️ 工作进程吞吐量")
+    stats_table.add_column("进程", style="cyan")
+    stats_table.add_column("完成查询", style="white")
+    stats_table.add_column("重启次数", style="white")
+    stats_table.add_column("运行时间(秒)", style="white")
+    stats_table.add_column("查询/分钟", style="green")
+    
+    for stats in worker_stats:
+        stats_table.add_row(
+            str(stats["worker_id"]),
+            str(stats["completed"]),
+            str(stats["restarts"]),
+            f"{stats['wall_seconds']:.1f}",
+            f"{stats['queries_per_minute']:.2f}",
+        )
+    
+    console.print(stats_table)
+
 @app.command()
 def batch_demo(
-    queries_file: str = typer.Argument(..., help="包含查询列表的JSON文件"),
-    output_file: str = typer.Option("results.json", help="结果输出文件")
+    queries_file: str = typer.Argument(..., help="包含查询列表的JSON数组文件或JSONL文件"),
+    output_file: str = typer.Option("results.json", help="结果输出文件（.jsonl 后缀时逐条流式写入）"),
+    concurrency: int = typer.Option(1, "--concurrency", help="同时执行的查询数量（多进程模式下为每个进程的并发度）"),
+    workers: int = typer.Option(1, "--workers", help="工作进程数量，大于1时启用多进程模式"),
+    resume: bool = typer.Option(False, "--resume", help="跳过 JSONL 输出中已成功完成的查询")
 ):
     """
     批量运行多个市场分析查询
     
     从文件读取查询列表，批量执行分析并保存结果。
+    使用 --concurrency N 时最多同时执行 N 个分析，每个分析使用独立的Agent团队。
+    使用 --workers M 时将查询分派到 M 个工作进程，崩溃进程中的查询会被重新排队。
+    输出文件为 .jsonl 时每完成一个查询立即追加写入，配合 --resume 可在中断后继续。
+    续跑时重新执行的查询会追加新记录，同一 index 以文件中最后一行为准。
+    查询文件按需流式解析，内存占用与并发度相关而与文件大小无关。
     """
     
+    streaming = output_file.endswith(".jsonl")
+    if resume and not streaming:
+        console.print("❌ --resume 需要 .jsonl 格式的输出文件", style="red")
+        sys.exit(1)
+    
+    stats = {"success": 0, "total": 0}
+    writer = JsonlResultWriter(output_file) if streaming else None
+    
+    def on_complete(index: int, record: Dict[str, Any]):
+        stats["total"] += 1
+        if writer:
+            writer.write(index, record)
+        if record["status"] == "success":
+            stats["success"] += 1
+            console.print(f"✅ 查询 {index + 1} 完成", style="green")
+        else:
+            console.print(f"❌ 查询 {index + 1} 失败", style="red")
+    
+    def load_queries():
+        # 查询按需从文件中流式读取，不会一次性载入内存
+        queries = iter_query_file(queries_file)
+        
+        skip = load_completed_results(output_file) if resume else {}
+        if skip:
+            console.print(f"⏭️ 跳过 {len(skip)} 个已完成的查询", style="yellow")
+        return queries, skip
+    
+    def save_results(results):
+        if streaming:
+            console.print(f"\n📁 结果已流式写入: {output_file}", style="green")
+        else:
+            # 保存结果（与输入顺序一致）
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            console.print(f"\n📁 结果已保存到: {output_file}", style="green")
+        
+        # 显示统计
+        console.print(f"📊 成功: {stats['success']}/{stats['total']}", style="green")
+    
     async def batch_main():
         demo = DemoOrchestrator()
         await demo.initialize_system()
         
         try:
-            # 读取查询文件
-            with open(queries_file, 'r', encoding='utf-8') as f:
-                queries = json.load(f)
+            queries, skip = load_queries()
             
-            results = []
+            console.print(f"📋 开始批量处理 {queries_file} 中的查询 (并发度: {concurrency})...")
             
-            console.print(f"📋 开始批量处理 {len(queries)} 个查询...")
+            def on_start(index: int, query: str):
+                console.print(f"\n🔄 处理查询 {index + 1}: {query[:50]}...")
             
-            for i, query in enumerate(queries, 1):
-                console.print(f"\n🔄 处理查询 {i}/{len(queries)}: {query[:50]}...")
-                
-                result = await demo.team.analyze_market(query)
-                
-                if result:
-                    results.append({
-                        "query": query,
-                        "result": {
-                            "content": result.content,
-                            "confidence": result.confidence,
-                            "agent_name": result.agent_name,
-                            "metadata": result.metadata,
-                            "sources": result.sources
-                        },
-                        "status": "success"
-                    })
-                    console.print(f"✅ 查询 {i} 完成", style="green")
-                else:
-                    results.append({
-                        "query": query,
-                        "result": None,
-                        "status": "failed"
-                    })
-                    console.print(f"❌ 查询 {i} 失败", style="red")
+            # 复用已初始化的团队作为第一个并发槽位
+            runner = BatchRunner(concurrency=concurrency, teams=[demo.team])
+            results = await runner.run(
+                queries, on_start=on_start, on_complete=on_complete, skip=skip, collect=not streaming
+            )
+            save_results(results)
             
-            # 保存结果
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            console.print(f"❌ 批量处理失败: {e}", style="red")
+    
+    def process_main():
+        demo = DemoOrchestrator()
+        asyncio.run(demo.initialize_system(create_team=False))
+        
+        try:
+            queries, skip = load_queries()
             
-            console.print(f"\n📁 结果已保存到: {output_file}", style="green")
+            console.print(
+                f"📋 开始多进程批量处理 {queries_file} 中的查询 "
+                f"({workers} 个进程 × 并发度 {concurrency})..."
+            )
             
-            # 显示统计
-            success_count = sum(1 for r in results if r["status"] == "success")
-            console.print(f"📊 成功: {success_count}/{len(queries)}", style="green")
+            runner = ProcessBatchRunner(workers=workers, concurrency_per_worker=concurrency)
+            results = runner.run(queries, on_complete=on_complete, skip=skip, collect=not streaming)
+            save_results(results)
+            _display_worker_stats(runner.worker_stats)
             
         except Exception as e:
             console.print(f"❌ 批量处理失败: {e}", style="red")
     
-    asyncio.run(batch_main())
+    if writer:
+        writer.open()
+    try:
+        if workers > 1:
+            process_main()
+        else:
+            asyncio.run(batch_main())
+    finally:
+        if writer:
+            writer.close()
 
 if __name__ == "__main__":
     app() 
\ No newline at end of file
@@ -0,0 +1,333 @@
+"""
+对冲请求模块
+LLM 调用超过该模型的历史延迟分位数仍未返回时发出重复请求，先成功的结果胜出，落败的请求被中断
+"""
+
+import contextvars
+import logging
+import socket
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Callable, List, Optional, TypeVar
+from .config import config
+from .observability import set_span_attributes, add_span_event
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class CancelToken:
+    """一次对冲请求的取消信号：执行中的请求注册中断函数（例如断开 HTTP 连接），落败时触发"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """注册中断函数，已取消时立即执行"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"中断落败请求失败: {e}")
+
+_cancel_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("hedge_cancel_token", default=None)
+
+def current_cancel_token() -> Optional[CancelToken]:
+    """当前执行的对冲请求的取消信号，不在对冲线程池中执行时为 None"""
+    return _cancel_token.get()
+
+class _AbortableBackend:
+    """包装 httpcore 网络后端，记录建立的 socket 以便从其他线程中断
+
+    关闭连接池不会唤醒阻塞在 recv 上的线程，需要对 socket 执行 shutdown。
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._sockets = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def connect_tcp(self, *args, **kwargs):
+        stream = self._backend.connect_tcp(*args, **kwargs)
+        sock = stream.get_extra_info("socket")
+        if sock is not None:
+            with self._lock:
+                self._sockets.add(sock)
+        return stream
+
+    def abort(self) -> None:
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __getattr__(self, name: str):
+        return getattr(self._backend, name)
+
+def make_abortable(http_client) -> Callable[[], None]:
+    """让同步 httpx 客户端可以从其他线程中断，返回中断函数
+
+    中断会断开该客户端的所有连接，因此每个客户端同一时间只应执行一个请求。
+    """
+    backends = []
+    for transport in [http_client._transport, *http_client._mounts.values()]:
+        # httpx 没有公开设置网络后端的参数，直接替换连接池的后端
+        pool = getattr(transport, "_pool", None)
+        if pool is not None and hasattr(pool, "_network_backend"):
+            pool._network_backend = _AbortableBackend(pool._network_backend)
+            backends.append(pool._network_backend)
+
+    def abort() -> None:
+        for backend in backends:
+            backend.abort()
+
+    return abort
+
+class _Attempt:
+    """在对冲线程池中执行的一次请求，记录开始执行的时间"""
+
+    def __init__(self, fn: Callable[[], T]):
+        self.fn = fn
+        self.token = CancelToken()
+        self.started = threading.Event()
+        self.started_at = 0.0
+        self.future: Optional[Future] = None
+
+    def run(self) -> T:
+        self.started_at = time.monotonic()
+        self.started.set()
+        _cancel_token.set(self.token)
+        return self.fn()
+
+    def cancel(self) -> None:
+        """尚未开始时直接取消，执行中时触发注册的中断函数"""
+        self.future.cancel()
+        self.token.cancel()
+
+class LatencyTracker:
+    """滑动窗口内的延迟样本，用于计算分位数"""
+
+    def __init__(self, window_size: int):
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """第 q 分位（0~1）的延迟，没有样本时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+class HedgingManager:
+    """按模型学习延迟分布并执行对冲请求
+
+    - 主请求的延迟（无论是否被对冲）记入该模型的延迟窗口，作为未对冲时的延迟分布
+    - 调用方实际等待的延迟记入另一个窗口，两者的 p99 之差即为对冲带来的尾延迟改善
+    - 对冲请求占全部请求的比例超过 max_extra_request_rate 时不再对冲，避免故障时放大负载
+    - 可对冲的请求在大小为 max_workers 的线程池中执行，调用方线程只负责等待；
+      线程池没有空闲线程时直接在调用方线程中执行且不对冲，从不排队，延迟从请求开始执行时计时
+    - 落败的请求通过 CancelToken 中断（断开其 HTTP 连接），其占用的时间计入 loser_seconds
+    """
+
+    def __init__(self):
+        self._primary: Dict[str, LatencyTracker] = {}
+        self._effective: Dict[str, LatencyTracker] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._max_workers = 0
+
+    def _tracker(self, trackers: Dict[str, LatencyTracker], model: str) -> LatencyTracker:
+        with self._lock:
+            tracker = trackers.get(model)
+            if tracker is None:
+                tracker = trackers[model] = LatencyTracker(config.hedging.window_size)
+            return tracker
+
+    def _count(self, model: str, key: str, amount: float = 1) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(model, {
+                "requests": 0,
+                "hedged": 0,
+                "hedge_wins": 0,
+                "pool_full": 0,
+                "losers_cancelled": 0,
+                "loser_seconds": 0.0,
+            })
+            counters[key] += amount
+
+    def _submit(self, fn: Callable[[], T]) -> Optional[_Attempt]:
+        """在对冲线程池中执行 fn，复制一份当前上下文（追踪 span 等）；没有空闲线程时返回 None"""
+        with self._lock:
+            if self._executor is None or self._max_workers != config.hedging.max_workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._max_workers = max(1, config.hedging.max_workers)
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="llm-hedge")
+                self._slots = threading.BoundedSemaphore(self._max_workers)
+            executor, slots = self._executor, self._slots
+
+        if not slots.acquire(blocking=False):
+            return None
+        attempt = _Attempt(fn)
+        attempt.future = executor.submit(contextvars.copy_context().run, attempt.run)
+        attempt.future.add_done_callback(lambda _: slots.release())
+        return attempt
+
+    def threshold(self, model: str) -> Optional[float]:
+        """触发对冲的延迟阈值，样本不足时返回 None（不对冲）"""
+        tracker = self._tracker(self._primary, model)
+        if len(tracker) < config.hedging.min_samples:
+            return None
+        return tracker.percentile(config.hedging.percentile)
+
+    def _within_budget(self, model: str) -> bool:
+        """再对冲一次后，对冲请求占比是否仍不超过上限"""
+        with self._lock:
+            counters = self._counters.get(model)
+            if not counters or not counters["requests"]:
+                return True
+            return (counters["hedged"] + 1) / counters["requests"] <= config.hedging.max_extra_request_rate
+
+    def record_latency(self, model: str, latency: float) -> None:
+        """记录一次未对冲请求的延迟"""
+        self._tracker(self._primary, model).record(latency)
+        self._tracker(self._effective, model).record(latency)
+
+    def _cancel_loser(self, model: str, attempt: _Attempt) -> None:
+        """中断落败的请求，请求结束后把它占用的时间计入对冲开销"""
+        def record(future: Future) -> None:
+            self._count(model, "losers_cancelled")
+            if attempt.started.is_set():
+                self._count(model, "loser_seconds", time.monotonic() - attempt.started_at)
+
+        attempt.cancel()
+        attempt.future.add_done_callback(record)
+
+    def call(self, model: str, primary: Callable[[], T], hedge: Callable[[], T]) -> T:
+        """执行 primary，超过延迟阈值仍未返回时再执行 hedge，返回先成功的结果并中断另一个"""
+        self._count(model, "requests")
+        threshold = self.threshold(model)
+
+        primary_attempt = None
+        if threshold is not None and self._within_budget(model):
+            primary_attempt = self._submit(primary)
+            if primary_attempt is None:
+                self._count(model, "pool_full")
+        if primary_attempt is None:
+            start = time.monotonic()
+            result = primary()
+            self.record_latency(model, time.monotonic() - start)
+            return result
+
+        primary_attempt.started.wait()
+        start = primary_attempt.started_at
+        primary_future = primary_attempt.future
+
+        def record_primary(future: Future) -> None:
+            # 被对冲的主请求也记录延迟，使阈值反映未对冲时的延迟分布；被中断的主请求记录中断前已等待的时间
+            if future.cancelled():
+                return
+            if future.exception() is None or primary_attempt.token.cancelled:
+                self._tracker(self._primary, model).record(time.monotonic() - start)
+
+        primary_future.add_done_callback(record_primary)
+        done, _ = wait([primary_future], timeout=max(0.0, threshold - (time.monotonic() - start)))
+        hedge_attempt = None
+        if not done:
+            hedge_attempt = self._submit(hedge)
+            if hedge_attempt is None:
+                self._count(model, "pool_full")
+                logger.debug(f"对冲线程池已满，{model} 调用不发出对冲请求")
+        if hedge_attempt is None:
+            result = primary_future.result()
+            self._tracker(self._effective, model).record(time.monotonic() - start)
+            return result
+
+        self._count(model, "hedged")
+        add_span_event("llm.hedge", {"model": model, "threshold_seconds": threshold})
+        logger.info(f"{model} 调用超过 {threshold:.2f} 秒未返回，发出对冲请求")
+
+        attempts = {primary_future: primary_attempt, hedge_attempt.future: hedge_attempt}
+        pending = set(attempts)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                for loser in pending:
+                    self._cancel_loser(model, attempts[loser])
+                hedge_won = future is hedge_attempt.future
+                if hedge_won:
+                    self._count(model, "hedge_wins")
+                self._tracker(self._effective, model).record(time.monotonic() - start)
+                set_span_attributes({"llm.hedge.fired": True, "llm.hedge.won": hedge_won})
+                return future.result()
+        raise error
+
+    def reset(self) -> None:
+        """清空延迟样本和计数"""
+        with self._lock:
+            self._primary.clear()
+            self._effective.clear()
+            self._counters.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """按模型报告对冲阈值、额外请求比例、落败请求开销和尾延迟改善"""
+        with self._lock:
+            models = list(self._counters)
+            counters = {model: dict(self._counters[model]) for model in models}
+        stats = {}
+        for model in models:
+            c = counters[model]
+            primary = self._tracker(self._primary, model)
+            effective = self._tracker(self._effective, model)
+            primary_p99 = primary.percentile(0.99)
+            effective_p99 = effective.percentile(0.99)
+            stats[model] = {
+                **c,
+                "extra_request_rate": c["hedged"] / c["requests"] if c["requests"] else 0.0,
+                "hedge_win_rate": c["hedge_wins"] / c["hedged"] if c["hedged"] else 0.0,
+                "threshold_seconds": self.threshold(model),
+                "p50_seconds": effective.percentile(0.5),
+                "p99_seconds": effective_p99,
+                "unhedged_p99_seconds": primary_p99,
+                "p99_reduction_seconds": (
+                    primary_p99 - effective_p99 if primary_p99 is not None and effective_p99 is not None else None
+                ),
+            }
+        return stats
+
+# 全局对冲管理器
+hedging = HedgingManager()
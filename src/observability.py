@@ -4,7 +4,6 @@
 """
 
 import logging
-import phoenix as px
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
@@ -13,8 +12,10 @@ from openinference.instrumentation.openai import OpenAIInstrumentor
 from openinference.instrumentation.anthropic import AnthropicInstrumentor
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.semconv.resource import ResourceAttributes
+from contextlib import contextmanager
 from typing import Dict, Any, Optional
 import functools
+import inspect
 import time
 from .config import config
 
@@ -30,14 +31,20 @@ class ObservabilityManager:
         self.phoenix_session = None
         self._initialized = False
     
-    def initialize(self) -> None:
-        """初始化可观测性系统"""
+    def initialize(self, launch_phoenix: bool = True) -> None:
+        """初始化可观测性系统
+        
+        Args:
+            launch_phoenix: 是否启动本地 Phoenix UI。批量工作进程只需导出追踪数据，
+                由主进程负责启动 Phoenix。
+        """
         if self._initialized:
             return
             
         try:
             # 1. 启动 Phoenix 本地服务器
-            self._start_phoenix()
+            if launch_phoenix:
+                self._start_phoenix()
             
             # 2. 配置 OpenTelemetry
             self._setup_opentelemetry()
@@ -58,6 +65,9 @@ class ObservabilityManager:
             return
             
         try:
+            # Phoenix 导入较慢，仅在需要启动 UI 的进程中导入
+            import phoenix as px
+            
             # 设置环境变量（新的推荐方式）
             import os
             os.environ["PHOENIX_PORT"] = str(config.observability.phoenix_port)
@@ -138,8 +148,28 @@ class ObservabilityManager:
             logger.warning(f"OpenInference Anthropic instrumentation 启用失败: {e}")
     
     def trace_agent_operation(self, operation_name: str):
-        """装饰器：追踪 Agent 操作"""
+        """装饰器：追踪 Agent 操作（同时支持同步函数和协程函数）"""
         def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self._initialized or not self.tracer:
+                        return await func(*args, **kwargs)
+                    
+                    # span 需覆盖整个 await 过程，而不仅是协程对象的创建
+                    with self.tracer.start_as_current_span(operation_name) as span:
+                        start_time = time.time()
+                        self._record_operation_inputs(span, operation_name, args, kwargs)
+                        try:
+                            result = await func(*args, **kwargs)
+                            self._record_operation_success(span, result, start_time)
+                            return result
+                        except Exception as e:
+                            self._record_operation_error(span, e)
+                            raise
+                
+                return async_wrapper
+            
             @functools.wraps(func)
             def wrapper(*args, **kwargs):
                 if not self._initialized or not self.tracer:
@@ -147,73 +177,77 @@ class ObservabilityManager:
                 
                 with self.tracer.start_as_current_span(operation_name) as span:
                     start_time = time.time()
-                    
-                    # 记录输入参数
-                    span.set_attribute("agent.operation", operation_name)
-                    span.set_attribute("agent.args_count", len(args))
-                    span.set_attribute("agent.kwargs_count", len(kwargs))
-                    
-                    # 尝试记录详细的输入信息（安全处理）
-                    try:
-                        # 对于特定的agent操作，记录更详细的信息
-                        if operation_name == "agent_generate_reply":
-                            if args and len(args) > 0:
-                                # 尝试从args中提取messages
-                                if hasattr(args[0], '__dict__'):
-                                    span.set_attribute("agent.self_class", args[0].__class__.__name__)
-                                if len(args) > 1:
-                                    messages = args[1] if isinstance(args[1], list) else str(args[1])[:500]
-                                    span.set_attribute("input.messages", str(messages)[:1000])
-                            
-                            # 记录kwargs中的信息
-                            if "messages" in kwargs:
-                                span.set_attribute("input.messages", str(kwargs["messages"])[:1000])
-                            if "sender" in kwargs:
-                                span.set_attribute("input.sender", str(kwargs.get("sender", ""))[:200])
-                        
-                        elif operation_name == "content_moderation":
-                            if args and len(args) > 1:
-                                content = str(args[1])[:500]  # 限制长度
-                                span.set_attribute("input.content", content)
-                        
-                        elif operation_name == "output_validation":
-                            if args and len(args) > 1:
-                                output = str(args[1])[:500]
-                                span.set_attribute("input.raw_output", output)
-                    
-                    except Exception as attr_e:
-                        span.set_attribute("agent.input_capture_error", str(attr_e))
-                    
+                    self._record_operation_inputs(span, operation_name, args, kwargs)
                     try:
                         result = func(*args, **kwargs)
-                        
-                        # 记录成功状态和输出
-                        span.set_attribute("agent.status", "success")
-                        duration = time.time() - start_time
-                        span.set_attribute("agent.duration_seconds", duration)
-                        
-                        # 尝试记录输出信息
-                        try:
-                            if result is not None:
-                                result_str = str(result)[:1000]  # 限制长度
-                                span.set_attribute("output.result", result_str)
-                                span.set_attribute("output.type", type(result).__name__)
-                        except Exception as output_e:
-                            span.set_attribute("agent.output_capture_error", str(output_e))
-                        
+                        self._record_operation_success(span, result, start_time)
                         return result
-                    
                     except Exception as e:
-                        # 记录错误信息
-                        span.set_attribute("agent.status", "error")
-                        span.set_attribute("agent.error_type", type(e).__name__)
-                        span.set_attribute("agent.error_message", str(e))
-                        span.record_exception(e)
+                        self._record_operation_error(span, e)
                         raise
             
             return wrapper
         return decorator
     
+    def _record_operation_inputs(self, span, operation_name: str, args: tuple, kwargs: dict) -> None:
+        """记录操作的输入参数"""
+        span.set_attribute("agent.operation", operation_name)
+        span.set_attribute("agent.args_count", len(args))
+        span.set_attribute("agent.kwargs_count", len(kwargs))
+        
+        # 尝试记录详细的输入信息（安全处理）
+        try:
+            # 对于特定的agent操作，记录更详细的信息
+            if operation_name == "agent_generate_reply":
+                if args and len(args) > 0:
+                    # 尝试从args中提取messages
+                    if hasattr(args[0], '__dict__'):
+                        span.set_attribute("agent.self_class", args[0].__class__.__name__)
+                    if len(args) > 1:
+                        messages = args[1] if isinstance(args[1], list) else str(args[1])[:500]
+                        span.set_attribute("input.messages", str(messages)[:1000])
+                
+                # 记录kwargs中的信息
+                if "messages" in kwargs:
+                    span.set_attribute("input.messages", str(kwargs["messages"])[:1000])
+                if "sender" in kwargs:
+                    span.set_attribute("input.sender", str(kwargs.get("sender", ""))[:200])
+            
+            elif operation_name == "content_moderation":
+                if args and len(args) > 1:
+                    content = str(args[1])[:500]  # 限制长度
+                    span.set_attribute("input.content", content)
+            
+            elif operation_name == "output_validation":
+                if args and len(args) > 1:
+                    output = str(args[1])[:500]
+                    span.set_attribute("input.raw_output", output)
+        
+        except Exception as attr_e:
+            span.set_attribute("agent.input_capture_error", str(attr_e))
+    
+    def _record_operation_success(self, span, result: Any, start_time: float) -> None:
+        """记录成功状态和输出"""
+        span.set_attribute("agent.status", "success")
+        duration = time.time() - start_time
+        span.set_attribute("agent.duration_seconds", duration)
+        
+        # 尝试记录输出信息
+        try:
+            if result is not None:
+                result_str = str(result)[:1000]  # 限制长度
+                span.set_attribute("output.result", result_str)
+                span.set_attribute("output.type", type(result).__name__)
+        except Exception as output_e:
+            span.set_attribute("agent.output_capture_error", str(output_e))
+    
+    def _record_operation_error(self, span, error: Exception) -> None:
+        """记录错误信息"""
+        span.set_attribute("agent.status", "error")
+        span.set_attribute("agent.error_type", type(error).__name__)
+        span.set_attribute("agent.error_message", str(error))
+        span.record_exception(error)
+    
     def log_agent_conversation(self, 
                              agent_name: str, 
                              message: str, 
@@ -255,4 +289,27 @@ def traced_agent_operation(operation_name: str):
 
 def log_conversation(agent_name: str, message: str, role: str = "assistant", **metadata):
     """快捷函数：记录对话"""
-    observability.log_agent_conversation(agent_name, message, role, metadata) 
\ No newline at end of file
+    observability.log_agent_conversation(agent_name, message, role, metadata)
+
+def set_span_attributes(attributes: Dict[str, Any]) -> None:
+    """快捷函数：在当前 span 上记录属性"""
+    span = trace.get_current_span()
+    if not span.is_recording():
+        return
+    for key, value in attributes.items():
+        span.set_attribute(key, value)
+
+@contextmanager
+def traced_span(name: str, attributes: Optional[Dict[str, Any]] = None):
+    """快捷上下文管理器：创建 span 并设为当前 span，追踪未初始化时返回 None"""
+    if not observability._initialized or not observability.tracer:
+        yield None
+        return
+    with observability.tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
+
+def add_span_event(name: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+    """快捷函数：在当前 span 上记录事件"""
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.add_event(name, attributes=attributes or {})
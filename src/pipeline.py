@@ -0,0 +1,306 @@
+"""
+流水线执行模块
+按声明式的 DAG 依次调用 Agent，步骤输出直接传给下游步骤，不经过群聊管理器
+"""
+
+import asyncio
+import contextlib
+import difflib
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+from pydantic import BaseModel, Field
+from autogen import Agent
+from .config import config
+from .observability import traced_span
+from .ratelimit import estimate_tokens
+from .streaming import listen_tokens
+
+logger = logging.getLogger(__name__)
+
+# 查询开头的动词和并列成分之间的分隔词
+_QUERY_VERBS = re.compile(r"^请?(分析|评估|研究|调研|探讨|预测)")
+# 查询结尾的疑问词和标点，例如 "AI芯片市场前景如何？"
+_QUERY_SUFFIX = re.compile(r"(如何|怎么样|怎样|是什么|有哪些)?[？?。！!\s]*$")
+_ASPECT_SEPARATORS = re.compile(r"以及|和|与|及|、|，|,")
+
+def decompose_query(query: str, width: int) -> List[str]:
+    """将查询拆分为至多 width 个可独立研究的子问题（规则拆分，不调用 LLM）
+
+    "分析中国电动汽车市场的发展趋势和投资机会" 拆为 "中国电动汽车市场的发展趋势"、
+    "中国电动汽车市场的投资机会"，不足 width 个时用 research_dimensions 中尚未覆盖的维度补齐。
+    查询中没有 "的" 时整体作为研究对象，子问题写作 "AI芯片市场前景：市场规模与增长"。
+    """
+    text = _QUERY_SUFFIX.sub("", _QUERY_VERBS.sub("", query.strip())).strip()
+    subject, aspects, joiner = text, [], "："
+    if "的" in text:
+        subject, tail = text.rsplit("的", 1)
+        aspects = [aspect.strip() for aspect in _ASPECT_SEPARATORS.split(tail) if aspect.strip()]
+        joiner = "的"
+    for dimension in config.agent.research_dimensions:
+        # 以维度的前两个字判断是否已被查询中的某个方面覆盖，例如"竞争格局"覆盖"竞争格局与主要参与者"
+        if not any(dimension[:2] in aspect for aspect in aspects):
+            aspects.append(dimension)
+    return [f"{subject}{joiner}{aspect}" for aspect in aspects[:width]]
+
+class PipelineStep(BaseModel):
+    """流水线中的一个 Agent 步骤"""
+    name: str
+    agent: str  # Agent 在团队 agents 字典中的键
+    prompt: str  # 提示词模板，可引用 {query} 和依赖步骤的输出 {<步骤名>}
+    depends_on: List[str] = Field(default_factory=list)
+    # 推测执行：partial_ready 为正则（多行模式），步骤的流式输出匹配后，匹配位置之前的内容即可供下游推测步骤使用；
+    # speculative 的步骤在依赖的输出达到就绪点后即启动，依赖完成后输出有实质变化时用最终输出重新执行
+    partial_ready: Optional[str] = None
+    speculative: bool = False
+
+class SpeculationStats:
+    """按步骤统计推测执行的命中、未命中、节省的时间和作废的 token"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, step: str, outcome: str, saved_seconds: float = 0.0, wasted_tokens: int = 0) -> None:
+        """记录一次推测步骤的执行结果，outcome 为 hit | miss | not_triggered"""
+        with self._lock:
+            entry = self._stats.setdefault(step, {
+                "runs": 0,
+                "hits": 0,
+                "misses": 0,
+                "not_triggered": 0,
+                "saved_seconds": 0.0,
+                "wasted_tokens": 0,
+            })
+            entry["runs"] += 1
+            entry[{"hit": "hits", "miss": "misses"}.get(outcome, outcome)] += 1
+            entry["saved_seconds"] += saved_seconds
+            entry["wasted_tokens"] += wasted_tokens
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            stats = {}
+            for step, entry in self._stats.items():
+                speculated = entry["hits"] + entry["misses"]
+                stats[step] = {
+                    **entry,
+                    "hit_rate": entry["hits"] / speculated if speculated else 0.0,
+                    "miss_rate": entry["misses"] / speculated if speculated else 0.0,
+                }
+            return stats
+
+# 全局推测执行统计
+speculation_stats = SpeculationStats()
+
+class _PartialOutput:
+    """步骤流式输出的累积内容，匹配就绪点后通知等待中的推测步骤
+
+    start 和 append 在执行 LLM 调用的线程中调用，ready 通过事件循环设置。
+    """
+
+    def __init__(self, pattern: str, loop: asyncio.AbstractEventLoop):
+        self._pattern = re.compile(pattern, re.MULTILINE)
+        self._loop = loop
+        self._text = ""
+        self.snapshot: Optional[str] = None  # 就绪时已完成的部分
+        self.ready = asyncio.Event()
+
+    def start(self) -> None:
+        self._text = ""
+
+    def append(self, text: str) -> None:
+        self._text += text
+        if self.snapshot is None:
+            match = self._pattern.search(self._text)
+            if match:
+                self.snapshot = self._text[:match.start()]
+                self._loop.call_soon_threadsafe(self.ready.set)
+
+def _differs_materially(partial: str, final: str) -> bool:
+    """推测时使用的部分输出与最终输出中对应部分的相似度低于阈值时，视为有实质变化"""
+    if final.startswith(partial):
+        return False
+    seen = final[:len(partial)]
+    similarity = difflib.SequenceMatcher(None, partial, seen, autojunk=False).ratio()
+    return similarity < config.agent.speculation_min_similarity
+
+class AgentPipeline:
+    """Agent 步骤组成的 DAG
+
+    每个步骤在依赖步骤全部完成后立即执行，没有依赖关系的步骤并发执行。
+    每个步骤只调用一次对应 Agent 的 LLM，并创建一个 span。
+    """
+
+    def __init__(self, steps: List[PipelineStep]):
+        self.steps = {step.name: step for step in steps}
+        if len(self.steps) != len(steps):
+            raise ValueError("流水线步骤名称重复")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[PipelineStep]:
+        """按依赖关系排序，依赖不存在或存在环时报错"""
+        order: List[PipelineStep] = []
+        state: Dict[str, str] = {}  # visiting | done
+
+        def visit(name: str, path: List[str]) -> None:
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"流水线存在循环依赖: {' -> '.join(path + [name])}")
+            step = self.steps.get(name)
+            if step is None:
+                raise ValueError(f"步骤 {path[-1]} 依赖未定义的步骤 {name}")
+            state[name] = "visiting"
+            for dependency in step.depends_on:
+                visit(dependency, path + [name])
+            state[name] = "done"
+            order.append(step)
+
+        for name in self.steps:
+            visit(name, [])
+        return order
+
+    async def run(self, agents: Dict[str, Agent], query: str) -> Dict[str, str]:
+        """执行流水线，返回各步骤的输出"""
+        outputs: Dict[str, str] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        # 只监听有推测步骤依赖的步骤的流式输出
+        loop = asyncio.get_running_loop()
+        partials = {
+            step.name: _PartialOutput(step.partial_ready, loop)
+            for step in self.order
+            if step.partial_ready and any(step.name in s.depends_on for s in self.order if s.speculative)
+        }
+        for step in self.order:
+            agent = agents[step.agent]
+            if step.speculative and any(name in partials for name in step.depends_on):
+                run = self._run_speculative_step(step, agent, query, outputs, tasks, partials)
+            else:
+                dependencies = [tasks[name] for name in step.depends_on]
+                run = self._run_step(step, agent, query, outputs, dependencies, partials.get(step.name))
+            tasks[step.name] = asyncio.ensure_future(run)
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return outputs
+
+    async def _run_step(self,
+                        step: PipelineStep,
+                        agent: Agent,
+                        query: str,
+                        outputs: Dict[str, str],
+                        dependencies: List[asyncio.Task],
+                        partial: Optional[_PartialOutput] = None) -> None:
+        if dependencies:
+            await asyncio.gather(*dependencies)
+
+        with traced_span(f"pipeline_step.{step.name}", self._span_attributes(step, agent)) as span:
+            start_time = time.time()
+            prompt = step.prompt.format(query=query, **{name: outputs[name] for name in step.depends_on})
+            with listen_tokens(partial) if partial is not None else contextlib.nullcontext():
+                outputs[step.name] = await _generate(agent, prompt)
+            if span is not None:
+                span.set_attribute("pipeline.duration_seconds", time.time() - start_time)
+                span.set_attribute("output.length", len(outputs[step.name]))
+        logger.info(f"流水线步骤 {step.name} ({agent.name}) 完成")
+
+    async def _run_speculative_step(self,
+                                    step: PipelineStep,
+                                    agent: Agent,
+                                    query: str,
+                                    outputs: Dict[str, str],
+                                    tasks: Dict[str, asyncio.Task],
+                                    partials: Dict[str, _PartialOutput]) -> None:
+        """依赖完成或其输出达到就绪点后即启动；依赖全部完成后，
+        若推测时使用的部分输出与最终输出有实质变化，则放弃推测结果并用最终输出重新执行"""
+        for name in step.depends_on:
+            partial = partials.get(name)
+            if partial is None:
+                await tasks[name]
+                continue
+            ready = asyncio.ensure_future(partial.ready.wait())
+            try:
+                await asyncio.wait([tasks[name], ready], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                ready.cancel()
+            if tasks[name].done():
+                tasks[name].result()  # 依赖失败时抛出
+        inputs = {name: outputs[name] if name in outputs else partials[name].snapshot for name in step.depends_on}
+        speculated = [name for name in step.depends_on if name not in outputs]
+
+        with traced_span(f"pipeline_step.{step.name}", self._span_attributes(step, agent)) as span:
+            start_time = time.time()
+            saved_seconds, wasted_tokens = 0.0, 0
+            if not speculated:
+                # 依赖在达到就绪点之前已经完成（或输出中没有就绪点），按普通步骤执行
+                outcome = "not_triggered"
+                outputs[step.name] = await _generate(agent, step.prompt.format(query=query, **inputs))
+            else:
+                prompt = step.prompt.format(query=query, **inputs)
+                attempt = asyncio.ensure_future(_generate_timed(agent, prompt))
+                try:
+                    await asyncio.gather(*(tasks[name] for name in step.depends_on))
+                except BaseException:
+                    attempt.cancel()
+                    raise
+                dependencies_done = time.time()
+
+                changed = [name for name in speculated if _differs_materially(inputs[name], outputs[name])]
+                if not changed:
+                    outcome = "hit"
+                    outputs[step.name], finished_at = await attempt
+                    saved_seconds = min(dependencies_done, finished_at) - start_time
+                else:
+                    outcome = "miss"
+                    wasted_tokens = estimate_tokens([{"content": prompt}])
+                    if attempt.done() and not attempt.cancelled() and attempt.exception() is None:
+                        wasted_tokens += estimate_tokens([{"content": attempt.result()[0]}])
+                    else:
+                        # 已发出的 LLM 请求无法撤回，按预留的补全长度估算
+                        wasted_tokens += config.rate_limit.completion_token_estimate
+                        attempt.cancel()
+                    logger.info(f"流水线步骤 {step.name} 推测未命中，{', '.join(changed)} 的输出有实质变化，重新执行")
+                    final_inputs = {name: outputs[name] for name in step.depends_on}
+                    outputs[step.name] = await _generate(agent, step.prompt.format(query=query, **final_inputs))
+
+            speculation_stats.record(step.name, outcome, saved_seconds, wasted_tokens)
+            if span is not None:
+                span.set_attribute("pipeline.duration_seconds", time.time() - start_time)
+                span.set_attribute("output.length", len(outputs[step.name]))
+                span.set_attribute("pipeline.speculation", outcome)
+                span.set_attribute("pipeline.speculation.saved_seconds", saved_seconds)
+                span.set_attribute("pipeline.speculation.wasted_tokens", wasted_tokens)
+        logger.info(f"流水线步骤 {step.name} ({agent.name}) 完成，推测执行: {outcome}")
+
+    @staticmethod
+    def _span_attributes(step: PipelineStep, agent: Agent) -> Dict[str, Any]:
+        return {
+            "pipeline.step": step.name,
+            "pipeline.agent": agent.name,
+            "pipeline.depends_on": ",".join(step.depends_on),
+        }
+
+async def _generate(agent: Agent, prompt: str) -> str:
+    """以单条用户消息调用 Agent，返回回复内容"""
+    reply = await agent.a_generate_reply(messages=[{"role": "user", "content": prompt}], sender=None)
+    return _reply_content(reply)
+
+async def _generate_timed(agent: Agent, prompt: str) -> Tuple[str, float]:
+    """同 _generate，同时返回完成时间"""
+    content = await _generate(agent, prompt)
+    return content, time.time()
+
+def _reply_content(reply: Any) -> str:
+    """Agent 回复可能是字符串或消息字典"""
+    if isinstance(reply, dict):
+        return str(reply.get("content") or "")
+    return str(reply or "")
@@ -0,0 +1,307 @@
+"""
+限流模块
+为 LLM 和审核服务调用提供进程级共享的自适应限流
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from .config import config
+from .observability import set_span_attributes
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    """粗略估算消息的 token 数（中文约 1 字 1 token，英文约 4 字符 1 token，取折中）"""
+    chars = sum(len(str(m.get("content") or "")) for m in messages)
+    return chars // 2 + 4 * len(messages)
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """是否为服务端限流错误（HTTP 429）"""
+    return getattr(error, "status_code", None) == 429
+
+def parse_retry_after(error: BaseException) -> Optional[float]:
+    """从错误响应的 Retry-After / retry-after-ms 头中解析建议的等待时间（秒）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+class TokenBucket:
+    """令牌桶
+
+    采用预留方式：调用方先扣除令牌（余额可以为负），再按欠额等待，
+    因此同步线程和协程可以共享同一个桶。
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """预留令牌，返回需要等待的秒数"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+            self._updated_at = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    def adjust(self, amount: float) -> None:
+        """按实际用量修正预留（正数为补扣，负数为退还）"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD 并发控制：每次成功加性增加并发上限，遇到限流时乘性减少"""
+
+    def __init__(self,
+                 initial_limit: float,
+                 min_limit: float = 1,
+                 max_limit: float = 64,
+                 decrease_factor: float = 0.5):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < max(1, int(self.limit)):
+            self.in_flight += 1
+            return True
+        return False
+
+    def acquire(self) -> None:
+        """同步获取并发名额（在线程中阻塞等待）"""
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+
+    async def acquire_async(self) -> None:
+        """异步获取并发名额"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_acquire():
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._wake_waiters()
+
+    def on_success(self) -> None:
+        with self._cond:
+            previous = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) > previous:
+                self._wake_waiters()
+
+    def on_rate_limited(self) -> None:
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def _wake_waiters(self) -> None:
+        """唤醒所有等待者重新竞争名额（调用方需持有锁）"""
+        self._cond.notify_all()
+        for loop, waiter in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve_waiter, waiter)
+        self._async_waiters.clear()
+
+def _resolve_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+class RateLimiter:
+    """单个 provider/model 的限流器
+
+    - RPM、TPM 两个令牌桶（配置为 0 时不限制）
+    - AIMD 自适应并发上限
+    - 收到 429 时按 Retry-After 冷却，冷却期间所有调用等待
+    """
+
+    def __init__(self,
+                 key: str,
+                 rpm: int,
+                 tpm: int,
+                 max_concurrency: int,
+                 min_concurrency: int = 1,
+                 decrease_factor: float = 0.5,
+                 default_retry_after: float = 1.0):
+        self.key = key
+        self.rpm_bucket = TokenBucket(rpm, rpm / 60) if rpm else None
+        self.tpm_bucket = TokenBucket(tpm, tpm / 60) if tpm else None
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial_limit=max_concurrency,
+            min_limit=min_concurrency,
+            max_limit=max_concurrency,
+            decrease_factor=decrease_factor,
+        )
+        self.default_retry_after = default_retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.waited_seconds = 0.0
+        self._cooldown_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """预留 RPM/TPM 令牌，返回需要等待的秒数"""
+        wait = 0.0
+        if self.rpm_bucket:
+            wait = max(wait, self.rpm_bucket.reserve(1))
+        if self.tpm_bucket and tokens:
+            wait = max(wait, self.tpm_bucket.reserve(tokens))
+        with self._lock:
+            self.requests += 1
+            wait = max(wait, self._cooldown_until - time.monotonic())
+            self.waited_seconds += wait
+        return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """同步获取调用许可，返回等待的秒数。调用结束后必须调用 release"""
+        self.concurrency.acquire()
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """异步获取调用许可，返回等待的秒数。调用结束后必须调用 release"""
+        await self.concurrency.acquire_async()
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self.concurrency.release()
+                raise
+        return wait
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        """释放并发名额，并根据调用结果调整并发上限"""
+        self.concurrency.release()
+        if error is None:
+            self.concurrency.on_success()
+        elif is_rate_limit_error(error):
+            self.on_rate_limited(parse_retry_after(error))
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """收到 429：冷却 Retry-After 秒，并（每个冷却周期至多一次）减小并发上限"""
+        retry_after = retry_after if retry_after is not None else self.default_retry_after
+        now = time.monotonic()
+        with self._lock:
+            self.rate_limited += 1
+            self._cooldown_until = max(self._cooldown_until, now + retry_after)
+            decrease = now - self._last_decrease >= max(retry_after, self.default_retry_after)
+            if decrease:
+                self._last_decrease = now
+        if decrease:
+            self.concurrency.on_rate_limited()
+        logger.warning(f"{self.key} 触发限流，冷却 {retry_after:.1f} 秒，并发上限降为 {int(self.concurrency.limit)}")
+
+    def record_usage(self, actual_tokens: int, reserved_tokens: int) -> None:
+        """按实际 token 用量修正 TPM 桶"""
+        if self.tpm_bucket:
+            self.tpm_bucket.adjust(actual_tokens - reserved_tokens)
+
+    @contextmanager
+    def limit(self, tokens: int = 0):
+        """同步调用的限流上下文"""
+        waited = self.acquire(tokens)
+        set_span_attributes({f"ratelimit.{self.key}.waited_seconds": waited})
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(error)
+
+    @asynccontextmanager
+    async def async_limit(self, tokens: int = 0):
+        """异步调用的限流上下文"""
+        waited = await self.acquire_async(tokens)
+        set_span_attributes({f"ratelimit.{self.key}.waited_seconds": waited})
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "waited_seconds": self.waited_seconds,
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+        }
+
+class RateLimiterRegistry:
+    """进程级限流器注册表，按 provider/model 共享限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str) -> Optional[RateLimiter]:
+        """获取 provider/model 的限流器，限流关闭时返回 None"""
+        if not config.rate_limit.enable_rate_limiting:
+            return None
+
+        key = f"{provider}/{model}"
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limits = config.rate_limit.limits.get(key, {})
+                limiter = RateLimiter(
+                    key,
+                    rpm=limits.get("rpm", config.rate_limit.default_rpm),
+                    tpm=limits.get("tpm", config.rate_limit.default_tpm),
+                    max_concurrency=limits.get("max_concurrency", config.rate_limit.max_concurrency),
+                    min_concurrency=config.rate_limit.min_concurrency,
+                    decrease_factor=config.rate_limit.decrease_factor,
+                    default_retry_after=config.rate_limit.default_retry_after,
+                )
+                self._limiters[key] = limiter
+            return limiter
+
+    def reset(self) -> None:
+        """清空所有限流器（配置变更后重新创建）"""
+        with self._lock:
+            self._limiters.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {key: limiter.get_stats() for key, limiter in self._limiters.items()}
+
+# 全局限流器注册表
+rate_limiters = RateLimiterRegistry()
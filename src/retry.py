@@ -0,0 +1,46 @@
+"""
+重试策略模块
+对 LLM 调用错误分类，为可重试的错误计算带抖动的指数退避时间
+"""
+
+import random
+from enum import Enum
+from typing import Optional
+import httpx
+import openai
+from .config import config
+from .ratelimit import is_rate_limit_error, parse_retry_after
+
+class ErrorClass(str, Enum):
+    """错误分类"""
+    RATE_LIMITED = "rate_limited"  # 429，按 Retry-After 等待后重试
+    TRANSIENT = "transient"        # 5xx、超时、连接错误，退避后重试
+    FATAL = "fatal"                # 鉴权失败、请求无效等，重试无意义，直接抛出
+
+# 可重试的 HTTP 状态码（除 429 和 5xx 之外）
+_RETRYABLE_STATUS = {408, 409}
+
+def classify_error(error: BaseException) -> ErrorClass:
+    """按异常类型和 HTTP 状态码对错误分类"""
+    if is_rate_limit_error(error):
+        return ErrorClass.RATE_LIMITED
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return ErrorClass.TRANSIENT if status >= 500 or status in _RETRYABLE_STATUS else ErrorClass.FATAL
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, TimeoutError, ConnectionError)):
+        return ErrorClass.TRANSIENT
+    return ErrorClass.FATAL
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    """第 attempt 次重试前的等待时间（秒）
+
+    指数退避加完全抖动（在 0 到退避上限之间随机取值），避免多个调用同时重试；
+    限流错误携带 Retry-After 时至少等待服务端建议的时间。
+    """
+    cap = min(config.llm.retry_max_delay, config.llm.retry_base_delay * (2 ** (attempt - 1)))
+    delay = random.uniform(0, cap)
+    if error is not None:
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+    return delay
@@ -0,0 +1,114 @@
+"""
+模型路由模块
+按 Agent 角色选择模型，并统计每条路由的延迟和成本
+"""
+
+import functools
+import logging
+import threading
+from typing import Dict, Any, Optional
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+def resolve_model(route: Optional[str]) -> str:
+    """路由对应的模型名；"default"/"backup" 指向 LLMConfig 中的 default_model/backup_model"""
+    target = "default"
+    if route and config.routing.enable_model_routing:
+        target = config.routing.routes.get(route, "default")
+    if target == "default":
+        return config.llm.default_model
+    if target == "backup":
+        return config.llm.backup_model
+    return target
+
+@functools.lru_cache(maxsize=None)
+def anthropic_client_available() -> bool:
+    """AutoGen 的 Anthropic 客户端是否可用（需要安装兼容版本的 anthropic）"""
+    try:
+        from autogen.oai.anthropic import AnthropicClient  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# AutoGen 0.2.35 中只有 OpenAI 兼容客户端支持 stream=True，AnthropicClient 等会忽略该参数
+STREAMING_API_TYPES = ("openai", "azure")
+
+def supports_streaming(api_type: Optional[str]) -> bool:
+    """该 api_type 的 AutoGen 客户端能否流式输出"""
+    return (api_type or "openai") in STREAMING_API_TYPES
+
+def model_config_entry(model: str) -> Optional[Dict[str, Any]]:
+    """构建模型的 config_list 条目，缺少密钥或依赖时返回 None"""
+    if model.startswith("claude"):
+        if not config.llm.anthropic_api_key or not anthropic_client_available():
+            return None
+        return {"model": model, "api_key": config.llm.anthropic_api_key, "api_type": "anthropic"}
+    if not config.llm.openai_api_key:
+        return None
+    return {"model": model, "api_key": config.llm.openai_api_key}
+
+def route_config_entry(route: Optional[str]) -> Dict[str, Any]:
+    """路由的 config_list 条目，路由模型不可用时回退到默认模型"""
+    model = resolve_model(route)
+    entry = model_config_entry(model)
+    if entry is None and model != config.llm.default_model:
+        logger.warning(f"路由 {route} 的模型 {model} 缺少 API 密钥或依赖，回退到 {config.llm.default_model}")
+        entry = model_config_entry(config.llm.default_model)
+    # 默认模型缺少密钥时仍返回条目，由调用时报错，与未启用路由时的行为一致
+    return entry or {"model": config.llm.default_model, "api_key": config.llm.openai_api_key}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按 model_prices（美元 / 百万 token）估算调用成本，未配置价格的模型记为 0"""
+    prices = config.routing.model_prices.get(model, {})
+    return (prompt_tokens * prices.get("input", 0) + completion_tokens * prices.get("output", 0)) / 1_000_000
+
+class RouteStats:
+    """按路由和模型统计调用次数、延迟、token 用量和成本"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self,
+               route: str,
+               model: str,
+               latency: float,
+               prompt_tokens: int,
+               completion_tokens: int,
+               cancelled: bool = False) -> float:
+        """记录一次调用，返回本次估算成本；cancelled 表示对冲落败被中断的调用"""
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            entry = self._stats.setdefault(route, {}).setdefault(model, {
+                "calls": 0,
+                "total_latency_seconds": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost_usd": 0.0,
+                "cancelled_calls": 0,
+            })
+            entry["calls"] += 1
+            entry["cancelled_calls"] += int(cancelled)
+            entry["total_latency_seconds"] += latency
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += cost
+        return cost
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        with self._lock:
+            return {
+                route: {
+                    model: {**entry, "avg_latency_seconds": entry["total_latency_seconds"] / entry["calls"]}
+                    for model, entry in models.items()
+                }
+                for route, models in self._stats.items()
+            }
+
+# 全局路由统计
+route_stats = RouteStats()
@@ -4,16 +4,37 @@
 """
 
 import openai
+import httpx
 import asyncio
-from typing import Dict, Any, Optional, List, Union
+import contextlib
+import hashlib
+import importlib
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, deque
+from typing import Dict, Any, Optional, List, Union, Callable, Awaitable, Tuple
 from pydantic import BaseModel, Field, ValidationError
 from enum import Enum
 import logging
 from .config import config
-from .observability import traced_agent_operation, log_conversation
+from opentelemetry import metrics
+from .observability import traced_agent_operation, log_conversation, set_span_attributes, add_span_event
+from .cache import LRUCache
+from .ratelimit import rate_limiters
 
 logger = logging.getLogger(__name__)
 
+# 熔断器指标（未配置 MeterProvider 时为空操作）
+_meter = metrics.get_meter(__name__)
+_breaker_transitions = _meter.create_counter(
+    "circuit_breaker.transitions", description="熔断器状态切换次数"
+)
+_breaker_rejections = _meter.create_counter(
+    "circuit_breaker.rejected_calls", description="熔断器打开期间被拒绝的调用次数"
+)
+
 class ModerationResult(BaseModel):
     """内容审核结果"""
     flagged: bool
@@ -36,54 +57,672 @@ class AgentOutput(BaseModel):
     metadata: Dict[str, Any] = Field(default_factory=dict, description="附加元数据")
     sources: List[str] = Field(default_factory=list, description="信息来源")
 
+class AhoCorasickMatcher:
+    """Aho-Corasick 多模式匹配器，一次线性扫描找出文本中出现的所有词条
+    
+    词条和文本都经过 NFKC 归一化并忽略大小写，全角/半角写法视为相同。
+    """
+    
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(dict.fromkeys(self._normalize(p) for p in patterns if p and p.strip()))
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        
+        for index, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                if ch not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][ch] = len(self._goto) - 1
+                node = self._goto[node][ch]
+            self._output[node].append(index)
+        
+        # 按广度优先顺序构建失败指针
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return unicodedata.normalize("NFKC", text).casefold()
+    
+    def find_all(self, text: str) -> List[str]:
+        """返回文本中出现的所有词条（按词表顺序，去重）"""
+        if not self.patterns:
+            return []
+        
+        found = set()
+        node = 0
+        for ch in self._normalize(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            found.update(self._output[node])
+        return [self.patterns[i] for i in sorted(found)]
+
+class LocalModerationTier:
+    """本地审核层 - 级联审核的第一级
+    
+    - 命中屏蔽词：直接判定违规
+    - 命中复核词：交给下一级（远程审核）
+    - 可选的本地评分模型返回违规概率，低于 safe_below 判定安全，
+      高于 flag_above 判定违规，介于两者之间交给下一级
+    
+    classify 返回 None 表示无法确定，评分模型出错时同样交给下一级。任何实现 name 属性和
+    classify 方法的对象都可以加入 SafetyManager.moderation_tiers；带评分模型的审核层在线程池中执行。
+    """
+    
+    name = "local"
+    
+    def __init__(self,
+                 block_terms: List[str],
+                 review_terms: Optional[List[str]] = None,
+                 scorer: Optional[Callable[[str], float]] = None,
+                 safe_below: float = 0.05,
+                 flag_above: float = 0.95):
+        self.block_matcher = AhoCorasickMatcher(block_terms)
+        self.review_matcher = AhoCorasickMatcher(review_terms or [])
+        self.scorer = scorer
+        self.safe_below = safe_below
+        self.flag_above = flag_above
+    
+    def classify(self, content: str) -> Optional[ModerationResult]:
+        blocked = self.block_matcher.find_all(content)
+        if blocked:
+            return ModerationResult(
+                flagged=True,
+                categories={"local_blocklist": True},
+                category_scores={"local_blocklist": 1.0},
+                reason=f"命中本地屏蔽词: {', '.join(blocked)}"
+            )
+        
+        if self.review_matcher.find_all(content) or self.scorer is None:
+            return None
+        
+        score = self._score(content)
+        if score is None or self.safe_below < score < self.flag_above:
+            return None
+        
+        flagged = score >= self.flag_above
+        return ModerationResult(
+            flagged=flagged,
+            categories={"local_model": flagged},
+            category_scores={"local_model": score},
+            reason=f"本地模型判定违规 (score={score:.2f})" if flagged else None
+        )
+
+    def _score(self, content: str) -> Optional[float]:
+        """本地评分模型的违规概率，模型出错时返回 None"""
+        try:
+            return float(self.scorer(content))
+        except Exception as e:
+            logger.warning(f"本地审核评分模型出错: {e}")
+            return None
+
+    def classify_final(self, content: str, threshold: float) -> Optional[ModerationResult]:
+        """远程审核不可用时的最终判定：复核词按违规处理，评分与审核阈值比较
+        
+        评分模型出错时返回 None，由调用方按失败策略处理。
+        """
+        result = self.classify(content)
+        if result is not None and result.flagged:
+            return result
+        
+        reviewed = self.review_matcher.find_all(content)
+        if reviewed:
+            return ModerationResult(
+                flagged=True,
+                categories={"local_review": True},
+                category_scores={"local_review": 1.0},
+                reason=f"命中本地复核词且远程审核不可用: {', '.join(reviewed)}"
+            )
+        
+        if self.scorer is None:
+            return ModerationResult(flagged=False, categories={}, category_scores={})
+        
+        score = self._score(content)
+        if score is None:
+            return None
+        flagged = score > threshold
+        return ModerationResult(
+            flagged=flagged,
+            categories={"local_model": flagged},
+            category_scores={"local_model": score},
+            reason=f"本地模型判定违规 (score={score:.2f})" if flagged else None
+        )
+
+async def _close_on_cancel(client: openai.AsyncOpenAI) -> None:
+    """一直等待，被取消（事件循环结束或显式关闭）时关闭客户端"""
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        await client.close()
+
+async def _run_tier(tier: Any, method: Callable[..., Any], *args) -> Any:
+    """执行审核层的判定方法，带评分模型的审核层在线程池中执行，避免阻塞事件循环"""
+    if getattr(tier, "scorer", None) is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+def _load_scorer(path: str) -> Optional[Callable[[str], float]]:
+    """按 "模块:函数" 路径加载本地评分函数"""
+    try:
+        module_name, _, attr = path.partition(":")
+        return getattr(importlib.import_module(module_name), attr)
+    except (ImportError, AttributeError, ValueError) as e:
+        logger.warning(f"加载本地审核评分模型失败 ({path}): {e}")
+        return None
+
+class CircuitState(str, Enum):
+    """熔断器状态"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """熔断器
+    
+    - 关闭：统计最近 window_size 次调用，调用数达到 min_calls 后，失败率或慢调用比例
+      超过阈值时打开
+    - 打开：直接拒绝调用，open_seconds 后进入半开状态
+    - 半开：放行最多 half_open_max_calls 个探测调用，探测成功则关闭，失败或过慢则重新打开
+    
+    状态切换记录为当前 span 的事件，并计入 OpenTelemetry 指标。
+    """
+    
+    def __init__(self,
+                 name: str,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_seconds: float = 5.0,
+                 slow_call_rate_threshold: float = 0.5,
+                 window_size: int = 20,
+                 min_calls: int = 5,
+                 open_seconds: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.rejected_calls = 0
+        self.transitions: Counter = Counter()
+        self._state = CircuitState.CLOSED
+        self._window: deque = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+    
+    def allow_request(self) -> bool:
+        """是否放行本次调用"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CircuitState.CLOSED:
+                return True
+            
+            if self._state == CircuitState.HALF_OPEN:
+                # 探测调用被取消时不会上报结果，超时后允许新的探测
+                if time.monotonic() - self._probe_started_at > self.open_seconds:
+                    self._probes_in_flight = 0
+                if self._probes_in_flight < self.half_open_max_calls:
+                    self._probes_in_flight += 1
+                    self._probe_started_at = time.monotonic()
+                    return True
+            
+            self.rejected_calls += 1
+            _breaker_rejections.add(1, {"breaker": self.name})
+            return False
+    
+    def record_success(self, duration: float) -> None:
+        """记录一次成功调用及其耗时"""
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._open() if slow else self._close()
+                return
+            self._window.append((False, slow))
+            self._evaluate()
+    
+    def record_failure(self) -> None:
+        """记录一次失败调用"""
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._open()
+                return
+            self._window.append((True, False))
+            self._evaluate()
+    
+    def _evaluate(self) -> None:
+        if self._state != CircuitState.CLOSED or len(self._window) < self.min_calls:
+            return
+        calls = len(self._window)
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, slow in self._window if slow)
+        if failures / calls >= self.failure_rate_threshold or slow_calls / calls >= self.slow_call_rate_threshold:
+            self._open()
+    
+    def _maybe_half_open(self) -> None:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._probes_in_flight = 0
+            self._probe_started_at = time.monotonic()
+            self._transition(CircuitState.HALF_OPEN)
+    
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._transition(CircuitState.OPEN)
+    
+    def _close(self) -> None:
+        self._window.clear()
+        self._transition(CircuitState.CLOSED)
+    
+    def _transition(self, new_state: CircuitState) -> None:
+        old_state = self._state
+        self._state = new_state
+        self.transitions[f"{old_state.value}->{new_state.value}"] += 1
+        logger.warning(f"熔断器 {self.name}: {old_state.value} → {new_state.value}")
+        attributes = {"breaker": self.name, "from": old_state.value, "to": new_state.value}
+        add_span_event("circuit_breaker.state_change", attributes)
+        _breaker_transitions.add(1, attributes)
+
+def split_content_into_chunks(content: str, max_chars: int) -> List[str]:
+    """把长文本按段落或章节切分为不超过 max_chars 的分块
+    
+    以空行和 Markdown 标题为边界，相邻段落尽量合并到同一个分块；
+    单个段落过长时再按句子切分。max_chars <= 0 时不切分。
+    """
+    if max_chars <= 0 or len(content) <= max_chars:
+        return [content]
+    
+    paragraphs = [p for p in re.split(r"\n\s*\n|\n(?=#{1,6}\s)", content) if p.strip()]
+    pieces = []
+    for paragraph in paragraphs:
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(_split_long_paragraph(paragraph, max_chars))
+    
+    return _pack_pieces(pieces, max_chars, separator="\n\n")
+
+def _split_long_paragraph(paragraph: str, max_chars: int) -> List[str]:
+    """按句子切分过长的段落，单个句子仍然过长时按长度截断"""
+    sentences = [s for s in re.findall(r"[^。！？!?.\n]*(?:[。！？!?.\n]|$)", paragraph) if s]
+    pieces = []
+    for sentence in sentences:
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        pieces.append(sentence)
+    return _pack_pieces(pieces, max_chars, separator="")
+
+def _pack_pieces(pieces: List[str], max_chars: int, separator: str) -> List[str]:
+    """把连续的片段贪心合并为不超过 max_chars 的分块"""
+    chunks = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if len(candidate) <= max_chars:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+class ModerationBatcher:
+    """审核请求微批处理器
+    
+    收集时间窗口内（或达到最大批量时）的并发审核请求，合并为一次批量调用，
+    再把逐条结果分发给各个等待的协程。同一批次中的相同内容只发送一次。
+    必须在创建它的事件循环中使用。
+    """
+    
+    def __init__(self,
+                 send_batch: Callable[[List[str]], Awaitable[List[Any]]],
+                 max_batch_size: int = 32,
+                 window_seconds: float = 0.01):
+        self.send_batch = send_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_seconds = window_seconds
+        self.batches_sent = 0
+        self.items_sent = 0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+    
+    async def submit(self, content: str) -> Any:
+        """提交一条内容，等待所在批次返回其审核结果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((content, future))
+        
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_seconds, self._flush)
+        
+        return await future
+    
+    def _flush(self) -> None:
+        """把当前收集的请求作为一个批次发送"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        batch, self._pending = self._pending, []
+        batch = [(content, future) for content, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        inputs = list(dict.fromkeys(content for content, _ in batch))
+        try:
+            results = await self.send_batch(inputs)
+            if len(results) != len(inputs):
+                raise ValueError(f"审核服务返回 {len(results)} 条结果，预期 {len(inputs)} 条")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.batches_sent += 1
+        self.items_sent += len(inputs)
+        by_content = dict(zip(inputs, results))
+        for content, future in batch:
+            if not future.done():
+                future.set_result(by_content[content])
+
 class SafetyManager:
     """安全管理器"""
     
     def __init__(self):
         self.moderation_client = None
+        # 审核结果缓存：相同内容在相同阈值下的判定结果不变
+        self.moderation_cache = LRUCache(
+            max_entries=config.security.moderation_cache_max_entries,
+            ttl_seconds=config.security.moderation_cache_ttl_seconds,
+        )
+        self.moderation_api_calls = 0
+        self.moderation_inputs_sent = 0
+        # 级联审核：本地层能确定的内容不再请求远程审核服务
+        self.moderation_tiers = self._build_moderation_tiers()
+        self.tier_decisions: Counter = Counter()
+        self.moderation_breaker = CircuitBreaker(
+            "moderation",
+            failure_rate_threshold=config.security.moderation_breaker_failure_rate,
+            slow_call_seconds=config.security.moderation_breaker_slow_call_seconds,
+            slow_call_rate_threshold=config.security.moderation_breaker_slow_call_rate,
+            window_size=config.security.moderation_breaker_window,
+            min_calls=config.security.moderation_breaker_min_calls,
+            open_seconds=config.security.moderation_breaker_open_seconds,
+            half_open_max_calls=config.security.moderation_breaker_half_open_calls,
+        )
         self._initialize_clients()
     
+    def _build_moderation_tiers(self) -> List[LocalModerationTier]:
+        """根据配置构建本地审核层，未配置词表和评分模型时不启用"""
+        scorer = _load_scorer(config.security.local_scorer) if config.security.local_scorer else None
+        if not (config.security.local_block_terms or config.security.local_review_terms or scorer):
+            return []
+        return [LocalModerationTier(
+            block_terms=config.security.local_block_terms,
+            review_terms=config.security.local_review_terms,
+            scorer=scorer,
+            safe_below=config.security.local_safe_below,
+            flag_above=config.security.local_flag_above,
+        )]
+    
     def _initialize_clients(self):
-        """初始化外部服务客户端"""
-        if config.llm.openai_api_key:
-            self.moderation_client = openai.OpenAI(api_key=config.llm.openai_api_key)
+        """初始化外部服务客户端
+        
+        审核客户端是异步客户端，其 httpx 连接池绑定创建它的事件循环，
+        因此在首次使用时按事件循环创建（见 _get_moderation_client），并在该事件循环结束时关闭。
+        """
+        self.moderation_client = None
+        self.moderation_batcher = None
+        self._client_loop = None
+        self._client_guard: Optional[asyncio.Task] = None
+    
+    def _get_moderation_client(self) -> Optional[openai.AsyncOpenAI]:
+        """获取当前事件循环的异步审核客户端，同一事件循环内的所有审核请求共享连接池"""
+        if not config.llm.openai_api_key:
+            return None
+        
+        loop = asyncio.get_running_loop()
+        if self.moderation_client is None or self._client_loop is not loop:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.security.moderation_max_connections,
+                    max_keepalive_connections=config.security.moderation_max_keepalive_connections,
+                    keepalive_expiry=config.security.moderation_keepalive_expiry,
+                ),
+                timeout=config.security.moderation_timeout,
+            )
+            self.moderation_client = openai.AsyncOpenAI(
+                api_key=config.llm.openai_api_key,
+                base_url=config.security.moderation_base_url,
+                http_client=http_client,
+                max_retries=config.security.moderation_max_retries,
+            )
+            self.moderation_batcher = ModerationBatcher(
+                self._send_moderation_batch,
+                max_batch_size=config.security.moderation_max_batch_size,
+                window_seconds=config.security.moderation_batch_window_ms / 1000,
+            )
+            self._client_loop = loop
+            # 连接池只能在所属的事件循环中关闭：asyncio.run 退出前会取消所有未完成的任务，
+            # 守护任务被取消时关闭客户端，切换事件循环后旧客户端也不会泄漏连接池
+            self._client_guard = loop.create_task(_close_on_cancel(self.moderation_client))
+        return self.moderation_client
+    
+    async def _send_moderation_batch(self, inputs: List[str]) -> List[Any]:
+        """以一次请求审核多条内容，按输入顺序返回各条结果，并向熔断器上报结果"""
+        self.moderation_api_calls += 1
+        self.moderation_inputs_sent += len(inputs)
+        limiter = rate_limiters.get("openai", "moderation")
+        async with limiter.async_limit() if limiter else contextlib.nullcontext():
+            # 只计算远程调用本身的耗时，在限流器中排队和冷却的时间不算慢调用
+            start_time = time.monotonic()
+            try:
+                response = await self.moderation_client.moderations.create(input=inputs)
+            except openai.APIStatusError as e:
+                # 只有服务端错误和限流说明服务不可用，其他客户端错误不计入失败率；
+                # 启用限流器时 429 由限流器冷却处理，不计入熔断器
+                if e.status_code >= 500 or (e.status_code == 429 and limiter is None):
+                    self.moderation_breaker.record_failure()
+                elif e.status_code != 429:
+                    self.moderation_breaker.record_success(time.monotonic() - start_time)
+                raise
+            except Exception:
+                self.moderation_breaker.record_failure()
+                raise
+            self.moderation_breaker.record_success(time.monotonic() - start_time)
+        return response.results
+    
+    async def aclose(self) -> None:
+        """关闭审核客户端的连接池"""
+        if self.moderation_client is not None:
+            guard = self._client_guard
+            if guard is not None and not guard.done() and guard.get_loop() is asyncio.get_running_loop():
+                guard.cancel()
+                await asyncio.gather(guard, return_exceptions=True)
+            else:
+                await self.moderation_client.close()
+            self.moderation_client = None
+            self.moderation_batcher = None
+            self._client_loop = None
+            self._client_guard = None
     
     @traced_agent_operation("content_moderation")
     async def moderate_content(self, content: str) -> ModerationResult:
-        """使用 OpenAI Moderation API 检查内容安全性"""
-        if not config.security.enable_content_moderation or not self.moderation_client:
+        """使用 OpenAI Moderation API 检查内容安全性（异步请求，不阻塞事件循环）
+        
+        超过 moderation_chunk_chars 的长文本按段落切分后并发审核，
+        任一分块被标记时立即取消其余分块的请求。
+        """
+        if not config.security.enable_content_moderation:
             return ModerationResult(
                 flagged=False,
                 categories={},
                 category_scores={}
             )
         
+        # 没有可用的远程客户端时仍执行本地审核层
+        self._get_moderation_client()
+        
+        chunks = split_content_into_chunks(content, config.security.moderation_chunk_chars)
+        if len(chunks) == 1:
+            result, decisions = await self._moderate_text(content)
+            set_span_attributes({f"moderation.tier.{tier}": decision for tier, decision in decisions.items()})
+            return result
+        
+        return await self._moderate_chunks(chunks)
+    
+    async def _moderate_chunks(self, chunks: List[str]) -> ModerationResult:
+        """并发审核各个分块，出现被标记的分块时取消其余请求并汇总结果
+
+        分块不经过微批处理器：同一内容的分块会被合并为一个请求同时返回，
+        既没有并发收益，也无法在某个分块被标记时取消其余请求。
+        """
+        tasks = [asyncio.create_task(self._moderate_text(chunk, coalesce=False)) for chunk in chunks]
+        results = []
+        decision_counts: Counter = Counter()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result, decisions = await next_done
+                results.append(result)
+                decision_counts.update(f"{tier}.{decision}" for tier, decision in decisions.items())
+                if result.flagged:
+                    break
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        set_span_attributes({
+            "moderation.chunks": len(chunks),
+            "moderation.chunks_checked": len(results),
+            **{f"moderation.tier.{key}": count for key, count in decision_counts.items()},
+        })
+        
+        # 汇总：类别取并集，分数取各分块最大值
+        categories: Dict[str, bool] = {}
+        category_scores: Dict[str, float] = {}
+        for result in results:
+            for category, flagged_status in result.categories.items():
+                categories[category] = categories.get(category, False) or flagged_status
+            for category, score in result.category_scores.items():
+                category_scores[category] = max(category_scores.get(category, 0.0), score)
+        
+        flagged_results = [r for r in results if r.flagged]
+        if flagged_results:
+            reason = flagged_results[0].reason
+        else:
+            # 分块审核失败时保留异常原因
+            reason = next((r.reason for r in results if r.reason), None)
+        
+        return ModerationResult(
+            flagged=bool(flagged_results),
+            categories=categories,
+            category_scores=category_scores,
+            reason=reason
+        )
+    
+    async def _moderate_text(self, content: str, coalesce: bool = True) -> Tuple[ModerationResult, Dict[str, str]]:
+        """按 本地审核层 → 缓存 → 远程审核 的顺序审核单段文本
+        
+        coalesce 为 False 时远程审核单独发送一个请求，不与其他并发请求合并。
+        返回审核结果和各级的判定（如 {"local": "escalate", "cache": "miss", "remote": "checked"}）
+        """
+        decisions: Dict[str, str] = {}
+        for tier in self.moderation_tiers:
+            local_result = await _run_tier(tier, tier.classify, content)
+            if local_result is None:
+                decisions[tier.name] = "escalate"
+                continue
+            decisions[tier.name] = "flagged" if local_result.flagged else "safe"
+            self._record_tier_decisions(decisions)
+            return local_result, decisions
+        
+        threshold = config.security.moderation_threshold
+        cache_key = self._moderation_cache_key(content, threshold)
+        cached = self.moderation_cache.get(cache_key)
+        decisions["cache"] = "hit" if cached is not None else "miss"
+        if cached is not None:
+            self._record_tier_decisions(decisions)
+            return cached.model_copy(deep=True), decisions
+        
+        if self.moderation_batcher is None:
+            decisions["remote"] = "unavailable"
+            self._record_tier_decisions(decisions)
+            return ModerationResult(flagged=False, categories={}, category_scores={}), decisions
+        
+        if not self.moderation_breaker.allow_request():
+            decisions["breaker"] = "open"
+            self._record_tier_decisions(decisions)
+            return await self._breaker_open_result(content), decisions
+        
+        decisions["remote"] = "checked"
+        self._record_tier_decisions(decisions)
         try:
-            response = self.moderation_client.moderations.create(input=content)
-            result = response.results[0]
+            if coalesce:
+                # 并发的审核请求由微批处理器合并发送
+                result = await self.moderation_batcher.submit(content)
+            else:
+                result = (await self._send_moderation_batch([content]))[0]
+            
+            # 新版审核模型的部分类别可能没有返回值，忽略缺失的类别
+            categories = {k: bool(v) for k, v in result.categories.model_dump().items() if v is not None}
+            category_scores = {k: v for k, v in result.category_scores.model_dump().items() if v is not None}
             
             # 检查是否超过阈值
             flagged = result.flagged
-            max_score = max(result.category_scores.model_dump().values()) if result.category_scores else 0
+            max_score = max(category_scores.values()) if category_scores else 0
             
-            if max_score > config.security.moderation_threshold:
+            if max_score > threshold:
                 flagged = True
             
             # 找出触发的类别
             reason = None
             if flagged:
                 triggered_categories = [
-                    category for category, flagged_status in result.categories.model_dump().items()
-                    if flagged_status or result.category_scores.model_dump().get(category, 0) > config.security.moderation_threshold
+                    category for category, flagged_status in categories.items()
+                    if flagged_status or category_scores.get(category, 0) > threshold
                 ]
                 reason = f"触发类别: {', '.join(triggered_categories)}"
             
-            return ModerationResult(
+            moderation_result = ModerationResult(
                 flagged=flagged,
-                categories=result.categories.model_dump(),
-                category_scores=result.category_scores.model_dump(),
+                categories=categories,
+                category_scores=category_scores,
                 reason=reason
             )
+            # 只缓存审核服务给出的判定，服务异常时的结果不缓存
+            self.moderation_cache.set(cache_key, moderation_result.model_copy(deep=True))
+            return moderation_result, decisions
         
         except Exception as e:
             logger.error(f"内容审核失败: {e}")
@@ -93,7 +732,67 @@ class SafetyManager:
                 categories={},
                 category_scores={},
                 reason=f"审核服务异常: {str(e)}"
+            ), decisions
+    
+    @staticmethod
+    def _moderation_cache_key(content: str, threshold: float) -> str:
+        """审核缓存键：内容哈希 + 审核阈值"""
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return f"{threshold}:{digest}"
+    
+    async def _breaker_open_result(self, content: str) -> ModerationResult:
+        """熔断器打开时按 moderation_breaker_open_policy 给出判定，不等待远程服务"""
+        policy = config.security.moderation_breaker_open_policy
+        if policy == "fail_closed":
+            return ModerationResult(
+                flagged=True,
+                categories={},
+                category_scores={},
+                reason="审核服务熔断中，按 fail_closed 策略拒绝"
             )
+        
+        if policy == "local_only":
+            final_tiers = [tier for tier in self.moderation_tiers if hasattr(tier, "classify_final")]
+            if final_tiers:
+                tier = final_tiers[0]
+                result = await _run_tier(tier, tier.classify_final, content, config.security.moderation_threshold)
+                if result is not None:
+                    return result
+                logger.warning("审核服务熔断中且本地审核层无法判定，按 fail_open 策略放行")
+            else:
+                logger.warning("审核服务熔断中且未配置本地审核层，按 fail_open 策略放行")
+        
+        return ModerationResult(
+            flagged=False,
+            categories={},
+            category_scores={},
+            reason="审核服务熔断中，跳过远程审核"
+        )
+    
+    def _record_tier_decisions(self, decisions: Dict[str, str]) -> None:
+        self.tier_decisions.update(f"{tier}.{decision}" for tier, decision in decisions.items())
+    
+    def get_moderation_stats(self) -> Dict[str, Any]:
+        """获取审核缓存和级联各级的统计"""
+        cache_stats = self.moderation_cache.get_stats()
+        local_decided = sum(
+            count for key, count in self.tier_decisions.items()
+            if key.endswith((".flagged", ".safe"))
+        )
+        return {
+            "api_calls": self.moderation_api_calls,
+            "cache_hits": cache_stats["hits"],
+            "cache_misses": cache_stats["misses"],
+            "cache_hit_rate": cache_stats["hit_rate"],
+            "cache_size": cache_stats["size"],
+            "local_decisions": local_decided,
+            "avoided_calls": cache_stats["hits"] + local_decided,
+            "inputs_sent": self.moderation_inputs_sent,
+            "tier_decisions": dict(self.tier_decisions),
+            "breaker_state": self.moderation_breaker.state.value,
+            "breaker_rejected_calls": self.moderation_breaker.rejected_calls,
+            "breaker_transitions": dict(self.moderation_breaker.transitions),
+        }
     
     @traced_agent_operation("output_validation")
     def validate_agent_output(self, raw_output: str, agent_name: str) -> tuple[ValidationStatus, Optional[AgentOutput]]:
@@ -183,7 +882,14 @@ class OutputValidator:
                                      raw_output: str, 
                                      agent_name: str,
                                      correction_callback=None) -> Optional[AgentOutput]:
-        """带自修复的验证循环"""
+        """带自修复的验证循环
+        
+        每次尝试中内容安全检查和格式验证并发执行，任一检查给出确定的失败时
+        取消另一项检查；同一次循环中已审核过的相同内容不再重复审核。
+        """
+        
+        # 本次循环内已审核的内容及其结果
+        moderated: Dict[str, ModerationResult] = {}
         
         for attempt in range(config.security.max_retry_attempts):
             log_conversation(
@@ -192,9 +898,16 @@ class OutputValidator:
                 "system"
             )
             
-            # 1. 内容安全检查
-            moderation_result = await self.safety_manager.moderate_content(raw_output)
-            if moderation_result.flagged:
+            # 1. 内容安全检查与格式、质量验证并发执行
+            moderation_result, status, validated_output = await self._run_checks(
+                raw_output, agent_name, moderated
+            )
+            set_span_attributes({
+                f"validation.attempt_{attempt + 1}.moderation_skipped": moderation_result is None,
+                f"validation.attempt_{attempt + 1}.format_status": status.value if status else "cancelled",
+            })
+            
+            if moderation_result is not None and moderation_result.flagged:
                 logger.warning(f"内容被标记为不安全: {moderation_result.reason}")
                 if attempt == config.security.max_retry_attempts - 1:
                     return None  # 最后一次尝试仍然不安全，放弃
@@ -209,9 +922,7 @@ class OutputValidator:
                 else:
                     return None
             
-            # 2. 格式和质量验证
-            status, validated_output = self.safety_manager.validate_agent_output(raw_output, agent_name)
-            
+            # 2. 格式和质量验证结果
             if status == ValidationStatus.VALID:
                 log_conversation(
                     "Validator", 
@@ -229,12 +940,53 @@ class OutputValidator:
                     )
                     continue
             
-            # 验证失败
-            if attempt == config.security.max_retry_attempts - 1:
-                logger.error(f"❌ {agent_name} 输出验证最终失败")
-                return None
+            # 验证失败且内容没有被修正：再次尝试只会得到相同的结果
+            logger.error(f"❌ {agent_name} 输出验证最终失败")
+            return None
         
         return None
+    
+    async def _run_checks(self,
+                          raw_output: str,
+                          agent_name: str,
+                          moderated: Dict[str, ModerationResult]):
+        """并发执行内容审核和格式验证
+        
+        Returns:
+            (审核结果, 格式验证状态, 验证后的输出)。某项检查因另一项先失败而被取消时，
+            对应的结果为 None。
+        """
+        moderation_result = moderated.get(raw_output)
+        if moderation_result is not None and moderation_result.flagged:
+            return moderation_result, None, None
+        
+        format_task = asyncio.create_task(
+            asyncio.to_thread(self.safety_manager.validate_agent_output, raw_output, agent_name)
+        )
+        pending = {format_task}
+        moderation_task = None
+        if moderation_result is None:
+            moderation_task = asyncio.create_task(self.safety_manager.moderate_content(raw_output))
+            pending.add(moderation_task)
+        
+        status = validated_output = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if moderation_task in done:
+                    moderation_result = moderation_task.result()
+                    moderated[raw_output] = moderation_result
+                    if moderation_result.flagged:
+                        break
+                if format_task in done:
+                    status, validated_output = format_task.result()
+                    if status != ValidationStatus.VALID:
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        return moderation_result, status, validated_output
 
 # 全局实例
 safety_manager = SafetyManager()
@@ -0,0 +1,208 @@
+"""
+流式事件模块
+分析过程中按发生顺序产生类型化事件：Agent 发言开始、token 增量、发言结束、验证结果和最终输出
+"""
+
+import asyncio
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, Optional, Protocol
+from pydantic import BaseModel, Field
+from autogen.io import IOStream
+from .safety import AgentOutput
+
+logger = logging.getLogger(__name__)
+
+# OpenAIWrapper 流式输出前后打印的终端颜色控制序列
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+class AnalysisEventType(str, Enum):
+    """分析事件类型"""
+    TURN_STARTED = "turn_started"    # Agent 开始发言
+    TOKEN = "token"                  # LLM 流式输出的 token 增量
+    TURN_FINISHED = "turn_finished"  # Agent 发言结束，content 为完整发言
+    VALIDATION = "validation"        # 输出验证结果
+    FINAL = "final"                  # 最终输出，output 为验证后的结果（失败时为 None）
+
+class AnalysisEvent(BaseModel):
+    """分析过程中产生的事件"""
+    type: AnalysisEventType
+    agent: Optional[str] = Field(default=None, description="产生事件的 Agent 名称")
+    turn: Optional[int] = Field(default=None, description="发言编号，同一次发言的开始、token 和结束事件编号相同")
+    content: str = Field(default="", description="token 增量、完整发言或验证说明")
+    output: Optional[AgentOutput] = Field(default=None, description="最终输出，仅 final 事件")
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="附加信息")
+    timestamp: float = Field(default_factory=time.time)
+
+class AnalysisEventStream:
+    """事件队列，可从任意线程写入（LLM 调用在线程池中执行），由事件循环中的消费者读取"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._turns = 0
+
+    def emit(self, event: Optional[AnalysisEvent]) -> None:
+        """写入事件，None 表示事件流结束"""
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:
+            # 消费者已退出且事件循环已关闭，线程池中剩余的调用产生的事件直接丢弃
+            pass
+
+    async def get(self) -> Optional[AnalysisEvent]:
+        return await self._queue.get()
+
+    def next_turn(self) -> int:
+        self._turns += 1
+        return self._turns
+
+class TokenListener(Protocol):
+    """在调用方线程之外接收 LLM 流式输出的监听器"""
+
+    def start(self) -> None:
+        """一次新的 LLM 调用开始（重试时之前收到的内容作废）"""
+        ...
+
+    def append(self, text: str) -> None:
+        """收到一段输出增量"""
+        ...
+
+_current_stream: ContextVar[Optional[AnalysisEventStream]] = ContextVar("analysis_event_stream", default=None)
+_current_turn: ContextVar[Optional[int]] = ContextVar("analysis_turn", default=None)
+_token_listener: ContextVar[Optional[TokenListener]] = ContextVar("token_listener", default=None)
+
+def emit_event(event_type: AnalysisEventType, **fields) -> None:
+    """向当前分析的事件流写入事件，没有消费者时不做任何事"""
+    stream = _current_stream.get()
+    if stream is not None:
+        stream.emit(AnalysisEvent(type=event_type, **fields))
+
+def start_turn(agent_name: str) -> Optional[int]:
+    """产生 turn_started 事件并返回发言编号，之后同一上下文中的 token 事件使用该编号"""
+    stream = _current_stream.get()
+    if stream is None:
+        return None
+    turn = stream.next_turn()
+    _current_turn.set(turn)
+    stream.emit(AnalysisEvent(type=AnalysisEventType.TURN_STARTED, agent=agent_name, turn=turn))
+    return turn
+
+def finish_turn(turn: Optional[int],
+                agent_name: str,
+                reply: Any = None,
+                error: Optional[Exception] = None,
+                cancelled: bool = False) -> None:
+    """产生 turn_finished 事件，发言失败或被取消时在 metadata 中记录"""
+    if turn is None:
+        return
+    content = reply.get("content") if isinstance(reply, dict) else reply
+    metadata: Dict[str, Any] = {}
+    if error is not None:
+        metadata["error"] = str(error)
+    if cancelled:
+        metadata["cancelled"] = True
+    emit_event(
+        AnalysisEventType.TURN_FINISHED,
+        agent=agent_name,
+        turn=turn,
+        content=str(content or ""),
+        metadata=metadata,
+    )
+
+@contextmanager
+def listen_tokens(listener: TokenListener) -> Iterator[None]:
+    """在当前上下文中监听 LLM 流式输出，期间的 LLM 调用以流式请求发出"""
+    token = _token_listener.set(listener)
+    try:
+        yield
+    finally:
+        _token_listener.reset(token)
+
+class _TokenIOStream:
+    """AutoGen IOStream 适配器：把 OpenAIWrapper 流式打印的内容转为 token 事件并交给监听器"""
+
+    def __init__(self,
+                 stream: Optional[AnalysisEventStream],
+                 listener: Optional[TokenListener],
+                 agent_name: str,
+                 turn: Optional[int]):
+        self._stream = stream
+        self._listener = listener
+        self._agent_name = agent_name
+        self._turn = turn
+
+    def print(self, *objects: Any, sep: str = " ", end: str = "\n", flush: bool = False) -> None:
+        # 设置终端颜色的打印（"\033[32m"、"\033[0m\n"）不是模型输出
+        text = sep.join(str(o) for o in objects if not _ANSI_ESCAPE.search(str(o)))
+        if not text:
+            return
+        if self._listener is not None:
+            self._listener.append(text)
+        if self._stream is not None:
+            self._stream.emit(AnalysisEvent(
+                type=AnalysisEventType.TOKEN, agent=self._agent_name, turn=self._turn, content=text,
+            ))
+
+    def input(self, prompt: str = "", *, password: bool = False) -> str:
+        raise RuntimeError("流式分析过程中不支持交互输入")
+
+class _StreamingClient:
+    """为每次请求加上 stream=True 的 LLM 客户端代理"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, **params):
+        return self._client.create(stream=True, **params)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+@contextmanager
+def token_stream(agent_name: str, llm_client) -> Iterator[Any]:
+    """LLM 调用期间把流式输出转为 token 事件并交给监听器，返回本次调用应使用的客户端
+
+    没有活动的事件流和监听器时原样返回客户端，请求不开启流式输出。
+    """
+    stream = _current_stream.get()
+    listener = _token_listener.get()
+    if stream is None and listener is None:
+        yield llm_client
+        return
+    if listener is not None:
+        listener.start()
+    with IOStream.set_default(_TokenIOStream(stream, listener, agent_name, _current_turn.get())):
+        yield _StreamingClient(llm_client)
+
+async def stream_events(run: Awaitable[Optional[AgentOutput]]) -> AsyncIterator[AnalysisEvent]:
+    """在新任务中执行 run，按发生顺序产出执行期间的事件，最后产出 final 事件
+
+    消费者提前退出时取消执行中的任务。
+    """
+    stream = AnalysisEventStream(asyncio.get_running_loop())
+
+    async def runner() -> None:
+        # 任务拥有独立的上下文副本，事件流只对本次分析可见
+        _current_stream.set(stream)
+        try:
+            output = await run
+            stream.emit(AnalysisEvent(type=AnalysisEventType.FINAL, output=output))
+        finally:
+            stream.emit(None)
+
+    task = asyncio.ensure_future(runner())
+    try:
+        while True:
+            event = await stream.get()
+            if event is None:
+                break
+            yield event
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
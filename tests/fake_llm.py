@@ -0,0 +1,102 @@
+"""
+测试用本地 LLM 客户端
+替代 AutoGen 的 OpenAIWrapper，不发起网络请求并记录每次请求的消息
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+from autogen.io import IOStream
+
+# Agent 构造时会创建 OpenAI 客户端，需要一个占位密钥
+os.environ.setdefault("OPENAI_API_KEY", "sk-test-placeholder")
+
+def default_reply(agent_name: str, messages: List[Dict]) -> str:
+    """默认回复：返回固定长度的内容，便于比较提示词大小"""
+    return f"{agent_name} 的分析结论：市场保持增长，建议持续关注竞争格局和政策变化。"
+
+class FakeLLMClient:
+    """模拟 OpenAIWrapper 的最小接口"""
+
+    def __init__(self, agent_name: str, model: str = "fake-model",
+                 reply_fn: Optional[Callable[[str, List[Dict]], str]] = None,
+                 chunk_size: int = 8, chunk_delay: float = 0):
+        self.agent_name = agent_name
+        self.model = model
+        self.reply_fn = reply_fn or default_reply
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls: List[List[Dict]] = []
+        self.stream_requests = 0
+
+    def create(self, **params):
+        messages = params.get("messages", [])
+        self.calls.append([dict(m) for m in messages])
+        text = self.reply_fn(self.agent_name, messages)
+        if params.get("stream"):
+            self._print_chunks(text)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages)
+        return SimpleNamespace(
+            text=text,
+            model=self.model,
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(text)),
+        )
+
+    def _print_chunks(self, text: str) -> None:
+        """与 OpenAIWrapper 的流式输出一致：按块打印到当前 IOStream，前后带终端颜色控制序列"""
+        self.stream_requests += 1
+        iostream = IOStream.get_default()
+        iostream.print("\033[32m", end="")
+        for start in range(0, len(text), self.chunk_size):
+            time.sleep(self.chunk_delay)
+            iostream.print(text[start:start + self.chunk_size], end="", flush=True)
+        iostream.print("\033[0m\n")
+
+    def extract_text_or_completion_object(self, response):
+        return [response.text]
+
+    def clear_usage_summary(self):
+        pass
+
+    def prompt_sizes(self) -> List[int]:
+        """每次请求的提示词字符数"""
+        return [sum(len(str(m.get("content", ""))) for m in call) for call in self.calls]
+
+def install_fake_llm(team, reply_fn=None, **client_kwargs) -> Dict[str, FakeLLMClient]:
+    """为团队中所有带 LLM 的 Agent 安装假客户端，client_kwargs 传给 FakeLLMClient"""
+    clients = {}
+    agents = dict(team.agents)
+    if getattr(team, "corrector", None) is not None:
+        agents["corrector"] = team.corrector
+    for key, agent in agents.items():
+        if getattr(agent, "client", None) is not None:
+            clients[key] = FakeLLMClient(agent.name, reply_fn=reply_fn, **client_kwargs)
+            agent.client = clients[key]
+    return clients
+
+@contextmanager
+def offline_config(**cache_overrides):
+    """测试期间关闭内容审核、LLM 响应缓存和分析结果缓存，退出时恢复原配置
+
+    传入 cache_overrides 时按给定值修改缓存配置（例如启用缓存并指向临时文件）。
+    测试中对 config.llm、config.agent、config.security、config.cache、config.rate_limit、config.routing 和 config.hedging 的其他修改也会在退出时恢复，
+    退出时同时清空共享限流器，避免冷却状态影响后续测试。
+    """
+    from src.config import config
+    from src.ratelimit import rate_limiters
+
+    saved = {section: getattr(config, section).model_dump() for section in ("llm", "agent", "security", "cache", "rate_limit", "routing", "hedging")}
+    config.security.enable_content_moderation = False
+    config.cache.enable_llm_cache = False
+    config.cache.enable_result_cache = False
+    for key, value in cache_overrides.items():
+        setattr(config.cache, key, value)
+    try:
+        yield config
+    finally:
+        for section, values in saved.items():
+            for key, value in values.items():
+                setattr(getattr(config, section), key, value)
+        rate_limiters.reset()
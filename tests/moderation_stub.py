@@ -0,0 +1,155 @@
+"""
+测试用本地审核服务
+兼容 OpenAI /v1/moderations 接口的 HTTP 替身，记录请求数、并发度和连接数
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Sequence, Union
+
+CATEGORIES = [
+    "harassment", "harassment/threatening", "hate", "hate/threatening", "illicit", "illicit/violent",
+    "self-harm", "self-harm/instructions", "self-harm/intent",
+    "sexual", "sexual/minors", "violence", "violence/graphic",
+]
+
+class ModerationStubServer:
+    """本地审核服务替身
+
+    Args:
+        delay: 每个请求的处理延迟（秒），也可以是根据请求输入列表返回延迟的函数
+        flagged_terms: 包含这些词的文本在 violence 类别得到高分
+        fail: 为 True 时所有请求返回错误
+        fail_status: 返回错误时的 HTTP 状态码
+        retry_after: 返回 429 时携带的 Retry-After 头（秒）
+    """
+
+    def __init__(self, delay: Union[float, Callable[[List[str]], float]] = 0.0, flagged_terms: Sequence[str] = ("违规",),
+                 fail: bool = False, fail_status: int = 400, retry_after: Optional[float] = None):
+        self.delay = delay
+        self.flagged_terms = list(flagged_terms)
+        self.fail = fail
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.inputs: List[str] = []
+        self.requests = 0
+        self.connections = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def score(self, text: str) -> float:
+        return 0.95 if any(term in text for term in self.flagged_terms) else 0.01
+
+    def _result(self, text: str) -> dict:
+        score = self.score(text)
+        scores = {category: 0.0 for category in CATEGORIES}
+        scores["violence"] = score
+        return {
+            "flagged": score > 0.5,
+            "categories": {category: scores[category] > 0.5 for category in CATEGORIES},
+            "category_scores": scores,
+            "category_applied_input_types": {category: ["text"] for category in CATEGORIES},
+        }
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                inputs = body.get("input", "")
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+
+                with stub._lock:
+                    stub.requests += 1
+                    stub.inputs.extend(inputs)
+                    stub.active += 1
+                    stub.peak = max(stub.peak, stub.active)
+                try:
+                    delay = stub.delay(inputs) if callable(stub.delay) else stub.delay
+                    if delay:
+                        time.sleep(delay)
+                finally:
+                    with stub._lock:
+                        stub.active -= 1
+
+                if stub.fail:
+                    status, payload = stub.fail_status, {"error": {"message": "stub failure", "type": "stub_error"}}
+                else:
+                    status, payload = 200, {
+                        "id": f"modr-stub-{stub.requests}",
+                        "model": "omni-moderation-latest",
+                        "results": [stub._result(text) for text in inputs],
+                    }
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429 and stub.retry_after is not None:
+                    self.send_header("Retry-After", str(stub.retry_after))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端已取消请求并断开连接
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "ModerationStubServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+@contextmanager
+def moderation_service(**stub_kwargs):
+    """启动本地审核服务并让 SafetyManager 指向它，退出时恢复配置"""
+    from src.config import config
+
+    enabled = config.security.enable_content_moderation
+    base_url = config.security.moderation_base_url
+    with ModerationStubServer(**stub_kwargs) as stub:
+        config.security.enable_content_moderation = True
+        config.security.moderation_base_url = stub.url
+        try:
+            yield stub
+        finally:
+            config.security.enable_content_moderation = enabled
+            config.security.moderation_base_url = base_url
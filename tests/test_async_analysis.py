@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+异步分析测试
+验证 analyze_market 在 LLM 调用期间不阻塞事件循环
+"""
+
+import asyncio
+import threading
+import time
+from tests.fake_llm import install_fake_llm, offline_config
+from src.agents import MarketAnalysisTeam
+from src.batch import BatchRunner
+
+class SlowReply:
+    """带延迟的假回复，统计同时进行的 LLM 调用数"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __call__(self, agent_name, messages):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return f"{agent_name} 的分析结论：市场需求稳步增长，建议加大研发投入。"
+
+def test_event_loop_not_blocked():
+    """分析进行期间其他协程仍能被调度"""
+    with offline_config():
+        team = MarketAnalysisTeam()
+        install_fake_llm(team, reply_fn=SlowReply())
+
+        async def main():
+            ticks = 0
+            done = asyncio.Event()
+
+            async def ticker():
+                nonlocal ticks
+                while not done.is_set():
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker_task = asyncio.create_task(ticker())
+            result = await team.analyze_market("分析新能源储能技术的市场潜力")
+            done.set()
+            await ticker_task
+            return result, ticks
+
+        result, ticks = asyncio.run(main())
+        assert result is not None
+        assert ticks > 10, f"事件循环被阻塞，仅调度了 {ticks} 次"
+
+def test_concurrent_analyses_overlap():
+    """批量并发时多个分析的 LLM 调用真正重叠"""
+    with offline_config():
+        slow = SlowReply()
+
+        def factory():
+            team = MarketAnalysisTeam()
+            install_fake_llm(team, reply_fn=slow)
+            return team
+
+        runner = BatchRunner(concurrency=3, team_factory=factory)
+        results = asyncio.run(runner.run(["查询A", "查询B", "查询C"]))
+
+        assert all(r["status"] == "success" for r in results)
+        assert slow.peak >= 2
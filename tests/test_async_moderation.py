@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+异步审核客户端测试
+验证并发审核请求真正重叠，并复用连接池中的连接
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.safety import SafetyManager
+
+def test_concurrent_moderation_overlaps():
+    """并发审核不阻塞事件循环，请求在服务端同时进行"""
+    with offline_config() as config, moderation_service(delay=0.2) as stub:
+        # 关闭微批处理，使每条内容单独发送
+        config.security.moderation_max_batch_size = 1
+        manager = SafetyManager()
+
+        async def main():
+            start = time.monotonic()
+            results = await asyncio.gather(*(
+                manager.moderate_content(f"第 {i} 份市场报告") for i in range(8)
+            ))
+            return results, time.monotonic() - start
+
+        results, elapsed = asyncio.run(main())
+        assert all(not r.flagged for r in results)
+        assert stub.peak >= 4
+        assert elapsed < 8 * 0.2 / 2, f"审核请求被串行执行: {elapsed:.2f}s"
+
+def test_connections_reused_within_event_loop():
+    """同一事件循环内的审核请求复用 keep-alive 连接"""
+    with offline_config(), moderation_service() as stub:
+        manager = SafetyManager()
+
+        async def main():
+            for i in range(10):
+                await manager.moderate_content(f"报告 {i}")
+            result = await manager.moderate_content("包含违规内容的报告")
+            await manager.aclose()
+            return result
+
+        flagged = asyncio.run(main())
+        assert flagged.flagged
+        assert stub.requests == 11
+        assert stub.connections == 1
+
+def test_client_recreated_for_new_event_loop():
+    """新的事件循环使用新的客户端，而不是复用绑定旧循环的连接池，旧客户端随旧循环关闭"""
+    with offline_config(), moderation_service() as stub:
+        manager = SafetyManager()
+        asyncio.run(manager.moderate_content("第一份报告"))
+        first_client = manager.moderation_client
+        assert first_client.is_closed()  # 旧事件循环结束时关闭连接池
+        asyncio.run(manager.moderate_content("第二份报告"))
+        assert manager.moderation_client is not first_client
+        assert manager.moderation_client.is_closed()
+        assert stub.requests == 2
+
+if __name__ == "__main__":
+    test_concurrent_moderation_overlaps()
+    test_connections_reused_within_event_loop()
+    test_client_recreated_for_new_event_loop()
+    print("✅ 异步审核客户端测试通过")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+批量执行测试
+验证 BatchRunner 的并发上限、团队隔离和结果顺序
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import json
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam
+from src.batch import (
+    BatchRunner, ProcessBatchRunner, JsonlResultWriter, iter_query_file, load_completed_results, load_latest_records,
+)
+from src.safety import AgentOutput
+
+class FakeTeam:
+    """模拟的分析团队，记录同时进行的分析数量"""
+
+    active = 0
+    peak = 0
+
+    def __init__(self):
+        self.busy = False
+
+    async def analyze_market(self, query: str):
+        assert not self.busy, "同一个团队被两个查询同时使用"
+        self.busy = True
+        FakeTeam.active += 1
+        FakeTeam.peak = max(FakeTeam.peak, FakeTeam.active)
+        try:
+            await asyncio.sleep(random.uniform(0.01, 0.05))
+        finally:
+            FakeTeam.active -= 1
+            self.busy = False
+
+        if query.startswith("fail"):
+            return None
+        return AgentOutput(content=f"报告: {query}", agent_name="FakeTeam", confidence=0.9)
+
+def test_batch_runner_bounded_concurrency_and_order():
+    """并发度不超过上限，结果按输入顺序返回"""
+    FakeTeam.active = 0
+    FakeTeam.peak = 0
+    created = []
+
+    def factory():
+        team = FakeTeam()
+        created.append(team)
+        return team
+
+    queries = [f"query-{i}" for i in range(12)] + ["fail-12"]
+    runner = BatchRunner(concurrency=3, team_factory=factory)
+    results = asyncio.run(runner.run(queries))
+
+    assert [r["query"] for r in results] == queries
+    assert FakeTeam.peak <= 3
+    assert len(created) <= 3
+    assert results[-1]["status"] == "failed"
+    assert all(r["status"] == "success" for r in results[:-1])
+
+def test_jsonl_streaming_and_resume():
+    """结果逐条写入 JSONL，续跑时跳过已成功的查询并容忍中断时写了一半的行"""
+    FakeTeam.active = 0
+    queries = [f"query-{i}" for i in range(5)] + ["fail-5"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.jsonl")
+
+        with JsonlResultWriter(path) as writer:
+            runner = BatchRunner(concurrency=2, team_factory=FakeTeam)
+            results = asyncio.run(runner.run(queries[:3], on_complete=writer.write, collect=False))
+        assert results == []
+
+        # 模拟进程在写入过程中崩溃
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"index": 3, "query": "query-3", "sta')
+
+        completed = load_completed_results(path)
+        assert completed == {0: "query-0", 1: "query-1", 2: "query-2"}
+
+        executed = []
+        with JsonlResultWriter(path) as writer:
+            runner = BatchRunner(concurrency=2, team_factory=FakeTeam)
+            asyncio.run(runner.run(
+                queries,
+                on_start=lambda i, q: executed.append(i),
+                on_complete=writer.write,
+                skip=completed,
+            ))
+
+        assert sorted(executed) == [3, 4, 5]
+        completed = load_completed_results(path)
+        assert sorted(completed) == [0, 1, 2, 3, 4]
+
+def test_resumed_records_last_line_wins():
+    """续跑后同一序号有多条记录时以最后一行为准，读取结果不重复计数"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.jsonl")
+        with JsonlResultWriter(path) as writer:
+            writer.write(0, {"query": "query-0", "result": None, "status": "failed"})
+            writer.write(1, {"query": "query-1", "result": {"content": "旧报告"}, "status": "success"})
+            # 续跑：序号 0 重试成功，序号 1 再次写入失败记录
+            writer.write(0, {"query": "query-0", "result": {"content": "新报告"}, "status": "success"})
+            writer.write(1, {"query": "query-1", "result": None, "status": "failed"})
+
+        records = load_latest_records(path)
+        assert sorted(records) == [0, 1]
+        assert records[0]["result"]["content"] == "新报告"
+        assert records[1]["status"] == "failed"
+        assert load_completed_results(path) == {0: "query-0"}
+
+def test_iter_query_file_streams_json_and_jsonl():
+    """JSON 数组在极小的读取块下也能正确增量解析，JSONL 支持对象格式"""
+    sample = os.path.join(os.path.dirname(__file__), "..", "config", "sample_queries.json")
+    with open(sample, "r", encoding="utf-8") as f:
+        expected = json.load(f)
+
+    assert list(iter_query_file(sample, chunk_size=7)) == expected
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "queries.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(expected[0], ensure_ascii=False) + "\n\n")
+            f.write(json.dumps({"query": expected[1]}, ensure_ascii=False) + "\n")
+        assert list(iter_query_file(path)) == expected[:2]
+
+def test_batch_runner_backpressure():
+    """输入按需读取，已读取但未完成的查询数受并发度限制"""
+    FakeTeam.active = 0
+    state = {"pulled": 0, "completed": 0, "max_ahead": 0}
+
+    def queries():
+        for i in range(200):
+            state["pulled"] += 1
+            state["max_ahead"] = max(state["max_ahead"], state["pulled"] - state["completed"])
+            yield f"query-{i}"
+
+    def on_complete(index, record):
+        state["completed"] += 1
+
+    runner = BatchRunner(concurrency=4, team_factory=FakeTeam)
+    asyncio.run(runner.run(queries(), on_complete=on_complete, collect=False))
+
+    assert state["completed"] == 200
+    # 队列容量 (2 × 并发度) + 执行中的查询 + 生产者手中的一个
+    assert state["max_ahead"] <= 4 * 3 + 1
+
+class CrashingTeam:
+    """在特定查询上使进程崩溃的模拟团队（用于多进程测试）"""
+
+    async def analyze_market(self, query: str):
+        if query.startswith("crash:"):
+            # 首次执行时崩溃，重试时正常完成
+            marker = query[len("crash:"):]
+            if not os.path.exists(marker):
+                open(marker, "w").close()
+                os._exit(1)
+        elif query.startswith("poison"):
+            os._exit(1)
+
+        await asyncio.sleep(0.01)
+        return AgentOutput(content=f"报告: {query}", agent_name="CrashingTeam", confidence=0.9)
+
+def crashing_team_factory():
+    return CrashingTeam()
+
+def test_process_batch_runner_requeues_crashed_queries():
+    """工作进程崩溃后查询被重新排队，结果按输入顺序合并"""
+    with tempfile.TemporaryDirectory() as tmp:
+        queries = [f"query-{i}" for i in range(6)]
+        queries.insert(2, f"crash:{os.path.join(tmp, 'marker')}")
+        queries.append("poison")
+
+        completed = []
+        runner = ProcessBatchRunner(
+            workers=2,
+            concurrency_per_worker=2,
+            team_factory=crashing_team_factory,
+            max_attempts=2,
+            initialize_observability=False,
+        )
+        results = runner.run(queries, on_complete=lambda i, r: completed.append(i))
+
+    assert [r["query"] for r in results] == queries
+    assert all(r["status"] == "success" for r in results[:-1])
+    assert results[-1]["status"] == "failed"
+    assert results[-1]["error"] == "worker_crashed"
+    assert sorted(completed) == list(range(len(queries)))
+    assert sum(s["completed"] for s in runner.worker_stats) == len(queries) - 1
+    assert sum(s["restarts"] for s in runner.worker_stats) >= 2
+
+def test_batch_runner_uses_own_executor():
+    """LLM 调用在 BatchRunner 自有的线程池中执行，运行结束后线程池关闭，调用方事件循环的默认线程池不变"""
+    threads = []
+
+    def reply(agent_name, messages):
+        threads.append(threading.current_thread())
+        return f"{agent_name} 的分析结论：市场保持增长，建议持续关注竞争格局和政策变化。"
+
+    def factory():
+        team = MarketAnalysisTeam()
+        install_fake_llm(team, reply_fn=reply)
+        return team
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, int)
+        default_executor = loop._default_executor
+        runner = BatchRunner(concurrency=2, team_factory=factory)
+        for _ in range(2):
+            results = await runner.run(["分析中国储能市场", "分析中国光伏市场"])
+            assert all(r["status"] == "success" for r in results)
+        assert loop._default_executor is default_executor
+
+    with offline_config():
+        asyncio.run(main())
+
+    assert threads and all(t.name.startswith("llm") for t in threads)
+    for t in threads:
+        t.join(timeout=5)
+    assert not any(t.is_alive() for t in threads)
+
+if __name__ == "__main__":
+    test_batch_runner_bounded_concurrency_and_order()
+    test_jsonl_streaming_and_resume()
+    test_resumed_records_last_line_wins()
+    test_iter_query_file_streams_json_and_jsonl()
+    test_batch_runner_backpressure()
+    test_process_batch_runner_requeues_crashed_queries()
+    test_batch_runner_uses_own_executor()
+    print("✅ 批量执行测试通过")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+长文本分块审核测试
+验证按段落切分、分块并发审核以及发现违规分块后提前结束
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.safety import SafetyManager, split_content_into_chunks
+
+def _report(paragraphs: int, flagged_at: int = -1) -> str:
+    sections = []
+    for i in range(paragraphs):
+        body = ("市场需求稳步增长，竞争格局逐步清晰。" * 12) if i != flagged_at else "这一段包含违规内容。"
+        sections.append(f"## 第 {i} 节\n{body}")
+    return "\n\n".join(sections)
+
+def test_split_content_into_chunks():
+    """分块不超过上限，按章节边界切分且不丢失内容"""
+    report = _report(6)
+    chunks = split_content_into_chunks(report, 300)
+    assert len(chunks) == 6
+    assert all(len(c) <= 300 for c in chunks)
+    assert all(c.startswith("## 第") for c in chunks)
+    assert "\n\n".join(chunks) == report
+
+    # 过长的单个段落按句子切分
+    long_paragraph = "储能成本持续下降。" * 100
+    chunks = split_content_into_chunks(long_paragraph, 200)
+    assert all(len(c) <= 200 for c in chunks)
+    assert "".join(chunks) == long_paragraph
+
+    assert split_content_into_chunks("短文本", 300) == ["短文本"]
+    assert split_content_into_chunks(report, 0) == [report]
+
+def test_long_content_moderated_concurrently():
+    """各分块并发审核，重复审核时全部命中分块缓存"""
+    with offline_config() as config, moderation_service(delay=0.2) as stub:
+        config.security.moderation_chunk_chars = 300
+        manager = SafetyManager()
+        report = _report(6)
+
+        start = time.monotonic()
+        result = asyncio.run(manager.moderate_content(report))
+        elapsed = time.monotonic() - start
+
+        assert not result.flagged
+        assert result.category_scores["violence"] == 0.01
+        assert stub.requests == 6
+        assert elapsed < 6 * 0.2 / 2, f"分块被串行审核: {elapsed:.2f}s"
+
+        asyncio.run(manager.moderate_content(report))
+        assert stub.requests == 6
+
+def test_flagged_chunk_cancels_remaining():
+    """某个分块被标记后立即返回，不等待其余分块"""
+    def delay(inputs):
+        # 与正常分块合并在同一请求中的违规分块也要等待 2 秒
+        return 0.01 if all("违规" in text for text in inputs) else 2.0
+
+    with offline_config() as config, moderation_service(delay=delay):
+        config.security.moderation_chunk_chars = 300
+        manager = SafetyManager()
+
+        start = time.monotonic()
+        result = asyncio.run(manager.moderate_content(_report(6, flagged_at=3)))
+        elapsed = time.monotonic() - start
+
+        assert result.flagged
+        assert "violence" in result.reason
+        assert elapsed < 1.0, f"未提前结束: {elapsed:.2f}s"
+
+def test_chunks_bypass_batcher_under_default_config():
+    """默认微批配置下分块仍各自发送请求并同时进行，违规分块返回后其余请求被取消"""
+    with offline_config() as config, moderation_service(delay=0.5) as stub:
+        config.security.moderation_chunk_chars = 300
+        assert config.security.moderation_max_batch_size > 6
+        manager = SafetyManager()
+
+        async def moderate():
+            task = asyncio.ensure_future(manager.moderate_content(_report(6)))
+            await asyncio.sleep(0.3)
+            in_flight = stub.active
+            await task
+            return in_flight
+
+        assert asyncio.run(moderate()) == 6
+        assert stub.requests == 6
+        assert all(len(chunk) <= 300 for chunk in stub.inputs)
+
+    def delay(inputs):
+        return 0.01 if all("违规" in text for text in inputs) else 0.5
+
+    with offline_config() as config, moderation_service(delay=delay) as stub:
+        config.security.moderation_chunk_chars = 300
+        manager = SafetyManager()
+        cancelled = []
+        send = manager._send_moderation_batch
+
+        async def tracked_send(inputs):
+            try:
+                return await send(inputs)
+            except asyncio.CancelledError:
+                cancelled.append(inputs[0])
+                raise
+
+        manager._send_moderation_batch = tracked_send
+        report = _report(6, flagged_at=3)
+        result = asyncio.run(manager.moderate_content(report))
+
+        assert result.flagged
+        assert len(cancelled) == len(split_content_into_chunks(report, 300)) - 1
+        assert all("违规" not in text for text in cancelled)
+
+if __name__ == "__main__":
+    test_split_content_into_chunks()
+    test_long_content_moderated_concurrently()
+    test_flagged_chunk_cancels_remaining()
+    test_chunks_bypass_batcher_under_default_config()
+    print("✅ 长文本分块审核测试通过")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+审核服务熔断器测试
+验证失败率和慢调用触发熔断、半开探测以及熔断期间的判定策略
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.ratelimit import rate_limiters
+from src.safety import CircuitBreaker, CircuitState, LocalModerationTier, SafetyManager
+
+def test_failure_rate_opens_and_probe_closes():
+    """失败率超过阈值后打开，半开探测成功后关闭"""
+    breaker = CircuitBreaker("test", window_size=4, min_calls=4, open_seconds=0.05)
+    for _ in range(2):
+        breaker.record_success(0.01)
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+    assert breaker.rejected_calls == 1
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # 只放行一个探测调用
+    breaker.record_success(0.01)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.transitions == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+def test_slow_calls_open_and_failed_probe_reopens():
+    """慢调用比例过高时打开，半开探测失败后重新打开"""
+    breaker = CircuitBreaker("test", slow_call_seconds=0.5, window_size=3, min_calls=3, open_seconds=0.05)
+    for _ in range(3):
+        breaker.record_success(1.0)
+    assert breaker.state == CircuitState.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+def _degraded_manager(config, policy):
+    config.security.moderation_max_retries = 0
+    config.security.moderation_breaker_min_calls = 3
+    config.security.moderation_breaker_window = 3
+    config.security.moderation_breaker_open_seconds = 60
+    config.security.moderation_breaker_open_policy = policy
+    return SafetyManager()
+
+def test_open_breaker_stops_calling_dead_service():
+    """熔断后不再请求故障的审核服务，按 fail_closed 策略拒绝"""
+    with offline_config() as config, moderation_service(fail=True, fail_status=503) as stub:
+        manager = _degraded_manager(config, "fail_closed")
+
+        async def main():
+            return [await manager.moderate_content(f"报告 {i}") for i in range(6)]
+
+        results = asyncio.run(main())
+        assert stub.requests == 3
+        assert all(not r.flagged for r in results[:3])
+        assert all(r.flagged and "熔断" in r.reason for r in results[3:])
+
+        stats = manager.get_moderation_stats()
+        assert stats["breaker_state"] == "open"
+        assert stats["breaker_rejected_calls"] == 3
+
+def test_open_policies():
+    """fail_open 放行，local_only 使用本地审核层做最终判定"""
+    with offline_config() as config, moderation_service(fail=True, fail_status=500):
+        manager = _degraded_manager(config, "fail_open")
+        manager.moderation_tiers = [LocalModerationTier(block_terms=["内幕交易"], review_terms=["做空"])]
+
+        async def main():
+            for i in range(3):
+                await manager.moderate_content(f"报告 {i}")
+            fail_open = await manager.moderate_content("做空策略报告")
+            config.security.moderation_breaker_open_policy = "local_only"
+            local_review = await manager.moderate_content("做空策略报告")
+            local_pass = await manager.moderate_content("储能市场报告")
+            local_block = await manager.moderate_content("内幕交易计划")
+            return fail_open, local_review, local_pass, local_block
+
+        fail_open, local_review, local_pass, local_block = asyncio.run(main())
+        assert manager.moderation_breaker.state == CircuitState.OPEN
+        assert not fail_open.flagged and "熔断" in fail_open.reason
+        assert local_review.flagged and "做空" in local_review.reason
+        assert not local_pass.flagged
+        assert local_block.flagged
+
+def test_throttled_healthy_service_keeps_breaker_closed():
+    """在限流器中等待的时间和限流器已处理的 429 不计入熔断器"""
+    with offline_config() as config, moderation_service() as stub:
+        manager = _degraded_manager(config, "fail_open")
+        config.security.moderation_breaker_slow_call_seconds = 0.2
+        limiter = rate_limiters.get("openai", "moderation")
+
+        async def main():
+            for i in range(4):
+                limiter.on_rate_limited(0.3)  # 每次调用前都在冷却期
+                await manager.moderate_content(f"报告 {i}")
+            return await manager.moderate_content("违规内容")
+
+        result = asyncio.run(main())
+        assert stub.requests == 5
+        assert manager.moderation_breaker.state == CircuitState.CLOSED
+        assert result.flagged
+
+    with offline_config() as config, moderation_service(fail=True, fail_status=429, retry_after=0.01) as stub:
+        manager = _degraded_manager(config, "fail_open")
+
+        async def main():
+            for i in range(4):
+                await manager.moderate_content(f"报告 {i}")
+
+        asyncio.run(main())
+        assert stub.requests == 4
+        assert manager.moderation_breaker.state == CircuitState.CLOSED
+
+if __name__ == "__main__":
+    test_failure_rate_opens_and_probe_closes()
+    test_slow_calls_open_and_failed_probe_reopens()
+    test_open_breaker_stops_calling_dead_service()
+    test_open_policies()
+    test_throttled_healthy_service_keeps_breaker_closed()
+    print("✅ 审核服务熔断器测试通过")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+群聊提前结束测试
+验证 BusinessWriter 给出完整报告后群聊立即结束，不再轮询其余 Agent
+"""
+
+import asyncio
+from autogen import Agent
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam, REPORT_SECTIONS, is_report_complete
+
+COMPLETE_REPORT = "\n\n".join(
+    f"## {i}. {section}\n储能市场相关内容：装机规模持续增长，工商业储能需求旺盛。"
+    for i, section in enumerate(REPORT_SECTIONS, 1)
+)
+
+def report_reply(agent_name, messages):
+    if agent_name == "BusinessWriter":
+        return COMPLETE_REPORT
+    return f"{agent_name} 的分析结论：市场保持增长。"
+
+def test_is_report_complete():
+    """只有 BusinessWriter 给出的、包含全部章节标题的消息才算完整报告"""
+    assert is_report_complete({"name": "BusinessWriter", "content": COMPLETE_REPORT})
+    assert not is_report_complete({"name": "ProjectManager", "content": COMPLETE_REPORT})
+
+    missing = COMPLETE_REPORT.replace("风险评估", "风险")
+    assert not is_report_complete({"name": "BusinessWriter", "content": missing})
+
+    # 章节名只在正文中提到，不算章节标题
+    inline = "本报告包括执行摘要、市场环境分析、战略建议、风险评估和下一步行动计划。"
+    assert not is_report_complete({"name": "BusinessWriter", "content": inline})
+    assert not is_report_complete("执行摘要")
+
+    # 加粗标题、章节内含小标题的报告也算完整
+    bold = "\n\n".join(
+        f"**{section}**\n### 要点\n储能市场相关内容：装机规模持续增长，工商业储能需求旺盛。"
+        for section in REPORT_SECTIONS
+    )
+    assert is_report_complete({"name": "BusinessWriter", "content": bold})
+
+def test_outline_is_not_complete_report():
+    """只列出章节的提纲或计划不算完整报告"""
+    outline = "\n".join(f"{i}. {section}" for i, section in enumerate(REPORT_SECTIONS, 1))
+    assert not is_report_complete({"name": "BusinessWriter", "content": "报告提纲如下：\n" + outline})
+
+    headings_only = "\n".join(f"## {section}" for section in REPORT_SECTIONS)
+    assert not is_report_complete({"name": "BusinessWriter", "content": headings_only})
+
+    # 只有一个章节缺少正文也不算完整
+    short = COMPLETE_REPORT.replace("## 4. 风险评估\n储能市场相关内容：装机规模持续增长，工商业储能需求旺盛。", "## 4. 风险评估\n待补充。")
+    assert short != COMPLETE_REPORT
+    assert not is_report_complete({"name": "BusinessWriter", "content": short})
+
+def _chatty_team():
+    """项目经理每轮都要求继续，群聊只能靠轮数上限或终止条件结束"""
+    team = MarketAnalysisTeam()
+    team.agents["user_proxy"].register_reply(
+        [Agent, None], lambda recipient, messages, sender, config: (True, "请继续完善。")
+    )
+    return team, install_fake_llm(team, reply_fn=report_reply)
+
+def test_chat_ends_after_complete_report():
+    """完整报告出现后结束群聊，每个 Agent 只发言一次"""
+    with offline_config():
+        team, clients = _chatty_team()
+        result = asyncio.run(team.analyze_market("分析中国储能市场"))
+
+        assert result.content == COMPLETE_REPORT
+        assert {key: len(c.calls) for key, c in clients.items()} == {
+            "researcher": 1, "analyst": 1, "writer": 1, "corrector": 0,
+        }
+        assert team.group_chat.messages[-1]["name"] == "BusinessWriter"
+
+def test_without_early_termination_chat_keeps_cycling():
+    """关闭提前结束时群聊一直轮询到 max_round"""
+    with offline_config() as config:
+        config.agent.enable_early_termination = False
+        team, clients = _chatty_team()
+        asyncio.run(team.analyze_market("分析中国储能市场"))
+        assert len(clients["writer"].calls) > 1
+        assert len(team.group_chat.messages) == config.agent.max_round
+
+if __name__ == "__main__":
+    test_is_report_complete()
+    test_outline_is_not_complete_report()
+    test_chat_ends_after_complete_report()
+    test_without_early_termination_chat_keeps_cycling()
+    print("✅ 群聊提前结束测试通过")
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+对冲请求测试
+验证延迟分位数阈值、先成功者胜出、对冲比例上限以及在 Agent 调用中的接入
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam, TrackedAssistantAgent
+from src.hedging import LatencyTracker, HedgingManager, hedging
+from src.ratelimit import rate_limiters
+from src.routing import route_stats
+
+def _warm(manager, model, latency=0.01, samples=20):
+    for _ in range(samples):
+        manager.record_latency(model, latency)
+
+def _slow(result, seconds):
+    def call():
+        time.sleep(seconds)
+        return result
+    return call
+
+def test_latency_percentile():
+    """分位数取窗口内的样本，超出窗口的旧样本被丢弃"""
+    tracker = LatencyTracker(window_size=100)
+    assert tracker.percentile(0.5) is None
+    for i in range(200):
+        tracker.record(float(i))
+    assert len(tracker) == 100
+    assert tracker.percentile(0.5) == 150.0
+    assert tracker.percentile(0.99) == 199.0
+
+def test_slow_primary_is_hedged():
+    """主请求超过阈值后发出对冲请求，先返回的结果胜出"""
+    with offline_config() as config:
+        config.hedging.max_extra_request_rate = 1.0
+        manager = HedgingManager()
+        assert manager.threshold("m") is None
+        _warm(manager, "m")
+
+        start = time.monotonic()
+        result = manager.call("m", _slow("primary", 1.0), _slow("hedge", 0.01))
+        assert result == "hedge"
+        assert time.monotonic() - start < 0.5
+
+        # 阈值内返回的请求不对冲
+        assert manager.call("m", _slow("primary", 0), _slow("hedge", 0)) == "primary"
+        stats = manager.get_stats()["m"]
+        assert stats["requests"] == 2
+        assert stats["hedged"] == 1
+        assert stats["hedge_wins"] == 1
+        assert stats["extra_request_rate"] == 0.5
+
+def test_failed_hedge_falls_back_to_primary():
+    """对冲请求失败时等待主请求的结果"""
+    def failing():
+        raise RuntimeError("hedge failed")
+
+    with offline_config() as config:
+        config.hedging.max_extra_request_rate = 1.0
+        manager = HedgingManager()
+        _warm(manager, "m")
+        assert manager.call("m", _slow("primary", 0.1), failing) == "primary"
+
+def test_hedge_budget():
+    """对冲比例达到上限后不再对冲"""
+    with offline_config() as config:
+        config.hedging.max_extra_request_rate = 0.1
+        manager = HedgingManager()
+        _warm(manager, "m")
+        for _ in range(9):
+            manager.call("m", _slow("primary", 0), _slow("hedge", 0))
+        manager.call("m", _slow("primary", 0.1), _slow("hedge", 0))
+        assert manager.call("m", _slow("primary", 0.1), _slow("hedge", 0)) == "primary"
+        assert manager.get_stats()["m"]["hedged"] == 1
+
+def test_concurrent_calls_not_capped_or_queued():
+    """大量并发调用同时执行，不在共享线程池中排队，也不因排队时间触发对冲"""
+    with offline_config() as config:
+        config.hedging.max_extra_request_rate = 1.0
+        manager = HedgingManager()
+        _warm(manager, "m", latency=0.3)
+        results = []
+
+        def caller():
+            results.append(manager.call("m", _slow("primary", 0.2), _slow("hedge", 0)))
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=caller) for _ in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.monotonic() - start < 0.6
+        assert results == ["primary"] * 64
+        assert manager.get_stats()["m"]["hedged"] == 0
+
+def test_agent_completion_hedged():
+    """Agent 的 LLM 调用在启用对冲后，慢调用由重复请求兜底"""
+    with offline_config() as config:
+        config.hedging.enable_hedging = True
+        config.hedging.max_extra_request_rate = 1.0
+        hedging.reset()
+        team = MarketAnalysisTeam()
+        agent = team.agents["writer"]
+        model = agent.llm_config["config_list"][0]["model"]
+        _warm(hedging, model)
+
+        first = threading.Event()
+
+        def reply(agent_name, messages):
+            if not first.is_set():
+                first.set()
+                time.sleep(1.0)
+                return "慢速回复"
+            return "快速回复"
+
+        client = install_fake_llm(team, reply_fn=reply)["writer"]
+        messages = [{"role": "user", "content": "撰写报告"}]
+        start = time.monotonic()
+        result = asyncio.run(agent.a_generate_reply(messages=messages, sender=None))
+        assert result == "快速回复"
+        assert time.monotonic() - start < 0.8
+        assert len(client.calls) == 2
+        assert hedging.get_stats()[model]["hedge_wins"] == 1
+        hedging.reset()
+
+def test_pool_full_runs_inline_without_hedge():
+    """对冲线程池没有空闲线程时在调用方线程中执行，不排队也不对冲"""
+    with offline_config() as config:
+        config.hedging.max_extra_request_rate = 1.0
+        config.hedging.max_workers = 1
+        manager = HedgingManager()
+        _warm(manager, "m")
+        results = []
+
+        caller = threading.Thread(target=lambda: results.append(manager.call("m", _slow("a", 0.3), _slow("b", 0.3))))
+        caller.start()
+        time.sleep(0.05)
+        # 唯一的线程被上面的调用占用
+        assert manager.call("m", _slow("inline", 0.1), _slow("hedge", 0)) == "inline"
+        caller.join()
+
+        stats = manager.get_stats()["m"]
+        assert stats["pool_full"] == 2
+        assert stats["hedged"] == 0
+        assert results == ["a"]
+
+class _SlowChatHandler(BaseHTTPRequestHandler):
+    """兼容 /v1/chat/completions 的替身：第一个请求 5 秒后才返回，之后的请求立即返回"""
+
+    protocol_version = "HTTP/1.1"
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with _SlowChatHandler.lock:
+            _SlowChatHandler.requests += 1
+            first = _SlowChatHandler.requests == 1
+        if first:
+            time.sleep(5)
+        data = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "慢速回复" if first else "快速回复"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 4, "total_tokens": 14},
+        }).encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def test_losing_request_connection_is_aborted():
+    """落败的请求被断开 HTTP 连接而不是等待其返回，其占用的时间和输入 token 计入统计"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowChatHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with offline_config() as config:
+            config.hedging.enable_hedging = True
+            config.hedging.max_extra_request_rate = 1.0
+            hedging.reset()
+            route_stats.reset()
+            agent = TrackedAssistantAgent(
+                name="Writer",
+                system_message="你是商业报告撰写者。",
+                llm_config={
+                    "config_list": [{
+                        "model": "gpt-4o-mini",
+                        "api_key": "sk-test-placeholder",
+                        "base_url": f"http://127.0.0.1:{server.server_address[1]}/v1",
+                    }],
+                    "cache_seed": None,
+                    "max_retries": 0,
+                },
+            )
+            _warm(hedging, "gpt-4o-mini", latency=0.05)
+
+            messages = [{"role": "user", "content": "撰写报告"}]
+            start = time.monotonic()
+            result = asyncio.run(agent.a_generate_reply(messages=messages, sender=None))
+            assert result == "快速回复"
+            assert time.monotonic() - start < 2
+
+            # 落败的主请求被中断后很快结束，不会占用线程、限流名额直到 5 秒后服务端返回
+            deadline = time.monotonic() + 2
+            while hedging.get_stats()["gpt-4o-mini"]["losers_cancelled"] < 1 and time.monotonic() < deadline:
+                time.sleep(0.02)
+            stats = hedging.get_stats()["gpt-4o-mini"]
+            assert stats["losers_cancelled"] == 1
+            assert 0 < stats["loser_seconds"] < 2
+            assert rate_limiters.get("openai", "gpt-4o-mini").concurrency.in_flight == 0
+
+            route = route_stats.get_stats()["Writer"]["gpt-4o-mini"]
+            assert route["calls"] == 2
+            assert route["cancelled_calls"] == 1
+            hedging.reset()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_latency_percentile()
+    test_slow_primary_is_hedged()
+    test_failed_hedge_falls_back_to_primary()
+    test_hedge_budget()
+    test_concurrent_calls_not_capped_or_queued()
+    test_agent_completion_hedged()
+    test_pool_full_runs_inline_without_hedge()
+    test_losing_request_connection_is_aborted()
+    print("✅ 对冲请求测试通过")
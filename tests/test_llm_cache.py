@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+LLM 响应缓存测试
+验证缓存键规范化、TTL/LRU 淘汰以及重复分析时命中缓存
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from tests.fake_llm import FakeLLMClient, install_fake_llm, offline_config
+from src.agents import MarketAnalysisTeam
+from src.cache import ResponseCache, get_response_cache
+
+def test_cache_key_normalization():
+    """换行符和首尾空白不同的同一对话命中同一个键，模型或温度不同则不命中"""
+    messages = [{"role": "user", "content": "分析市场\r\n趋势  ", "name": "ProjectManager"}]
+    same = [{"role": "user", "content": "分析市场\n趋势", "name": "ProjectManager", "context": None}]
+
+    key = ResponseCache.make_key("gpt-4o", 0.1, "你是研究员", messages)
+    assert key == ResponseCache.make_key("gpt-4o", 0.1, "你是研究员 ", same)
+    assert key != ResponseCache.make_key("gpt-4o-mini", 0.1, "你是研究员", messages)
+    assert key != ResponseCache.make_key("gpt-4o", 0.7, "你是研究员", messages)
+    assert key != ResponseCache.make_key("gpt-4o", 0.1, "你是分析师", messages)
+
+def test_cache_ttl_and_lru_eviction():
+    """过期条目不返回，超出条目数上限时淘汰最久未访问的条目"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "llm.sqlite")
+        cache = ResponseCache(path, ttl_seconds=3600, max_entries=2)
+
+        cache.set("a", "回复A", latency=1.5)
+        cache.set("b", {"content": "回复B"}, latency=2.0)
+        assert cache.get("a") == {"response": "回复A", "latency": 1.5}
+
+        # "b" 最久未访问，写入 "c" 时被淘汰
+        time.sleep(0.01)
+        cache.set("c", "回复C", latency=1.0)
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert len(cache) == 2
+
+        # 其他进程打开同一个文件可以读取到已写入的条目
+        other = ResponseCache(path)
+        assert other.get("c")["response"] == "回复C"
+
+        expired = ResponseCache(path, ttl_seconds=1e-6)
+        time.sleep(0.01)
+        assert expired.get("c") is None
+
+        stats = cache.get_stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["saved_seconds"] == 3.0
+
+def test_cache_size_cap():
+    """总大小超过上限时淘汰旧条目"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, "llm.sqlite"), max_bytes=1000)
+        for i in range(10):
+            cache.set(f"key-{i}", "x" * 300, latency=0.1)
+        assert len(cache) == 3
+        assert cache.get("key-9") is not None
+        assert cache.get("key-0") is None
+
+def test_repeated_analysis_served_from_cache():
+    """重新执行相同的分析时所有 LLM 调用都命中缓存"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "llm.sqlite")
+        with offline_config(enable_llm_cache=True, llm_cache_path=path):
+            query = "分析中国电动汽车市场的发展趋势和投资机会"
+
+            team = MarketAnalysisTeam()
+            assert team.llm_config["cache_seed"] is None
+            first_clients = install_fake_llm(team)
+            first = asyncio.run(team.analyze_market(query))
+            first_calls = sum(len(c.calls) for c in first_clients.values())
+            assert first_calls > 0
+
+            # 模拟崩溃后重新运行：新的团队实例，同一个缓存文件
+            team = MarketAnalysisTeam()
+            second_clients = install_fake_llm(team)
+            second = asyncio.run(team.analyze_market(query))
+
+            assert sum(len(c.calls) for c in second_clients.values()) == 0
+            assert second.content == first.content
+            assert get_response_cache().get_stats()["hits"] >= first_calls
+
+def test_failover_reply_cached_under_backup_model():
+    """切换到备用模型得到的回复按备用模型缓存，主模型恢复后不会被当作主模型的回复返回"""
+    class Unavailable(Exception):
+        status_code = 503
+
+    def failing(agent_name, messages):
+        raise Unavailable("HTTP 503")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "llm.sqlite")
+        with offline_config(enable_llm_cache=True, llm_cache_path=path) as config:
+            config.llm.retry_base_delay = 0.001
+            config.llm.failover_after_attempts = 1
+            team = MarketAnalysisTeam()
+            agent = team.agents["researcher"]
+            agent.client = FakeLLMClient(agent.name, reply_fn=failing)
+            agent.backup_client = FakeLLMClient("BackupModel")
+            agent.backup_client._config_list = [{"model": "backup-model"}]
+            messages = [{"role": "user", "content": "分析储能市场"}]
+
+            reply = asyncio.run(agent.a_generate_reply(messages=messages, sender=None))
+            assert reply.startswith("BackupModel")
+
+            # 主模型恢复
+            primary = FakeLLMClient(agent.name)
+            agent.client = primary
+            reply = asyncio.run(agent.a_generate_reply(messages=messages, sender=None))
+            assert reply.startswith(agent.name)
+            assert len(primary.calls) == 1
+
+if __name__ == "__main__":
+    test_cache_key_normalization()
+    test_cache_ttl_and_lru_eviction()
+    test_cache_size_cap()
+    test_repeated_analysis_served_from_cache()
+    test_failover_reply_cached_under_backup_model()
+    print("✅ LLM 响应缓存测试通过")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+LLM 调用重试测试
+验证错误分类、退避重试、切换备用模型以及不可重试错误直接抛出
+"""
+
+import asyncio
+import httpx
+import pytest
+from tests.fake_llm import offline_config, install_fake_llm, FakeLLMClient
+from src.agents import MarketAnalysisTeam
+from src.retry import ErrorClass, classify_error, backoff_delay
+
+class APIError(Exception):
+    """模拟 SDK 抛出的 HTTP 错误"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+def failing_reply(failures: int, status_code: int = 503):
+    """前 failures 次调用抛出错误，之后返回正常回复"""
+    calls = []
+
+    def reply(agent_name, messages):
+        calls.append(agent_name)
+        if len(calls) <= failures:
+            raise APIError(status_code)
+        return f"{agent_name} 的分析结论"
+    return reply, calls
+
+def _researcher(config, reply_fn):
+    config.llm.retry_base_delay = 0.001
+    team = MarketAnalysisTeam()
+    install_fake_llm(team, reply_fn=reply_fn)
+    return team.agents["researcher"]
+
+def _ask(agent):
+    messages = [{"role": "user", "content": "分析储能市场"}]
+    return asyncio.run(agent.a_generate_reply(messages=messages, sender=None))
+
+def test_classify_error_and_backoff():
+    """限流、临时错误和不可重试错误分类正确，退避时间有上限"""
+    assert classify_error(APIError(429)) == ErrorClass.RATE_LIMITED
+    assert classify_error(APIError(502)) == ErrorClass.TRANSIENT
+    assert classify_error(APIError(408)) == ErrorClass.TRANSIENT
+    assert classify_error(APIError(401)) == ErrorClass.FATAL
+    assert classify_error(httpx.ConnectTimeout("timeout")) == ErrorClass.TRANSIENT
+    assert classify_error(ValueError("bad")) == ErrorClass.FATAL
+
+    with offline_config() as config:
+        config.llm.retry_base_delay = 1.0
+        config.llm.retry_max_delay = 4.0
+        assert all(0 <= backoff_delay(1) <= 1.0 for _ in range(50))
+        assert all(0 <= backoff_delay(10) <= 4.0 for _ in range(50))
+
+def test_transient_errors_retried():
+    """临时错误退避后重试成功，不再返回道歉文本"""
+    with offline_config() as config:
+        reply_fn, calls = failing_reply(2)
+        config.llm.failover_after_attempts = 10
+        reply = _ask(_researcher(config, reply_fn))
+        assert reply == "MarketResearcher 的分析结论"
+        assert len(calls) == 3
+
+def test_fatal_errors_propagate():
+    """不可重试的错误只调用一次并直接抛出"""
+    with offline_config() as config:
+        reply_fn, calls = failing_reply(10, status_code=401)
+        with pytest.raises(APIError):
+            _ask(_researcher(config, reply_fn))
+        assert len(calls) == 1
+
+def test_retries_exhausted():
+    """重试次数用尽后抛出最后一次错误"""
+    with offline_config() as config:
+        reply_fn, calls = failing_reply(10)
+        config.llm.max_retries = 2
+        agent = _researcher(config, reply_fn)
+        agent.backup_client = None
+        with pytest.raises(APIError):
+            _ask(agent)
+        assert len(calls) == 3
+
+def test_failover_to_backup_model():
+    """主模型连续失败达到阈值后立即切换到备用模型"""
+    with offline_config() as config:
+        reply_fn, calls = failing_reply(10)
+        config.llm.failover_after_attempts = 2
+        agent = _researcher(config, reply_fn)
+        agent.backup_client = FakeLLMClient("BackupModel")
+
+        reply = _ask(agent)
+        assert reply == "BackupModel 的分析结论：市场保持增长，建议持续关注竞争格局和政策变化。"
+        assert len(calls) == 2
+        assert len(agent.backup_client.calls) == 1
+
+if __name__ == "__main__":
+    test_classify_error_and_backoff()
+    test_transient_errors_retried()
+    test_fatal_errors_propagate()
+    test_retries_exhausted()
+    test_failover_to_backup_model()
+    print("✅ LLM 调用重试测试通过")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+本地审核层测试
+验证多模式匹配器和级联审核：本地能确定的内容不请求远程服务
+"""
+
+import asyncio
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.safety import AhoCorasickMatcher, LocalModerationTier, SafetyManager
+
+def test_aho_corasick_matches_overlapping_patterns():
+    """重叠词条和后缀词条都能找到，全角与大小写差异被忽略"""
+    matcher = AhoCorasickMatcher(["he", "she", "his", "hers"])
+    assert matcher.find_all("ushers") == ["he", "she", "hers"]
+    assert matcher.find_all("hi") == []
+
+    matcher = AhoCorasickMatcher(["内幕交易", "交易所", "ＡＢＣ"])
+    assert matcher.find_all("涉嫌内幕交易所得") == ["内幕交易", "交易所"]
+    assert matcher.find_all("abc 公司") == ["abc"]
+    assert AhoCorasickMatcher([]).find_all("任何文本") == []
+
+def test_local_tier_decisions():
+    """屏蔽词直接违规，复核词和不确定的评分交给下一级"""
+    tier = LocalModerationTier(
+        block_terms=["内幕交易"],
+        review_terms=["做空"],
+        scorer=lambda text: 0.01 if "报告" in text else 0.5,
+    )
+    assert tier.classify("涉及内幕交易的计划").flagged
+    assert tier.classify("市场分析报告").flagged is False
+    assert tier.classify("做空策略报告") is None
+    assert tier.classify("其他内容") is None
+    assert LocalModerationTier(block_terms=["内幕交易"]).classify("市场分析报告") is None
+
+def test_cascade_skips_remote_for_confident_decisions():
+    """本地确定的内容不请求远程审核，只有不确定的内容进入远程审核"""
+    with offline_config(), moderation_service() as stub:
+        manager = SafetyManager()
+        assert manager.moderation_tiers == []
+        manager.moderation_tiers = [LocalModerationTier(
+            block_terms=["内幕交易"],
+            review_terms=["做空"],
+            scorer=lambda text: 0.01 if "报告" in text else 0.5,
+        )]
+
+        async def main():
+            return [
+                await manager.moderate_content(text)
+                for text in ("涉及内幕交易的计划", "市场分析报告", "做空策略报告", "包含违规内容")
+            ]
+
+        blocked, safe, reviewed, ambiguous = asyncio.run(main())
+        assert blocked.flagged and "内幕交易" in blocked.reason
+        assert not safe.flagged
+        assert not reviewed.flagged
+        assert ambiguous.flagged
+
+        assert stub.inputs == ["做空策略报告", "包含违规内容"]
+        stats = manager.get_moderation_stats()
+        assert stats["local_decisions"] == 2
+        assert stats["avoided_calls"] == 2
+        assert stats["tier_decisions"]["local.escalate"] == 2
+        assert stats["tier_decisions"]["remote.checked"] == 2
+
+def test_scorer_error_escalates():
+    """评分模型出错时交给远程审核，熔断期间按失败策略处理，不中断审核"""
+    def broken_scorer(text):
+        raise RuntimeError("model not loaded")
+
+    tier = LocalModerationTier(block_terms=["内幕交易"], scorer=broken_scorer)
+    assert tier.classify("市场分析报告") is None
+    assert tier.classify("涉及内幕交易的计划").flagged
+    assert tier.classify_final("市场分析报告", 0.7) is None
+
+    with offline_config() as config, moderation_service() as stub:
+        manager = SafetyManager()
+        manager.moderation_tiers = [tier]
+
+        async def main():
+            remote = await manager.moderate_content("包含违规内容")
+            config.security.moderation_breaker_open_policy = "local_only"
+            manager.moderation_breaker._open()
+            degraded = await manager.moderate_content("市场分析报告")
+            return remote, degraded
+
+        remote, degraded = asyncio.run(main())
+        assert remote.flagged
+        assert stub.inputs == ["包含违规内容"]
+        assert not degraded.flagged and "熔断" in degraded.reason
+
+def test_tiers_built_from_config():
+    """配置词表后自动启用本地审核层"""
+    with offline_config() as config:
+        config.security.local_block_terms = ["内幕交易"]
+        manager = SafetyManager()
+        assert len(manager.moderation_tiers) == 1
+        assert manager.moderation_tiers[0].block_matcher.patterns == ["内幕交易"]
+
+if __name__ == "__main__":
+    test_aho_corasick_matches_overlapping_patterns()
+    test_local_tier_decisions()
+    test_cascade_skips_remote_for_confident_decisions()
+    test_scorer_error_escalates()
+    test_tiers_built_from_config()
+    print("✅ 本地审核层测试通过")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+模型路由测试
+验证按角色选择模型、缺少密钥时回退，以及按路由统计延迟和成本
+"""
+
+import asyncio
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam
+from src.routing import resolve_model, route_config_entry, estimate_cost, route_stats, anthropic_client_available
+
+def test_resolve_model():
+    """路由可以指向默认模型、备用模型或直接指定模型名"""
+    with offline_config() as config:
+        config.routing.routes = {"researcher": "backup", "writer": "default", "analyst": "gpt-4o-mini"}
+        assert resolve_model("researcher") == config.llm.backup_model
+        assert resolve_model("writer") == config.llm.default_model
+        assert resolve_model("analyst") == "gpt-4o-mini"
+        assert resolve_model("unknown") == config.llm.default_model
+
+        config.routing.enable_model_routing = False
+        assert resolve_model("researcher") == config.llm.default_model
+
+def test_claude_route_uses_anthropic_or_falls_back():
+    """Claude 路由使用 anthropic 接口，缺少密钥或依赖时回退到默认模型"""
+    with offline_config() as config:
+        config.llm.anthropic_api_key = "sk-ant-test"
+        entry = route_config_entry("researcher")
+        if anthropic_client_available():
+            assert entry["model"] == config.llm.backup_model
+            assert entry["api_type"] == "anthropic"
+        else:
+            assert entry["model"] == config.llm.default_model
+
+        config.llm.anthropic_api_key = None
+        entry = route_config_entry("researcher")
+        assert entry["model"] == config.llm.default_model
+        assert "api_type" not in entry
+
+def test_team_agents_use_routed_models():
+    """研究员和修正使用低成本模型，写作专家使用默认模型，并按路由统计"""
+    with offline_config() as config:
+        # 使用 OpenAI 的低成本模型作为备用模型，测试不依赖 anthropic 客户端
+        config.llm.backup_model = "gpt-4o-mini"
+        route_stats.reset()
+        team = MarketAnalysisTeam()
+        assert team.agents["researcher"].llm_config["config_list"][0]["model"] == config.llm.backup_model
+        assert team.agents["writer"].llm_config["config_list"][0]["model"] == config.llm.default_model
+        assert team.corrector.llm_config["config_list"][0]["model"] == config.llm.backup_model
+
+        clients = install_fake_llm(team)
+        asyncio.run(team.analyze_market("分析中国电动汽车市场的发展趋势和投资机会"))
+        asyncio.run(team._correction_callback("报告内容", "输出格式不符合要求"))
+        assert len(clients["corrector"].calls) == 1
+        assert len(clients["writer"].calls) >= 1
+
+        stats = team.get_conversation_summary()["model_routes"]
+        researcher = stats["researcher"][config.llm.backup_model]
+        assert researcher["calls"] == len(clients["researcher"].calls)
+        assert researcher["cost_usd"] > 0
+        assert config.llm.default_model in stats["writer"]
+        assert set(stats["correction"]) == {config.llm.backup_model}
+
+def test_estimate_cost():
+    """按每百万 token 价格估算成本，未配置价格的模型为 0"""
+    with offline_config() as config:
+        config.routing.model_prices = {"m": {"input": 1.0, "output": 4.0}}
+        assert estimate_cost("m", 1_000_000, 500_000) == 3.0
+        assert estimate_cost("other", 1000, 1000) == 0
+
+if __name__ == "__main__":
+    test_resolve_model()
+    test_claude_route_uses_anthropic_or_falls_back()
+    test_team_agents_use_routed_models()
+    test_estimate_cost()
+    print("✅ 模型路由测试通过")
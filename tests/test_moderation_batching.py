@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+审核微批处理测试
+验证并发审核请求被合并为批量调用，结果正确分发给各个调用方
+"""
+
+import asyncio
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.safety import SafetyManager, ModerationBatcher
+
+def test_concurrent_requests_coalesced():
+    """时间窗口内的并发审核合并为一次请求，每个调用方拿到自己的结果"""
+    with offline_config(), moderation_service(delay=0.05) as stub:
+        manager = SafetyManager()
+        contents = [f"第 {i} 份市场报告" for i in range(20)] + ["包含违规内容的报告", "第 0 份市场报告"]
+
+        async def main():
+            return await asyncio.gather(*(manager.moderate_content(c) for c in contents))
+
+        results = asyncio.run(main())
+        assert stub.requests == 1
+        # 同一批次中的重复内容只发送一次
+        assert len(stub.inputs) == 21
+        assert [r.flagged for r in results] == [False] * 20 + [True, False]
+        assert manager.get_moderation_stats()["inputs_sent"] == 21
+
+def test_max_batch_size_splits_batches():
+    """达到最大批量时立即发送，不等待时间窗口"""
+    with offline_config() as config, moderation_service() as stub:
+        config.security.moderation_max_batch_size = 4
+        config.security.moderation_batch_window_ms = 10_000
+        manager = SafetyManager()
+
+        async def main():
+            return await asyncio.wait_for(
+                asyncio.gather(*(manager.moderate_content(f"报告 {i}") for i in range(8))),
+                timeout=5,
+            )
+
+        results = asyncio.run(main())
+        assert len(results) == 8
+        assert stub.requests == 2
+
+def test_batch_failure_propagates_to_all_waiters():
+    """批量调用失败时每个等待者都收到异常，已取消的等待者被跳过"""
+
+    async def failing_send(inputs):
+        raise ConnectionError("moderation service unavailable")
+
+    async def main():
+        batcher = ModerationBatcher(failing_send, max_batch_size=10, window_seconds=0.01)
+        cancelled = asyncio.create_task(batcher.submit("c"))
+        waiters = [asyncio.create_task(batcher.submit(text)) for text in ("a", "b")]
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        return results, batcher.batches_sent
+
+    results, batches_sent = asyncio.run(main())
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert batches_sent == 0
+
+if __name__ == "__main__":
+    test_concurrent_requests_coalesced()
+    test_max_batch_size_splits_batches()
+    test_batch_failure_propagates_to_all_waiters()
+    print("✅ 审核微批处理测试通过")
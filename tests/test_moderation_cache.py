@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+审核结果缓存测试
+验证相同内容不重复调用审核服务，阈值变化时重新审核
+"""
+
+import asyncio
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.safety import SafetyManager, OutputValidator
+
+def test_repeated_content_served_from_cache():
+    """同一段文本只审核一次，统计命中率和节省的调用数"""
+    with offline_config(), moderation_service() as stub:
+        manager = SafetyManager()
+
+        for _ in range(3):
+            result = asyncio.run(manager.moderate_content("电动汽车市场分析报告"))
+            assert not result.flagged
+        asyncio.run(manager.moderate_content("另一份报告"))
+
+        assert stub.requests == 2
+        stats = manager.get_moderation_stats()
+        assert stats["api_calls"] == 2
+        assert stats["avoided_calls"] == 2
+        assert stats["cache_hit_rate"] == 0.5
+
+def test_threshold_is_part_of_cache_key():
+    """修改审核阈值后重新审核，判定结果随阈值变化"""
+    with offline_config() as config, moderation_service() as stub:
+        stub.score = lambda text: 0.5
+        manager = SafetyManager()
+        assert not asyncio.run(manager.moderate_content("内容")).flagged
+        config.security.moderation_threshold = 0.3
+        assert asyncio.run(manager.moderate_content("内容")).flagged
+        assert stub.requests == 2
+
+def test_service_errors_not_cached():
+    """审核服务异常时的结果不进入缓存"""
+    with offline_config(), moderation_service(fail=True) as stub:
+        manager = SafetyManager()
+
+        asyncio.run(manager.moderate_content("内容"))
+        asyncio.run(manager.moderate_content("内容"))
+        assert stub.requests == 2
+        assert manager.get_moderation_stats()["cache_size"] == 0
+
+def test_correction_loop_reuses_moderation():
+    """修正回调原样返回内容时不重复审核"""
+    with offline_config(), moderation_service() as stub:
+        validator = OutputValidator(SafetyManager())
+
+        async def unchanged(output, reason):
+            return output
+
+        result = asyncio.run(validator.validate_with_correction(
+            "这份报告包含违规内容，需要重新撰写。", "Writer", correction_callback=unchanged
+        ))
+        assert result is None
+        assert stub.requests == 1
+
+if __name__ == "__main__":
+    test_repeated_content_served_from_cache()
+    test_threshold_is_part_of_cache_key()
+    test_service_errors_not_cached()
+    test_correction_loop_reuses_moderation()
+    print("✅ 审核结果缓存测试通过")
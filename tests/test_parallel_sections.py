@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+报告分章节并发撰写测试
+验证正文章节并发生成、执行摘要基于正文生成，以及最终报告按固定顺序拼接
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam, REPORT_SECTIONS, is_report_complete
+
+def section_reply(agent_name, messages):
+    prompt = messages[-1]["content"]
+    if agent_name != "BusinessWriter":
+        return f"{agent_name} 的分析结论：市场保持增长，建议持续关注竞争格局和政策变化。"
+    section = prompt.split("**撰写章节:** ")[1].split("\n")[0]
+    time.sleep(0.3)
+    # 模型有时会重复输出章节标题，拼接时应去掉
+    return f"## {section}\n{section}的详细内容，结合研究数据给出具体判断。"
+
+def test_pipeline_steps():
+    """四个正文章节依赖研究和分析结果，执行摘要依赖全部正文章节"""
+    with offline_config() as config:
+        config.agent.research_fanout_width = 1
+        config.agent.parallel_report_sections = True
+        pipeline = MarketAnalysisTeam().build_pipeline("分析中国储能市场")
+
+        sections = [f"section_{i}" for i in range(1, 5)]
+        assert [s.name for s in pipeline.order] == ["research", "analysis"] + sections + ["summary"]
+        assert all(pipeline.steps[name].depends_on == ["research", "analysis"] for name in sections)
+        assert pipeline.steps["summary"].depends_on == sections
+
+def test_sections_generated_concurrently():
+    """正文章节并发撰写，最终报告包含按顺序排列的全部章节"""
+    with offline_config() as config:
+        config.agent.execution_mode = "pipeline"
+        config.agent.research_fanout_width = 1
+        config.agent.parallel_report_sections = True
+        team = MarketAnalysisTeam()
+        clients = install_fake_llm(team, reply_fn=section_reply)
+
+        start = time.monotonic()
+        result = asyncio.run(team.analyze_market("分析中国储能市场"))
+        elapsed = time.monotonic() - start
+
+        assert len(clients["writer"].calls) == 5
+        # 4 个正文章节并发 + 执行摘要，串行需要 1.5 秒
+        assert elapsed < 0.3 * 3, f"章节被串行撰写: {elapsed:.2f}s"
+
+        content = result.content
+        positions = [content.index(f"## {section}") for section in REPORT_SECTIONS]
+        assert positions == sorted(positions)
+        assert content.count("## 风险评估") == 1
+        assert is_report_complete({"name": "BusinessWriter", "content": content})
+
+        summary_prompt = clients["writer"].calls[-1][-1]["content"]
+        assert "**撰写章节:** 执行摘要" in summary_prompt
+        for section in REPORT_SECTIONS[1:]:
+            assert f"{section}的详细内容" in summary_prompt
+
+if __name__ == "__main__":
+    test_pipeline_steps()
+    test_sections_generated_concurrently()
+    print("✅ 报告分章节并发撰写测试通过")
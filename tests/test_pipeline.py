@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+流水线执行模式测试
+验证 DAG 校验、步骤输出传递、独立步骤并发执行，以及流水线模式只调用三次 LLM
+"""
+
+import asyncio
+import time
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam
+from src.observability import observability
+from src.pipeline import AgentPipeline, PipelineStep
+
+class EchoAgent:
+    """回显提示词的最小 Agent，可设置响应延迟"""
+
+    def __init__(self, name: str, delay: float = 0):
+        self.name = name
+        self.delay = delay
+        self.prompts = []
+
+    async def a_generate_reply(self, messages=None, sender=None):
+        self.prompts.append(messages[-1]["content"])
+        await asyncio.sleep(self.delay)
+        return {"content": f"{self.name}: {messages[-1]['content']}"}
+
+def test_dag_validation():
+    """重复步骤名、未定义的依赖和循环依赖在构建时报错"""
+    def step(name, *deps):
+        return PipelineStep(name=name, agent="a", prompt="{query}", depends_on=list(deps))
+
+    order = AgentPipeline([step("c", "a", "b"), step("b", "a"), step("a")]).order
+    assert [s.name for s in order] == ["a", "b", "c"]
+
+    for steps, message in [
+        ([step("a"), step("a")], "重复"),
+        ([step("a", "missing")], "未定义"),
+        ([step("a", "b"), step("b", "a")], "循环"),
+    ]:
+        try:
+            AgentPipeline(steps)
+        except ValueError as e:
+            assert message in str(e)
+        else:
+            raise AssertionError(f"应当报错: {message}")
+
+def test_outputs_passed_and_independent_steps_concurrent():
+    """下游步骤拿到上游输出，没有依赖关系的步骤并发执行"""
+    agents = {"a": EchoAgent("A", delay=0.2), "b": EchoAgent("B", delay=0.2), "c": EchoAgent("C")}
+    pipeline = AgentPipeline([
+        PipelineStep(name="left", agent="a", prompt="左 {query}"),
+        PipelineStep(name="right", agent="b", prompt="右 {query}"),
+        PipelineStep(name="join", agent="c", prompt="{left} | {right}", depends_on=["left", "right"]),
+    ])
+
+    start = time.monotonic()
+    outputs = asyncio.run(pipeline.run(agents, "储能"))
+    assert time.monotonic() - start < 0.35
+    assert outputs["join"] == "C: A: 左 储能 | B: 右 储能"
+
+def test_one_span_per_step():
+    """每个步骤创建一个 span"""
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    saved = observability.tracer, observability._initialized
+    observability.tracer, observability._initialized = provider.get_tracer(__name__), True
+    try:
+        agents = {"a": EchoAgent("A"), "b": EchoAgent("B")}
+        pipeline = AgentPipeline([
+            PipelineStep(name="first", agent="a", prompt="{query}"),
+            PipelineStep(name="second", agent="b", prompt="{first}", depends_on=["first"]),
+        ])
+        asyncio.run(pipeline.run(agents, "储能"))
+    finally:
+        observability.tracer, observability._initialized = saved
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert set(spans) == {"pipeline_step.first", "pipeline_step.second"}
+    assert spans["pipeline_step.second"].attributes["pipeline.depends_on"] == "first"
+
+def test_pipeline_mode_costs_three_completions():
+    """流水线模式（默认不拆分研究子问题）只调用研究员、分析师和写作专家各一次，不经过群聊"""
+    with offline_config() as config:
+        config.agent.execution_mode = "pipeline"
+        team = MarketAnalysisTeam()
+        clients = install_fake_llm(team)
+        result = asyncio.run(team.analyze_market("分析中国储能市场"))
+
+        assert {key: len(c.calls) for key, c in clients.items()} == {
+            "researcher": 1, "analyst": 1, "writer": 1, "corrector": 0,
+        }
+        assert team.group_chat.messages == []
+        assert result.content.startswith("BusinessWriter 的分析结论")
+
+        writer_prompt = clients["writer"].calls[0][-1]["content"]
+        assert "MarketResearcher 的分析结论" in writer_prompt
+        assert "StrategyAnalyst 的分析结论" in writer_prompt
+        assert "下一步行动计划" in writer_prompt
+
+if __name__ == "__main__":
+    test_dag_validation()
+    test_outputs_passed_and_independent_steps_concurrent()
+    test_one_span_per_step()
+    test_pipeline_mode_costs_three_completions()
+    print("✅ 流水线执行模式测试通过")
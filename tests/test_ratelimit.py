@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+共享限流器测试
+验证令牌桶节流、AIMD 并发控制、Retry-After 冷却以及在 LLM 和审核调用中的接入
+"""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from tests.fake_llm import offline_config, install_fake_llm
+from tests.moderation_stub import moderation_service
+from src.ratelimit import TokenBucket, RateLimiter, AdaptiveConcurrencyLimiter, rate_limiters
+from src.safety import SafetyManager
+from src.agents import MarketAnalysisTeam
+
+class RateLimitError(Exception):
+    """模拟 SDK 抛出的 429 错误"""
+    status_code = 429
+
+    def __init__(self, retry_after: str):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers={"retry-after": retry_after})
+
+def test_token_bucket_wait_times():
+    """令牌用完后按补充速率计算等待时间，实际用量可以修正预留"""
+    bucket = TokenBucket(capacity=10, refill_per_second=100)
+    assert bucket.reserve(10) == 0
+    assert abs(bucket.reserve(5) - 0.05) < 0.01
+    bucket.adjust(-10)  # 退还多预留的令牌
+    assert bucket.reserve(4) < 0.01
+
+def test_rpm_throttles_after_burst():
+    """突发额度用完后按 RPM 速率放行"""
+    limiter = RateLimiter("test", rpm=600, tpm=0, max_concurrency=4)
+    for _ in range(600):
+        assert limiter.acquire() == 0
+        limiter.release()
+
+    start = time.monotonic()
+    limiter.acquire()
+    limiter.release()
+    assert 0.05 < time.monotonic() - start < 0.3
+
+def test_concurrency_cap_and_aimd():
+    """并发不超过上限；429 时上限减半，成功后逐步恢复"""
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=3, max_limit=3)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def worker():
+        limiter.acquire()
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        limiter.release()
+        limiter.on_success()
+
+    threads = [threading.Thread(target=worker) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 3
+
+    limiter.on_rate_limited()
+    assert limiter.limit == 1.5
+    limiter.on_success()
+    assert int(limiter.limit) == 2
+    limiter.on_success()
+    assert int(limiter.limit) == 2
+
+def test_retry_after_cooldown():
+    """收到 429 后所有调用按 Retry-After 等待"""
+    limiter = RateLimiter("test", rpm=0, tpm=0, max_concurrency=4)
+
+    async def main():
+        try:
+            async with limiter.async_limit():
+                raise RateLimitError("0.2")
+        except RateLimitError:
+            pass
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.acquire_async() for _ in range(2)))
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(main())
+    assert 0.15 < elapsed < 0.5
+    assert limiter.rate_limited == 1
+    assert int(limiter.concurrency.limit) == 2
+
+def test_moderation_429_feeds_limiter():
+    """审核服务返回 429 时共享限流器进入冷却"""
+    with offline_config() as config, moderation_service(fail=True, fail_status=429, retry_after=0.3):
+        config.security.moderation_max_retries = 0
+        manager = SafetyManager()
+        asyncio.run(manager.moderate_content("市场报告"))
+
+        stats = rate_limiters.get_stats()["openai/moderation"]
+        assert stats["requests"] == 1
+        assert stats["rate_limited"] == 1
+
+        start = time.monotonic()
+        asyncio.run(manager.moderate_content("另一份报告"))
+        assert time.monotonic() - start > 0.2
+
+def test_llm_calls_share_limiter():
+    """团队中所有 Agent 的 LLM 调用共用同一个 provider/model 限流器"""
+    with offline_config() as config:
+        team = MarketAnalysisTeam()
+        clients = install_fake_llm(team)
+        asyncio.run(team.analyze_market("分析中国电动汽车市场的发展趋势和投资机会"))
+
+        calls = sum(len(c.calls) for c in clients.values())
+        stats = rate_limiters.get_stats()[f"openai/{config.llm.default_model}"]
+        assert stats["requests"] == calls
+        assert stats["in_flight"] == 0
+
+        rate_limiters.reset()
+        config.rate_limit.enable_rate_limiting = False
+        asyncio.run(team.analyze_market("分析中国储能市场"))
+        assert rate_limiters.get_stats() == {}
+
+if __name__ == "__main__":
+    test_token_bucket_wait_times()
+    test_rpm_throttles_after_burst()
+    test_concurrency_cap_and_aimd()
+    test_retry_after_cooldown()
+    test_moderation_429_feeds_limiter()
+    test_llm_calls_share_limiter()
+    print("✅ 共享限流器测试通过")
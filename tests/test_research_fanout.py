@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+研究子问题并发测试
+验证查询拆分规则、研究分支并发执行以及分支结果合并后交给战略分析师
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam
+from src.pipeline import decompose_query
+
+def test_decompose_query():
+    """按"的"之后的并列成分拆分，不足时用未覆盖的研究维度补齐"""
+    with offline_config() as config:
+        config.agent.research_dimensions = ["市场规模与增长", "政策与监管环境", "竞争格局与主要参与者"]
+        assert decompose_query("评估人工智能芯片行业的竞争格局和技术发展方向", 3) == [
+            "人工智能芯片行业的竞争格局",
+            "人工智能芯片行业的技术发展方向",
+            "人工智能芯片行业的市场规模与增长",
+        ]
+        assert decompose_query("分析新能源储能技术的市场潜力和政策影响", 2) == [
+            "新能源储能技术的市场潜力",
+            "新能源储能技术的政策影响",
+        ]
+        assert decompose_query("储能市场", 2) == ["储能市场：市场规模与增长", "储能市场：政策与监管环境"]
+        # 没有 "的" 的问句去掉疑问词和标点后整体作为研究对象
+        assert decompose_query("AI芯片市场前景如何？", 2) == ["AI芯片市场前景：市场规模与增长", "AI芯片市场前景：政策与监管环境"]
+        assert len(decompose_query("分析中国电动汽车市场的发展趋势和投资机会", 1)) == 1
+
+def test_pipeline_fanout_width():
+    """拆分宽度决定研究分支数，宽度为 1 时只有一个研究步骤"""
+    with offline_config() as config:
+        config.agent.research_fanout_width = 3
+        team = MarketAnalysisTeam()
+        pipeline = team.build_pipeline("分析中国电动汽车市场的发展趋势和投资机会")
+        assert [s.name for s in pipeline.order] == ["research_1", "research_2", "research_3", "analysis", "report"]
+        assert pipeline.steps["analysis"].depends_on == ["research_1", "research_2", "research_3"]
+
+        config.agent.research_fanout_width = 1
+        pipeline = team.build_pipeline("分析中国电动汽车市场的发展趋势和投资机会")
+        assert [s.name for s in pipeline.order] == ["research", "analysis", "report"]
+
+def test_research_branches_run_concurrently():
+    """研究阶段耗时接近最慢的分支，分析师看到所有分支的结果"""
+    def reply(agent_name, messages):
+        prompt = messages[-1]["content"]
+        if agent_name == "MarketResearcher":
+            time.sleep(0.3)
+            return "研究发现：" + prompt.split("**子问题:** ")[1].split("\n")[0]
+        return f"{agent_name} 的分析结论：市场保持增长，建议持续关注竞争格局和政策变化。"
+
+    with offline_config() as config:
+        config.agent.execution_mode = "pipeline"
+        config.agent.research_fanout_width = 3
+        query = "评估人工智能芯片行业的竞争格局和技术发展方向"
+        team = MarketAnalysisTeam()
+        clients = install_fake_llm(team, reply_fn=reply)
+
+        start = time.monotonic()
+        result = asyncio.run(team.analyze_market(query))
+        elapsed = time.monotonic() - start
+
+        assert result is not None
+        assert len(clients["researcher"].calls) == 3
+        assert elapsed < 0.3 * 2, f"研究分支被串行执行: {elapsed:.2f}s"
+
+        analyst_prompt = clients["analyst"].calls[0][-1]["content"]
+        for question in decompose_query(query, 3):
+            assert f"研究发现：{question}" in analyst_prompt
+
+if __name__ == "__main__":
+    test_decompose_query()
+    test_pipeline_fanout_width()
+    test_research_branches_run_concurrently()
+    print("✅ 研究子问题并发测试通过")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+分析结果缓存测试
+验证查询规范化、LRU 缓存以及相同查询的并发合并
+"""
+
+import asyncio
+import time
+from tests.fake_llm import install_fake_llm, offline_config
+from src.agents import MarketAnalysisTeam, analysis_result_cache
+from src.cache import LRUCache, canonicalize_query
+
+def test_canonicalize_query():
+    """空白、标点、全角半角和大小写差异不影响规范化结果"""
+    base = canonicalize_query("分析中国电动汽车市场的AI芯片需求")
+    assert canonicalize_query("  分析 中国电动汽车市场的ＡＩ芯片需求？") == base
+    assert canonicalize_query("分析，中国电动汽车市场的ai芯片需求。\n") == base
+    assert canonicalize_query("AI chip, market!") == canonicalize_query("ai  chip market")
+    assert canonicalize_query("ai chip market") != canonicalize_query("aichip market")
+    assert canonicalize_query("分析日本电动汽车市场") != canonicalize_query("分析中国电动汽车市场")
+
+    # 符号和分隔符改变查询含义，不能被去除
+    assert canonicalize_query("营收增长-5%的企业") != canonicalize_query("营收增长5%的企业")
+    assert canonicalize_query("A/B测试工具市场") != canonicalize_query("AB测试工具市场")
+    assert canonicalize_query("增速2.5%") != canonicalize_query("增速25%")
+    assert canonicalize_query("C++开发工具") != canonicalize_query("C开发工具")
+    assert canonicalize_query("增速2.5%。") == canonicalize_query("增速2.5%")
+
+def test_lru_cache_eviction_and_ttl():
+    """超出上限淘汰最久未使用的条目，过期条目不返回"""
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get_stats()["hits"] == 3
+
+    cache = LRUCache(max_entries=2, ttl_seconds=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+def test_identical_queries_coalesced_and_cached():
+    """并发的等价查询只运行一次群聊，之后的查询直接命中结果缓存"""
+    with offline_config(enable_result_cache=True):
+        analysis_result_cache.clear()
+
+        def slow_reply(agent_name, messages):
+            time.sleep(0.02)
+            return f"{agent_name} 的分析结论：储能市场需求持续增长，建议关注成本下降曲线。"
+
+        teams = [MarketAnalysisTeam() for _ in range(4)]
+        clients = [install_fake_llm(team, reply_fn=slow_reply) for team in teams]
+        queries = ["分析新能源储能技术的市场潜力", "分析新能源储能技术的市场潜力？", " 分析新能源储能技术的 市场潜力 "]
+
+        async def main():
+            return await asyncio.gather(*(
+                team.analyze_market(query) for team, query in zip(teams, queries)
+            ))
+
+        results = asyncio.run(main())
+        calls = [sum(len(c.calls) for c in team_clients.values()) for team_clients in clients]
+        assert sum(1 for n in calls[:3] if n > 0) == 1, f"群聊运行了多次: {calls}"
+        assert all(r is not None and r.content == results[0].content for r in results)
+        # 每个调用方拿到独立的副本
+        assert len({id(r) for r in results}) == 3
+
+        cached = asyncio.run(teams[3].analyze_market("分析新能源储能技术的市场潜力!"))
+        assert cached.content == results[0].content
+        assert sum(len(c.calls) for c in clients[3].values()) == 0
+
+        analysis_result_cache.clear()
+
+if __name__ == "__main__":
+    test_canonicalize_query()
+    test_lru_cache_eviction_and_ttl()
+    test_identical_queries_coalesced_and_cached()
+    print("✅ 分析结果缓存测试通过")
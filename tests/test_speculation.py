@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+推测执行测试
+验证研究员的数据部分完成后即启动战略分析师、研究结果有实质变化时重新分析，以及命中率统计
+"""
+
+import asyncio
+import time
+from tests.fake_llm import FakeLLMClient, offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam
+from src.pipeline import speculation_stats, _differs_materially
+
+DATA = "## 市场数据\n2024 年中国储能新增装机 40GW，同比增长 80%。\n"
+RESEARCH = DATA + "## 趋势分析\n工商业储能需求快速增长。\n## 竞争环境\n头部企业市场份额集中。"
+
+def speculative_reply(agent_name, messages):
+    if agent_name == "MarketResearcher":
+        return RESEARCH
+    if agent_name == "StrategyAnalyst":
+        time.sleep(0.2)
+    return f"{agent_name} 的分析结论：市场保持增长，建议持续关注竞争格局和政策变化。"
+
+def speculative_team(config):
+    config.agent.execution_mode = "pipeline"
+    config.agent.research_fanout_width = 1
+    config.agent.enable_speculative_analysis = True
+    speculation_stats.reset()
+    return MarketAnalysisTeam()
+
+def test_differs_materially():
+    """最终结果只是在已读部分之后追加内容时不算实质变化"""
+    assert not _differs_materially(DATA, RESEARCH)
+    assert not _differs_materially(DATA, DATA.replace("80%", "81%") + "## 趋势分析")
+    assert _differs_materially(DATA, "## 市场数据\n2024 年储能装机规模统计口径调整，暂无可靠数据。\n")
+
+def test_pipeline_steps_speculative():
+    """开启推测执行时研究步骤带就绪点，分析步骤可推测执行"""
+    with offline_config() as config:
+        team = speculative_team(config)
+        pipeline = team.build_pipeline("分析中国储能市场")
+        assert pipeline.steps["research"].partial_ready == config.agent.speculation_trigger
+        assert "## 市场数据" in pipeline.steps["research"].prompt
+        assert pipeline.steps["analysis"].speculative
+
+        config.agent.enable_speculative_analysis = False
+        pipeline = team.build_pipeline("分析中国储能市场")
+        assert pipeline.steps["research"].partial_ready is None
+        assert not pipeline.steps["analysis"].speculative
+
+def test_speculation_hit():
+    """数据部分完成后分析师即开始工作，研究结果没有变化时不重新分析"""
+    with offline_config() as config:
+        team = speculative_team(config)
+        clients = install_fake_llm(team, reply_fn=speculative_reply, chunk_size=4, chunk_delay=0.02)
+        result = asyncio.run(team.analyze_market("分析中国储能市场"))
+
+        assert result is not None
+        assert len(clients["analyst"].calls) == 1
+        analyst_prompt = clients["analyst"].calls[0][-1]["content"]
+        assert "40GW" in analyst_prompt
+        assert "头部企业" not in analyst_prompt
+
+        stats = team.get_conversation_summary()["speculation"]["analysis"]
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 0, 1.0)
+        assert stats["saved_seconds"] > 0.1
+
+def test_speculation_miss():
+    """研究员重试后数据部分发生变化，放弃推测结果并基于最终研究结果重新分析"""
+    revised = RESEARCH.replace("40GW，同比增长 80%", "35GW，口径调整后同比增长 45%")
+
+    class FlakyResearcher(FakeLLMClient):
+        """第一次流式输出数据部分后连接中断，重试时给出修订后的数据"""
+
+        def create(self, **params):
+            if not self.calls:
+                self.calls.append([dict(m) for m in params["messages"]])
+                self._print_chunks(DATA + "## 趋势分析\n")
+                raise TimeoutError("stream interrupted")
+            return super().create(**params)
+
+    with offline_config() as config:
+        config.llm.retry_base_delay = 0.01
+        team = speculative_team(config)
+        clients = install_fake_llm(team, reply_fn=speculative_reply)
+        team.agents["researcher"].client = FlakyResearcher(
+            "MarketResearcher", reply_fn=lambda name, messages: revised, chunk_size=4, chunk_delay=0.01,
+        )
+        result = asyncio.run(team.analyze_market("分析中国储能市场"))
+
+        assert result is not None
+        assert len(clients["analyst"].calls) == 2
+        assert "40GW" in clients["analyst"].calls[0][-1]["content"]
+        assert "35GW" in clients["analyst"].calls[1][-1]["content"]
+
+        stats = speculation_stats.get_stats()["analysis"]
+        assert (stats["hits"], stats["misses"], stats["miss_rate"]) == (0, 1, 1.0)
+        assert stats["wasted_tokens"] > 0
+
+def test_not_triggered_without_data_section():
+    """研究输出中没有就绪点时分析师等待研究完成"""
+    with offline_config() as config:
+        team = speculative_team(config)
+        clients = install_fake_llm(team, chunk_size=4)
+        asyncio.run(team.analyze_market("分析中国储能市场"))
+
+        assert len(clients["analyst"].calls) == 1
+        assert "MarketResearcher 的分析结论" in clients["analyst"].calls[0][-1]["content"]
+        stats = speculation_stats.get_stats()["analysis"]
+        assert (stats["runs"], stats["not_triggered"], stats["hit_rate"]) == (1, 1, 0.0)
+
+def test_skipped_when_researcher_cannot_stream():
+    """研究员路由到不支持流式输出的客户端时不启用推测执行，而不是每次都记为未触发"""
+    with offline_config() as config:
+        team = speculative_team(config)
+        clients = install_fake_llm(team, reply_fn=speculative_reply)
+        assert team.agents["researcher"].supports_streaming()
+        team.agents["researcher"].llm_config["config_list"][0]["api_type"] = "anthropic"
+        assert not team.agents["researcher"].supports_streaming()
+
+        pipeline = team.build_pipeline("分析中国储能市场")
+        assert pipeline.steps["research"].partial_ready is None
+        assert not pipeline.steps["analysis"].speculative
+
+        assert asyncio.run(team.analyze_market("分析中国储能市场")) is not None
+        assert len(clients["analyst"].calls) == 1
+        assert speculation_stats.get_stats().get("analysis", {}).get("runs", 0) == 0
+
+if __name__ == "__main__":
+    test_differs_materially()
+    test_pipeline_steps_speculative()
+    test_speculation_hit()
+    test_speculation_miss()
+    test_not_triggered_without_data_section()
+    test_skipped_when_researcher_cannot_stream()
+    print("✅ 推测执行测试通过")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+流式分析测试
+验证事件顺序、token 增量拼接为完整发言、首个 token 在发言结束前送达，以及非流式调用不受影响
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config, install_fake_llm
+from src.agents import MarketAnalysisTeam
+from src.streaming import AnalysisEventType
+
+async def collect(team, query="分析中国储能市场"):
+    """收集全部事件，同时记录每个事件的接收时间"""
+    events = []
+    async for event in team.analyze_market_stream(query):
+        events.append((time.monotonic(), event))
+    return events
+
+def tokens_by_turn(events):
+    turns = {}
+    for _, event in events:
+        if event.type == AnalysisEventType.TOKEN:
+            turns[event.turn] = turns.get(event.turn, "") + event.content
+    return turns
+
+def test_group_chat_event_sequence():
+    """每次发言依次产生开始、token 和结束事件，验证结果在最终输出之前"""
+    with offline_config():
+        team = MarketAnalysisTeam()
+        install_fake_llm(team)
+        events = asyncio.run(collect(team))
+
+        types = [event.type for _, event in events]
+        assert types[-2:] == [AnalysisEventType.VALIDATION, AnalysisEventType.FINAL]
+        assert events[-2][1].metadata["passed"] is True
+
+        finished = [event for _, event in events if event.type == AnalysisEventType.TURN_FINISHED]
+        assert [event.agent for event in finished] == ["MarketResearcher", "StrategyAnalyst", "BusinessWriter"]
+        # token 增量拼接后与完整发言一致，且不含终端颜色控制序列
+        tokens = tokens_by_turn(events)
+        for event in finished:
+            assert tokens[event.turn] == event.content
+
+        started = [event.turn for _, event in events if event.type == AnalysisEventType.TURN_STARTED]
+        assert started == [event.turn for event in finished]
+        assert events[-1][1].output.content == finished[-1].content
+
+def test_first_token_before_turn_finishes():
+    """第一个 token 在研究员发言结束之前送达"""
+    with offline_config():
+        team = MarketAnalysisTeam()
+        install_fake_llm(team, chunk_size=4, chunk_delay=0.02)
+        events = asyncio.run(collect(team))
+
+        first_token = next(t for t, e in events if e.type == AnalysisEventType.TOKEN)
+        first_finished = next(t for t, e in events if e.type == AnalysisEventType.TURN_FINISHED)
+        assert first_finished - first_token > 0.2
+
+def test_pipeline_concurrent_turns():
+    """流水线并发研究时，各分支的 token 按发言编号区分"""
+    with offline_config() as config:
+        config.agent.execution_mode = "pipeline"
+        config.agent.research_fanout_width = 3
+        team = MarketAnalysisTeam()
+        install_fake_llm(team, chunk_size=4, chunk_delay=0.01)
+        events = asyncio.run(collect(team, "评估人工智能芯片行业的竞争格局和技术发展方向"))
+
+        finished = [event for _, event in events if event.type == AnalysisEventType.TURN_FINISHED]
+        assert len({event.turn for event in finished}) == 5
+        tokens = tokens_by_turn(events)
+        for event in finished:
+            assert tokens[event.turn] == event.content
+        assert events[-1][1].output is not None
+
+def test_analyze_market_does_not_stream():
+    """不通过流式接口调用时，LLM 请求不开启流式输出"""
+    with offline_config():
+        team = MarketAnalysisTeam()
+        clients = install_fake_llm(team)
+        result = asyncio.run(team.analyze_market("分析中国储能市场"))
+
+        assert result is not None
+        assert all(client.stream_requests == 0 for client in clients.values())
+
+if __name__ == "__main__":
+    test_group_chat_event_sequence()
+    test_first_token_before_turn_finishes()
+    test_pipeline_concurrent_turns()
+    test_analyze_market_does_not_stream()
+    print("✅ 流式分析测试通过")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+团队状态重置测试
+验证复用同一个 MarketAnalysisTeam 时每次查询的提示词大小保持不变
+"""
+
+import asyncio
+from tests.fake_llm import install_fake_llm, offline_config
+from src.agents import MarketAnalysisTeam
+
+def _run_batch(team, clients, queries):
+    """依次执行查询，返回每个查询的提示词总字符数和对话历史长度"""
+    per_query = []
+    history_sizes = []
+    for query in queries:
+        before = sum(len(c.calls) for c in clients.values())
+        before_sizes = {k: len(c.calls) for k, c in clients.items()}
+        result = asyncio.run(team.analyze_market(query))
+        assert result is not None
+        assert sum(len(c.calls) for c in clients.values()) > before
+        per_query.append(sum(
+            sum(c.prompt_sizes()[before_sizes[k]:]) for k, c in clients.items()
+        ))
+        history_sizes.append(sum(
+            len(agent.conversation_history)
+            for agent in team.agents.values() if hasattr(agent, "conversation_history")
+        ))
+    return per_query, history_sizes
+
+def test_prompt_size_flat_across_batch():
+    """长批次中每个查询的提示词大小保持平稳"""
+    with offline_config():
+        team = MarketAnalysisTeam()
+        clients = install_fake_llm(team)
+
+        queries = ["分析中国电动汽车市场的发展趋势和投资机会"] * 6
+        sizes, history_sizes = _run_batch(team, clients, queries)
+
+        assert len(set(sizes)) == 1, f"提示词大小随查询增长: {sizes}"
+        # 对话历史只保留最近一次分析
+        assert len(set(history_sizes)) == 1, f"对话历史随查询增长: {history_sizes}"
+
+def test_reset_clears_conversation_state():
+    """reset() 清空群聊消息和各 Agent 的聊天记录，但保留 Agent 对象"""
+    with offline_config():
+        team = MarketAnalysisTeam()
+        install_fake_llm(team)
+        agents_before = dict(team.agents)
+
+        asyncio.run(team.analyze_market("评估人工智能芯片行业的竞争格局"))
+        assert team.group_chat.messages
+
+        team.reset()
+        assert team.group_chat.messages == []
+        assert team.manager.round_count == 0
+        for key, agent in team.agents.items():
+            assert agent is agents_before[key]
+            assert not any(agent.chat_messages.values())
+            if hasattr(agent, "conversation_history"):
+                assert agent.conversation_history == []
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+自修复验证循环测试
+验证内容审核与格式验证并发执行，格式失败时不等待审核结果
+"""
+
+import asyncio
+import time
+from tests.fake_llm import offline_config
+from tests.moderation_stub import moderation_service
+from src.safety import SafetyManager, OutputValidator
+
+VALID_REPORT = "执行摘要：储能市场保持高速增长，建议优先布局工商业储能。"
+
+def test_format_failure_does_not_wait_for_moderation():
+    """格式验证失败时立即进入修正，不等待慢速的审核请求"""
+    with offline_config(), moderation_service(delay=lambda inputs: 0.01 if VALID_REPORT in inputs else 1.0) as stub:
+        validator = OutputValidator(SafetyManager())
+        corrections = []
+
+        async def fix(output, reason):
+            corrections.append(reason)
+            return VALID_REPORT
+
+        start = time.monotonic()
+        result = asyncio.run(validator.validate_with_correction(
+            '{"content": 缺少引号}', "Writer", correction_callback=fix
+        ))
+        elapsed = time.monotonic() - start
+
+        assert result is not None and result.content == VALID_REPORT
+        assert corrections == ["输出格式不符合要求，请重新生成结构化内容"]
+        assert elapsed < 0.8, f"格式失败后仍在等待审核: {elapsed:.2f}s"
+
+def test_unrecoverable_output_fails_fast():
+    """没有修正回调时不再重复相同的检查"""
+    with offline_config(), moderation_service(delay=1.0):
+        validator = OutputValidator(SafetyManager())
+
+        start = time.monotonic()
+        assert asyncio.run(validator.validate_with_correction("太短", "Writer")) is None
+        assert asyncio.run(validator.validate_with_correction('{"a": 缺少引号}', "Writer")) is None
+        assert time.monotonic() - start < 0.8
+
+def test_flagged_content_corrected_and_rechecked():
+    """审核不通过时修正内容，修正后的内容重新审核"""
+    with offline_config(), moderation_service() as stub:
+        validator = OutputValidator(SafetyManager())
+
+        async def fix(output, reason):
+            assert reason.startswith("内容安全检查失败")
+            return VALID_REPORT
+
+        result = asyncio.run(validator.validate_with_correction(
+            "这份报告包含违规内容，需要重新撰写。", "Writer", correction_callback=fix
+        ))
+        assert result.content == VALID_REPORT
+        assert stub.inputs == ["这份报告包含违规内容，需要重新撰写。", VALID_REPORT]
+
+if __name__ == "__main__":
+    test_format_failure_does_not_wait_for_moderation()
+    test_unrecoverable_output_fails_fast()
+    test_flagged_content_corrected_and_rechecked()
+    print("✅ 自修复验证循环测试通过")